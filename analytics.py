@@ -0,0 +1,226 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  SALES ANALYTICS
+#  Closed orders are folded into the rollup tables (see tables.py) as they close, so reports for any date range read a
+#  a few rows per hour (orders) or day (items, mods) instead of scanning order_item.
+# ---------------------------------------------------------------------------------------------------------------------
+from sqlalchemy import func, insert, select, case, cast
+from sqlalchemy.exc import IntegrityError
+from tables import db, sortable_timestamp, User, MenuItem, ItemModVar, Category, Section, Table, Order, OrderItem, \
+    OrderRollup, SalesRollup, ModRollup, PopularityRollup, order_item__var
+from datetime import datetime, timedelta
+
+ROLLUPS = (OrderRollup, SalesRollup, ModRollup, PopularityRollup)
+
+DIMENSIONS = {
+    # name: (rollup, key column, label lookup)
+    'hour': (OrderRollup, OrderRollup.hour, None),
+    'day': (OrderRollup, func.substr(OrderRollup.hour, 1, 10), None),
+    'server': (OrderRollup, OrderRollup.user_id, User.full_name),
+    'table': (OrderRollup, OrderRollup.table_id, Table.name),
+    'category': (SalesRollup, SalesRollup.category_id, Category.name),
+    'section': (SalesRollup, SalesRollup.section_id, Section.name),
+    'item': (SalesRollup, SalesRollup.item_id, MenuItem.name),
+}
+
+# parts of the day for PopularityRollup, by the hour they end at; hours past the last one count as "late"
+DAYPARTS = [('late', 5), ('morning', 11), ('lunch', 15), ('afternoon', 17), ('dinner', 22)]
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  MAINTAINING ROLLUPS
+# ---------------------------------------------------------------------------------------------------------------------
+def hour_of(timestamp: str):
+    """
+    "%m/%d/%Y %H:%M:%S" -> "%Y-%m-%d %H"
+    """
+    return datetime.strptime(timestamp, "%m/%d/%Y %H:%M:%S").strftime("%Y-%m-%d %H")
+
+
+def daypart_of(hour: int):
+    return next((name for name, end in DAYPARTS if hour < end), 'late')
+
+
+def daypart_column(timestamp_column):
+    """
+    daypart_of() in SQL, for a "%m/%d/%Y %H:%M:%S" column
+    """
+    hour = cast(func.substr(timestamp_column, 12, 2), db.Integer)
+    return case(*[(hour < end, name) for name, end in DAYPARTS], else_='late')
+
+
+def add_to_rollup(rollup, key: dict, amounts: dict, **attributes):
+    """
+    Adds amounts to the rollup row identified by key, creating the row (with attributes) if it doesn't exist yet.
+    The insert runs in a savepoint so that losing a race with another worker falls back to the update.
+    """
+    increments = {column: getattr(rollup, column) + value for column, value in amounts.items()}
+    if db.session.query(rollup).filter_by(**key).update(increments, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(rollup).values(**key, **amounts, **attributes))
+    except IntegrityError:
+        db.session.query(rollup).filter_by(**key).update(increments, synchronize_session=False)
+
+
+def record_closed_order(order: Order):
+    """
+    Used in close_order()
+    Folds a closed order into the rollups. Runs inside the caller's transaction.
+    """
+    hour = hour_of(order.closed_at)
+    day = hour[:10]
+    daypart = daypart_of(int(hour[11:]))
+    add_to_rollup(
+        OrderRollup,
+        {'hour': hour, 'user_id': order.user_id, 'table_id': order.table_id},
+        {'order_count': 1, 'item_count': order.item_count, 'revenue': order.total}
+    )
+
+    item_sales = db.session.query(
+        OrderItem.item_id, MenuItem.category_id, MenuItem.section_id,
+        func.sum(OrderItem.quantity), func.sum(OrderItem.subtotal)
+    ).join(MenuItem, MenuItem.id == OrderItem.item_id) \
+        .filter(OrderItem.order_id == order.id) \
+        .group_by(OrderItem.item_id, MenuItem.category_id, MenuItem.section_id)
+    for item_id, category_id, section_id, quantity, revenue in item_sales:
+        add_to_rollup(
+            SalesRollup,
+            {'day': day, 'item_id': item_id},
+            {'quantity': quantity, 'revenue': revenue},
+            category_id=category_id,
+            section_id=section_id
+        )
+        add_to_rollup(PopularityRollup, {'user_id': order.user_id, 'daypart': daypart, 'item_id': item_id},
+                      {'quantity': quantity})
+
+    mod_sales = db.session.query(
+        OrderItem.item_id, order_item__var.c.var_id, func.sum(OrderItem.quantity)
+    ).join(order_item__var, order_item__var.c.order_item_id == OrderItem.id) \
+        .filter(OrderItem.order_id == order.id) \
+        .group_by(OrderItem.item_id, order_item__var.c.var_id)
+    for item_id, var_id, quantity in mod_sales:
+        add_to_rollup(ModRollup, {'day': day, 'item_id': item_id, 'var_id': var_id}, {'quantity': quantity})
+
+
+def day_filter(column, start: str = None, end: str = None):
+    """
+    conditions keeping column (a "%Y-%m-%d..." string) in [start, end); either end may be left open
+    """
+    conditions = []
+    if start:
+        conditions.append(column >= start)
+    if end:
+        conditions.append(column < end)
+    return conditions
+
+
+def rebuild_rollups(start: str = None, end: str = None):
+    """
+    Recomputes the rollups from order history with one INSERT ... SELECT per rollup table.
+    start and end ("%Y-%m-%d" days, end excluded) limit the rebuild to those days. PopularityRollup isn't kept per
+    day, so only a full rebuild recomputes it.
+    Returns the number of rows written per table.
+    """
+    hour = func.substr(sortable_timestamp(Order.closed_at), 1, 13)
+    day = func.substr(sortable_timestamp(Order.closed_at), 1, 10)
+    closed = [Order.status == 'closed', *day_filter(day, start, end)]
+    days = {
+        OrderRollup: func.substr(OrderRollup.hour, 1, 10),
+        SalesRollup: SalesRollup.day,
+        ModRollup: ModRollup.day,
+        PopularityRollup: None,
+    }
+    rollups = ROLLUPS if not start and not end else (OrderRollup, SalesRollup, ModRollup)
+
+    for rollup in rollups:
+        db.session.query(rollup).filter(*day_filter(days[rollup], start, end)).delete(synchronize_session=False)
+
+    db.session.execute(insert(OrderRollup).from_select(
+        ['hour', 'user_id', 'table_id', 'order_count', 'item_count', 'revenue'],
+        select(hour, Order.user_id, Order.table_id, func.count(Order.id), func.sum(Order.item_count),
+               func.sum(Order.total))
+        .where(*closed)
+        .group_by(hour, Order.user_id, Order.table_id)
+    ))
+    db.session.execute(insert(SalesRollup).from_select(
+        ['day', 'item_id', 'category_id', 'section_id', 'quantity', 'revenue'],
+        select(day, OrderItem.item_id, MenuItem.category_id, MenuItem.section_id, func.sum(OrderItem.quantity),
+               func.sum(OrderItem.subtotal))
+        .join(Order, Order.id == OrderItem.order_id)
+        .join(MenuItem, MenuItem.id == OrderItem.item_id)
+        .where(*closed)
+        .group_by(day, OrderItem.item_id, MenuItem.category_id, MenuItem.section_id)
+    ))
+    db.session.execute(insert(ModRollup).from_select(
+        ['day', 'item_id', 'var_id', 'quantity'],
+        select(day, OrderItem.item_id, order_item__var.c.var_id, func.sum(OrderItem.quantity))
+        .join(Order, Order.id == OrderItem.order_id)
+        .join(order_item__var, order_item__var.c.order_item_id == OrderItem.id)
+        .where(*closed)
+        .group_by(day, OrderItem.item_id, order_item__var.c.var_id)
+    ))
+    if PopularityRollup in rollups:
+        daypart = daypart_column(Order.closed_at)
+        db.session.execute(insert(PopularityRollup).from_select(
+            ['user_id', 'daypart', 'item_id', 'quantity'],
+            select(Order.user_id, daypart, OrderItem.item_id, func.sum(OrderItem.quantity))
+            .join(Order, Order.id == OrderItem.order_id)
+            .where(*closed)
+            .group_by(Order.user_id, daypart, OrderItem.item_id)
+        ))
+    db.session.commit()
+    return {rollup.__tablename__: db.session.query(rollup).filter(*day_filter(days[rollup], start, end)).count()
+            for rollup in rollups}
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  REPORTING
+# ---------------------------------------------------------------------------------------------------------------------
+def date_range(start: str = None, end: str = None):
+    """
+    Turns inclusive "%Y-%m-%d" dates into a [start, end) range that compares correctly against hour and day keys.
+    Defaults to the last 30 days. Raises ValueError for malformed dates.
+    """
+    end_date = datetime.strptime(end, "%Y-%m-%d") if end else datetime.now()
+    start_date = datetime.strptime(start, "%Y-%m-%d") if start else end_date - timedelta(days=29)
+    return start_date.strftime("%Y-%m-%d"), (end_date + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def sales_report(by: str, start: str = None, end: str = None):
+    """
+    Sales for the date range grouped by one of DIMENSIONS.
+    Returns a list of dicts with key, label, quantity (items sold), revenue and, for order-level dimensions, orders.
+    """
+    rollup, key, label = DIMENSIONS[by]
+    range_start, range_end = date_range(start, end)
+    period = rollup.hour if rollup is OrderRollup else rollup.day
+    quantity = rollup.item_count if rollup is OrderRollup else rollup.quantity
+
+    columns = [key.label('key'), func.sum(quantity).label('quantity'), func.sum(rollup.revenue).label('revenue')]
+    if rollup is OrderRollup:
+        columns.append(func.sum(OrderRollup.order_count).label('orders'))
+    query = db.session.query(*columns) \
+        .filter(period >= range_start, period < range_end) \
+        .group_by(key)
+    if label is not None:
+        query = query.outerjoin(label.class_, label.class_.id == key).add_columns(label.label('label')) \
+            .group_by(label)
+    rows = [dict(row._mapping) for row in query.order_by(key)]
+    for row in rows:
+        row.setdefault('label', row['key'])
+    return rows
+
+
+def modifier_report(start: str = None, end: str = None):
+    """
+    Most ordered vars for the date range, most popular first
+    """
+    range_start, range_end = date_range(start, end)
+    query = db.session.query(
+        ModRollup.var_id.label('key'), ItemModVar.name.label('label'), func.sum(ModRollup.quantity).label('quantity')
+    ).outerjoin(ItemModVar, ItemModVar.id == ModRollup.var_id) \
+        .filter(ModRollup.day >= range_start, ModRollup.day < range_end) \
+        .group_by(ModRollup.var_id, ItemModVar.name) \
+        .order_by(func.sum(ModRollup.quantity).desc())
+    return [dict(row._mapping) for row in query]
@@ -0,0 +1,68 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  STATIC ASSETS & TEMPLATE CACHE
+#  static_url() adds a hash of the file's contents to static URLs (/static/styles.css?v=3f2a9c1e0b7d), so a versioned
+#  URL can be cached by the browser for a year and a changed file simply gets a new URL.
+#  Compiled templates are written to a bytecode cache on disk, which `flask warm-templates` fills at deploy time so a
+#  new worker loads templates instead of compiling them on its first requests.
+# ---------------------------------------------------------------------------------------------------------------------
+from flask import current_app, request, url_for
+from jinja2 import FileSystemBytecodeCache
+import hashlib
+import os
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+_hashes = {}
+
+
+def file_hash(path: str):
+    """
+    first 12 hex digits of the md5 of the file, cached per path and modification time
+    """
+    modified = os.path.getmtime(path)
+    cached = _hashes.get(path)
+    if not cached or cached[0] != modified:
+        with open(path, 'rb') as file:
+            cached = (modified, hashlib.md5(file.read()).hexdigest()[:12])
+        _hashes[path] = cached
+    return cached[1]
+
+
+def static_url(filename: str):
+    """
+    url_for('static') with a content hash, available in templates as static_url('styles.css')
+    """
+    path = os.path.join(current_app.static_folder, filename)
+    return url_for('static', filename=filename, v=file_hash(path))
+
+
+def cache_versioned_static(response):
+    """
+    after_request hook: versioned static files never change, so they may be cached for good
+    unversioned requests keep Flask's default of revalidating with Last-Modified/ETag
+    """
+    if request.endpoint == 'static' and 'v' in request.args and response.status_code == 200:
+        response.cache_control.public = True
+        response.cache_control.max_age = ONE_YEAR
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def template_cache(app):
+    """
+    compiled templates are kept in TEMPLATE_CACHE_DIR (instance/jinja-cache by default)
+    """
+    directory = app.config.get('TEMPLATE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja-cache')
+    os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory)
+
+
+def warm_templates(app):
+    """
+    compiles every template into the bytecode cache, returns the names
+    """
+    names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
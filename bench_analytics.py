@@ -0,0 +1,105 @@
+"""
+Benchmark: sales reports from rollups vs scanning order_item
+usage: python bench_analytics.py [--items 1000000]
+
+Builds a throwaway SQLite database with synthetic closed orders spread over a year, rebuilds the rollups and times the
+same report answered both ways.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--items', type=int, default=1_000_000, help='number of synthetic order_item rows')
+args = parser.parse_args()
+
+db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DB_URL'] = f'sqlite:///{db_file}'
+
+from sqlalchemy import func  # noqa: E402
+import main  # noqa: E402
+from tables import db, sortable_timestamp, User, MenuItem, ItemModVar, Category, Section, Table, Order, \
+    OrderItem, order_item__var  # noqa: E402
+from analytics import rebuild_rollups, sales_report, modifier_report  # noqa: E402
+
+
+def timed(label, function, *function_args):
+    start = time.perf_counter()
+    result = function(*function_args)
+    print(f"{label:<45} {(time.perf_counter() - start) * 1000:>10.1f} ms")
+    return result
+
+
+def scan_report(start: str, end: str):
+    """
+    the same "sales by item" answer computed from raw order_item rows
+    """
+    closed_at = sortable_timestamp(Order.closed_at)
+    return db.session.query(OrderItem.item_id, func.sum(OrderItem.quantity), func.sum(OrderItem.subtotal)) \
+        .join(Order, Order.id == OrderItem.order_id) \
+        .filter(Order.status == 'closed', closed_at >= start, closed_at < end) \
+        .group_by(OrderItem.item_id).all()
+
+
+def seed(item_count: int):
+    random.seed(1)
+    engine = db.engine
+    engine.execute(User.__table__.insert(), [
+        {'id': i, 'full_name': f'Server {i}', 'email': f's{i}@mail.com', 'password': '-', 'status': 'active'}
+        for i in range(1, 11)])
+    engine.execute(Table.__table__.insert(), [{'id': i, 'name': f'Table {i}', 'status': 'available'}
+                                              for i in range(1, 31)])
+    engine.execute(Category.__table__.insert(), [{'id': i, 'name': f'CATEGORY {i}'} for i in range(1, 6)])
+    engine.execute(Section.__table__.insert(), [{'id': i, 'name': f'Section {i}', 'category_id': (i - 1) // 3 + 1}
+                                                for i in range(1, 16)])
+    engine.execute(MenuItem.__table__.insert(), [
+        {'id': i, 'name': f'Item {i}', 'price': random.randint(3, 40), 'status': 'active',
+         'section_id': (i - 1) % 15 + 1, 'category_id': ((i - 1) % 15) // 3 + 1} for i in range(1, 201)])
+    engine.execute(ItemModVar.__table__.insert(), [{'id': i, 'name': f'Var {i}'} for i in range(1, 31)])
+
+    first_day = datetime.now() - timedelta(days=365)
+    orders, order_items, item_vars = [], [], []
+    order_id = 0
+    while len(order_items) < item_count:
+        order_id += 1
+        closed_at = (first_day + timedelta(minutes=random.randint(0, 365 * 24 * 60))).strftime("%m/%d/%Y %H:%M:%S")
+        total = item_total = 0
+        for _ in range(random.randint(1, 7)):
+            quantity, price = random.randint(1, 3), random.randint(3, 40)
+            order_items.append({'id': len(order_items) + 1, 'order_id': order_id, 'item_id': random.randint(1, 200),
+                                'quantity': quantity, 'subtotal': quantity * price})
+            if random.random() < 0.3:
+                item_vars.append({'order_item_id': len(order_items), 'var_id': random.randint(1, 30)})
+            total += quantity * price
+            item_total += quantity
+        orders.append({'id': order_id, 'customer_name': 'Guest', 'status': 'closed', 'created_at': closed_at,
+                       'closed_at': closed_at, 'total': total, 'item_count': item_total,
+                       'table_id': random.randint(1, 30), 'user_id': random.randint(1, 10)})
+
+    engine.execute(Order.__table__.insert(), orders)
+    engine.execute(OrderItem.__table__.insert(), order_items)
+    engine.execute(order_item__var.insert(), item_vars)
+    return len(orders), len(order_items)
+
+
+app = main.create_app()
+with app.app_context():
+    db.create_all()
+    order_total, item_total = timed(f'seed {args.items:,} line items', seed, args.items)
+    print(f"{order_total:,} orders, {item_total:,} line items")
+    timed('rebuild rollups', rebuild_rollups)
+
+    end = datetime.now().strftime("%Y-%m-%d")
+    start = (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
+    month = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    next_day = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+    for label, range_start in [('year', start), ('30 days', month)]:
+        timed(f'sales by item, {label}, order_item scan', scan_report, range_start, next_day)
+        for by in ['item', 'day', 'server', 'category']:
+            timed(f'sales by {by}, {label}, rollups', sales_report, by, range_start, end)
+        timed(f'modifiers, {label}, rollups', modifier_report, range_start, end)
+
+os.remove(db_file)
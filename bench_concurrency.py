@@ -0,0 +1,257 @@
+"""
+Benchmark: concurrent order entry under gunicorn, sync workers vs threaded (gthread) workers
+usage: python bench_concurrency.py [--clients 16] [--seconds 15] [--workers 2] [--threads 8] [--logins 2]
+
+Seeds a throwaway SQLite database (or the one in DB_URL) with the sample menu and one server per client, then starts
+gunicorn with gunicorn.conf.py once per worker class. Each client has its own cookie jar, logs in as its server and
+loops: start a take-out order -> add items -> submit -> close. --logins more clients keep logging in and out, so
+password hashing competes with order entry.
+
+Every page is checked against the client's own order (customer name, order number in the flash message), and
+afterwards every order is checked in the database against what its client entered, so a session, flash message or
+db.session leaking between requests shows up as a failure (exit code 1). Prints orders/s, requests/s and request
+latency per worker class. The same checks run on every test run, in-process, in tests/test_concurrency.py.
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--clients', type=int, default=16, help='concurrent servers entering orders')
+parser.add_argument('--seconds', type=float, default=15, help='how long each worker class is run')
+parser.add_argument('--workers', type=int, default=2)
+parser.add_argument('--threads', type=int, default=8, help='threads per gthread worker')
+parser.add_argument('--logins', type=int, default=2, help='extra clients logging in and out in a loop')
+parser.add_argument('--port', type=int, default=8766)
+args = parser.parse_args()
+
+here = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault('DB_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'concurrency.db')}")
+
+import main  # noqa: E402
+from tables import db, User, Role, Order, MenuItem  # noqa: E402
+from floor import TAKE_OUT  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+PASSWORD = 'bench'
+BASE = f'http://127.0.0.1:{args.port}'
+
+
+def seed(app, count: int):
+    """
+    The menu, and count servers. Returns ([user_id], [item_id]).
+    """
+    with app.app_context():
+        db.create_all()
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    client.get('/')
+    client.get('/import-data')
+    with app.app_context():
+        role = Role(name='Server')
+        db.session.add(role)
+        db.session.flush()
+        password = generate_password_hash(PASSWORD, method='pbkdf2:sha256', salt_length=8)
+        users = [User(full_name=f'Server {i}', email=f'server{i}@bench.local', password=password, status='active',
+                      role_id=role.id) for i in range(count)]
+        db.session.add_all(users)
+        db.session.commit()
+        item_ids = [item_id for item_id, in db.session.query(MenuItem.id).filter_by(status='active')]
+        return [user.id for user in users], item_ids
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  CLIENTS
+# ---------------------------------------------------------------------------------------------------------------------
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *redirect_args):
+        return None
+
+
+class Client:
+    """
+    One browser: its own cookie jar, redirects not followed so every request is timed on its own
+    """
+
+    def __init__(self, latencies: list):
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), NoRedirect)
+        self.latencies = latencies
+
+    def request(self, path: str, data: dict = None):
+        """
+        (status, redirect location or None, body)
+        """
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        start = time.perf_counter()
+        try:
+            with self.opener.open(BASE + path, body, timeout=60) as response:
+                result = response.status, None, response.read().decode()
+        except urllib.error.HTTPError as error:
+            result = error.code, error.headers.get('Location'), error.read().decode()
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        return result
+
+    def form(self, path: str, data: dict):
+        """
+        GETs the form for its CSRF token and POSTs data to it. Returns where it redirected to.
+        """
+        status, _, page = self.request(path)
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page)
+        if status != 200 or not token:
+            raise AssertionError(f'GET {path}: {status}')
+        status, location, page = self.request(path, {**data, 'csrf_token': token.group(1)})
+        if status != 302:
+            raise AssertionError(f'POST {path}: {status} {re.findall(r"flash-msg[^>]*>([^<]*)", page)}')
+        return urllib.parse.urlsplit(location)
+
+    def login(self, user_id: int):
+        if self.form('/login', {'employee_id': user_id, 'password': PASSWORD}).path != '/start-order':
+            raise AssertionError(f'login as {user_id} failed')
+
+    def page(self, path: str):
+        status, _, page = self.request(path)
+        if status != 200:
+            raise AssertionError(f'GET {path}: {status}')
+        return page
+
+
+def enter_order(client: Client, name: str, item_ids: list):
+    """
+    One order from start to close, checking each page is about this order. Returns (order_id, {item_id: quantity}).
+    """
+    client.form('/start-order', {'table': TAKE_OUT, 'name': name})
+    quantities = {}
+    order_id = None
+    for item_id in random.sample(item_ids, 2):
+        quantity = random.randint(1, 3)
+        redirect = client.form('/complete-order', {'item_id': item_id, 'quantity': quantity, 'notes': name,
+                                                   'mod1': 'null', 'mod2': 'null', 'mod3': 'null'})
+        redirected_id = int(urllib.parse.parse_qs(redirect.query)['id'][0])
+        if order_id not in (None, redirected_id):
+            raise AssertionError(f'LEAK {name}: items went to orders {order_id} and {redirected_id}')
+        order_id = redirected_id
+        quantities[item_id] = quantities.get(item_id, 0) + quantity
+    if f' - {name}</span>' not in client.page(f'/complete-order?id={order_id}'):
+        raise AssertionError(f'LEAK {name}: order page shows someone else\'s order')
+
+    for path, message in [(f'/submit-order?id={order_id}', f'ORDER #{order_id} submitted'),
+                          (f'/close-order?id={order_id}', f'Order #{order_id} for {name} closed')]:
+        status, _, _ = client.request(path)
+        if status != 302:
+            raise AssertionError(f'GET {path}: {status}')
+        if message not in client.page('/orders'):
+            raise AssertionError(f'LEAK {name}: expected the flash "{message}"')
+    return order_id, quantities
+
+
+def run_clients(label: str, user_ids: list, item_ids: list, deadline: float):
+    """
+    Runs the order-entry and login clients until deadline. Returns (latencies, entered, errors) where entered is
+    [(order_id, user_id, name, {item_id: quantity})].
+    """
+    latencies, entered, errors = [], [], []
+
+    def enter_orders(number: int, user_id: int):
+        client = Client(latencies)
+        try:
+            client.login(user_id)
+            count = 0
+            while time.monotonic() < deadline:
+                count += 1
+                name = f'{label}-{number}-{count}'
+                order_id, quantities = enter_order(client, name, item_ids)
+                entered.append((order_id, user_id, name, quantities))
+        except Exception as error:
+            errors.append(f'client {number}: {error}')
+
+    def log_in_and_out(number: int):
+        try:
+            while time.monotonic() < deadline:
+                client = Client(latencies)
+                client.login(user_ids[number % len(user_ids)])
+                client.request('/logout')
+        except Exception as error:
+            errors.append(f'login client {number}: {error}')
+
+    threads = [threading.Thread(target=enter_orders, args=(number, user_id)) for number, user_id in enumerate(user_ids)]
+    threads += [threading.Thread(target=log_in_and_out, args=(number,)) for number in range(args.logins)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, entered, errors
+
+
+def check_database(app, entered: list):
+    """
+    Every order belongs to the server that entered it, with exactly the items it entered. Returns the mismatches.
+    """
+    mismatches = []
+    with app.app_context():
+        for order_id, user_id, name, quantities in entered:
+            order = Order.query.get(order_id)
+            found = {}
+            for order_item in order.order_items:
+                found[order_item.item_id] = found.get(order_item.item_id, 0) + order_item.quantity
+                if order_item.notes != name:
+                    mismatches.append(f'order {order_id}: item notes {order_item.notes!r}, expected {name!r}')
+            if (order.user_id, order.customer_name, order.status, found) != (user_id, name, 'closed', quantities):
+                mismatches.append(f'order {order_id}: {(order.user_id, order.customer_name, order.status, found)}, '
+                                  f'expected {(user_id, name, "closed", quantities)}')
+    return mismatches
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  GUNICORN
+# ---------------------------------------------------------------------------------------------------------------------
+def serve(worker_class: str, threads: int):
+    command = [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--worker-class', worker_class,
+               '--workers', str(args.workers), '--threads', str(threads), '--bind', f'127.0.0.1:{args.port}']
+    server = subprocess.Popen(command, cwd=here, env=os.environ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        try:
+            urllib.request.urlopen(f'{BASE}/login', timeout=1).read()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError('gunicorn exited')
+            time.sleep(0.05)
+
+
+app = main.create_app()
+user_ids, item_ids = seed(app, args.clients)
+print(f"{args.clients} clients + {args.logins} logging in and out, {args.workers} workers, {args.seconds:.0f} s each, "
+      f"{urllib.parse.urlsplit(os.environ['DB_URL']).scheme}")
+print(f"{'workers':<22} {'orders/s':>9} {'requests/s':>11} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+failed = False
+# sync ignores --threads only when it is 1: gunicorn switches to gthread for more
+for label, worker_class, threads in [('sync', 'sync', 1), (f'gthread x{args.threads}', 'gthread', args.threads)]:
+    server = serve(worker_class, threads)
+    try:
+        start = time.monotonic()
+        latencies, entered, errors = run_clients(worker_class, user_ids, item_ids, start + args.seconds)
+        elapsed = time.monotonic() - start
+    finally:
+        server.terminate()
+        server.wait()
+    errors += check_database(app, entered)
+    p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else 0
+    print(f"{label:<22} {len(entered) / elapsed:>9.1f} {len(latencies) / elapsed:>11.1f} "
+          f"{statistics.median(latencies) if latencies else 0:>8.1f} {p95:>8.1f} {len(errors):>7}")
+    for error in errors[:10]:
+        print(f'  {error}')
+    failed = failed or bool(errors)
+
+if failed:
+    sys.exit('requests failed or leaked between clients')
@@ -0,0 +1,97 @@
+"""
+Benchmark: menu typeahead answered from the in-memory index
+usage: python bench_search.py [--items 5000]
+
+Builds a throwaway SQLite database with a synthetic menu, builds the index and times typical typeahead queries, then
+times picking up a one-item edit, and searches answered by other threads while that rebuild runs.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--items', type=int, default=5000, help='number of synthetic menu items')
+args = parser.parse_args()
+
+db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DB_URL'] = f'sqlite:///{db_file}'
+
+import main  # noqa: E402
+from tables import db, MenuItem, Category, Section  # noqa: E402
+from versions import bump, ensure_versions  # noqa: E402
+from menu_search import MenuIndex  # noqa: E402
+
+ADJECTIVES = ['Spicy', 'Crispy', 'Grilled', 'Smoked', 'Roasted', 'Iced', 'Hot', 'Fresh', 'Garlic', 'Honey', 'Lemon',
+              'Sesame', 'Classic', 'House', 'Braised', 'Sweet', 'Sour', 'Creamy', 'Baked', 'Steamed']
+NOUNS = ['Chicken', 'Tofu', 'Pork', 'Beef', 'Shrimp', 'Salmon', 'Noodles', 'Rice', 'Dumplings', 'Salad', 'Soup',
+         'Latte', 'Tea', 'Lemonade', 'Bun', 'Wings', 'Ramen', 'Curry', 'Taco', 'Burger', 'Pancake', 'Mochi']
+EXTRAS = ['with Scallion', 'with Kimchi', 'with Basil', 'with Avocado', 'with Chili Oil', 'with Mushroom',
+          'with Ginger', 'with Peanut', 'with Mango', 'with Cheese']
+QUERIES = ['c', 'ch', 'chi', 'chick', 'chicken', 'spicy chi', 'grilled salmon ba', 'tea', 'drinks', 'chiken',
+           'dumplngs', 'kimchi ramen', 'lemon', 'honey garlic wings', 'xyz']
+
+
+def seed(item_count: int):
+    random.seed(1)
+    engine = db.engine
+    engine.execute(Category.__table__.insert(), [{'id': i, 'name': name} for i, name in
+                                                 enumerate(['FOOD', 'DRINKS', 'DESSERT', 'SIDES', 'SPECIALS'], 1)])
+    engine.execute(Section.__table__.insert(), [{'id': i, 'name': f'Section {i}', 'category_id': (i - 1) // 4 + 1}
+                                                for i in range(1, 21)])
+    items = []
+    for i in range(1, item_count + 1):
+        section_id = random.randint(1, 20)
+        items.append({'id': i, 'name': f'{random.choice(ADJECTIVES)} {random.choice(NOUNS)} {i}',
+                      'price': random.randint(3, 40), 'status': 'active',
+                      'description': f"{' '.join(random.sample(ADJECTIVES + NOUNS, 5)).lower()} "
+                                     f"{random.choice(EXTRAS).lower()}",
+                      'section_id': section_id, 'category_id': (section_id - 1) // 4 + 1})
+    engine.execute(MenuItem.__table__.insert(), items)
+    ensure_versions()
+    db.session.commit()
+
+
+def timed_ms(function, *function_args):
+    start = time.perf_counter()
+    function(*function_args)
+    return (time.perf_counter() - start) * 1000
+
+
+with main.create_app().app_context():
+    db.create_all()
+    seed(args.items)
+    index = MenuIndex()
+
+    print(f"build index over {args.items} items: {timed_ms(index.refresh):>8.1f} ms")
+    print(f"{'query':<22} {'results':>7} {'median us':>10} {'max us':>8}")
+    for query in QUERIES:
+        times = [timed_ms(index.search, query) * 1000 for _ in range(200)]
+        print(f"{query:<22} {len(index.search(query)):>7} {statistics.median(times):>10.0f} {max(times):>8.0f}")
+
+    MenuItem.query.filter_by(id=1).update({'name': 'Matcha Affogato'})
+    bump('menu')
+    db.session.commit()
+    index.expire()
+
+    # meanwhile, another request's searches: they should keep the old index's speed instead of waiting
+    during, rebuilding = [], threading.Event()
+
+    def search_meanwhile():
+        rebuilding.wait()
+        while rebuilding.is_set():
+            during.append(timed_ms(lambda: (index.refresh(), index.search('spicy chi'))) * 1000)
+
+    searcher = threading.Thread(target=search_meanwhile)
+    searcher.start()
+    rebuilding.set()
+    rebuild_ms = timed_ms(index.refresh)
+    rebuilding.clear()
+    searcher.join()
+    print(f"pick up a one-item edit: {rebuild_ms:>8.1f} ms, "
+          f"'affogato' -> {[item['name'] for item in index.search('affogato')]}")
+    print(f"searches during it: {len(during)}, median {statistics.median(during) if during else 0:.0f} us, "
+          f"max {max(during, default=0):.0f} us")
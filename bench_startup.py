@@ -0,0 +1,72 @@
+"""
+Benchmark: application startup
+usage: python bench_startup.py [--import-budget-ms 500] [--workers 2]
+
+1. import time of main.py in a fresh interpreter, checked against the budget (exit code 1 when over)
+2. create_app() time
+3. time to first request under gunicorn, with and without --preload
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--import-budget-ms', type=float, default=500)
+parser.add_argument('--workers', type=int, default=2)
+parser.add_argument('--port', type=int, default=8765)
+args = parser.parse_args()
+
+here = os.path.dirname(os.path.abspath(__file__))
+env = {**os.environ, 'DB_URL': f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"}
+
+measure = """
+import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app()
+print((imported - start) * 1000, (time.perf_counter() - imported) * 1000)
+"""
+runs = [subprocess.run([sys.executable, '-c', measure], cwd=here, env=env, capture_output=True, text=True, check=True)
+        for _ in range(5)]
+import_ms, create_ms = map(min, zip(*[map(float, run.stdout.split()) for run in runs]))
+print(f"{'import main':<40} {import_ms:>8.1f} ms (budget {args.import_budget_ms:.0f} ms)")
+print(f"{'create_app()':<40} {create_ms:>8.1f} ms")
+
+subprocess.run([sys.executable, '-m', 'flask', 'init-db'], cwd=here, env={**env, 'FLASK_APP': 'main'},
+               capture_output=True, check=True)
+
+
+def first_request(preload: bool):
+    # only the options given here, not gunicorn.conf.py (which preloads)
+    command = [sys.executable, '-m', 'gunicorn', '--config', os.devnull, '--workers', str(args.workers),
+               '--bind', f'127.0.0.1:{args.port}']
+    if preload:
+        command.append('--preload')
+    server = subprocess.Popen(command + ['main:create_app()'], cwd=here, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    start = time.perf_counter()
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{args.port}/login', timeout=1).read()
+                return (time.perf_counter() - start) * 1000
+            except OSError:
+                if server.poll() is not None:
+                    raise RuntimeError('gunicorn exited')
+                time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+for preload in [False, True]:
+    label = f"first request, {args.workers} workers{', --preload' if preload else ''}"
+    print(f"{label:<40} {first_request(preload):>8.1f} ms")
+
+if import_ms > args.import_budget_ms:
+    sys.exit(f"import main took {import_ms:.1f} ms, over the {args.import_budget_ms:.0f} ms budget")
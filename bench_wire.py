@@ -0,0 +1,122 @@
+"""
+Benchmark: bytes on the wire per order entry
+usage: python bench_wire.py [--items 4]
+
+Runs the same order entry on a throwaway SQLite database twice: once as a client that sends no Accept-Encoding and
+no validators (what every tablet got before compression and ETags), and once as a browser that accepts gzip/br and
+revalidates pages it has seen. Bytes are response bodies plus headers. Static files are counted once per client.
+"""
+import argparse
+import gzip
+import os
+import re
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--items', type=int, default=4, help='items added to each order')
+args = parser.parse_args()
+
+db_file = os.path.join(tempfile.mkdtemp(), 'wire.db')
+os.environ['DB_URL'] = f'sqlite:///{db_file}'
+
+import main  # noqa: E402
+from tables import db, Order  # noqa: E402
+from compression import brotli  # noqa: E402
+
+
+def page_text(response):
+    body = response.get_data()
+    if response.headers.get('Content-Encoding') == 'br':
+        body = brotli.decompress(body)
+    elif response.headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return body.decode()
+
+
+class Tablet:
+    """
+    test client that counts response bytes and, when caching, keeps ETags like a browser cache
+    """
+
+    def __init__(self, app, caching: bool):
+        self.client = app.test_client()
+        self.caching = caching
+        self.etags = {}
+        self.static = set()
+        self.bytes = self.requests = self.not_modified = 0
+
+    def headers(self, url):
+        if not self.caching:
+            return {}
+        headers = {'Accept-Encoding': 'br, gzip' if brotli else 'gzip'}
+        if url in self.etags:
+            headers['If-None-Match'] = self.etags[url]
+        return headers
+
+    def count(self, response):
+        self.requests += 1
+        self.bytes += len(response.get_data()) + sum(len(key) + len(value) + 4 for key, value in response.headers)
+        if response.status_code == 304:
+            self.not_modified += 1
+
+    def get(self, url):
+        response = self.client.get(url, headers=self.headers(url))
+        self.count(response)
+        if response.headers.get('ETag'):
+            self.etags[url] = response.headers['ETag']
+        if response.status_code == 200 and response.mimetype == 'text/html':
+            for asset in re.findall(r'(/static/[^"\']+)', page_text(response)):
+                if asset not in self.static:
+                    self.static.add(asset)
+                    self.count(self.client.get(asset, headers=self.headers(asset)))
+        if response.status_code in (301, 302):
+            return self.get(response.headers['Location'].replace('http://localhost', ''))
+        return response
+
+    def post(self, url, data):
+        response = self.client.post(url, data=data, headers=self.headers(url))
+        self.count(response)
+        return self.get(response.headers['Location'].replace('http://localhost', ''))
+
+
+def order_entry(tablet: Tablet, name: str):
+    """
+    seat a guest, add items, look the ticket over, submit, check the open orders, close
+    """
+    tablet.get('/start-order')
+    tablet.post('/start-order', {'table': 'Take Out', 'name': name})
+    for item_id in range(1, args.items + 1):
+        tablet.post('/complete-order', {'item_id': item_id, 'quantity': 1, 'notes': '', 'mod1': 'null',
+                                        'mod2': 'null', 'mod3': 'null'})
+    with app.app_context():
+        order_id = Order.query.filter_by(customer_name=name).first().id
+    tablet.get(f'/complete-order?id={order_id}')
+    tablet.get(f'/submit-order?id={order_id}')
+    tablet.get('/orders')
+    tablet.get(f'/complete-order?id={order_id}')
+    tablet.get('/orders')
+    tablet.get(f'/close-order?id={order_id}')
+    tablet.get('/orders')
+
+
+app = main.create_app({'WTF_CSRF_ENABLED': False})
+with app.app_context():
+    db.create_all()
+setup = app.test_client()
+setup.get('/')
+setup.get('/import-data')
+
+print(f"compression: {'br' if brotli else 'gzip'}, {args.items} items per order")
+for label, caching in [('before (identity, no validators)', False), ('after (compressed, revalidating)', True)]:
+    tablet = Tablet(app, caching)
+    tablet.get('/')
+    tablet.post('/login', {'employee_id': 1, 'password': 'password'})
+    static_bytes = tablet.bytes
+    tablet.bytes = tablet.requests = tablet.not_modified = 0
+    for number in range(3):
+        order_entry(tablet, f'{label} {number}')
+    print(f"{label:<36} {tablet.bytes / 3 / 1024:>8.1f} KB per order entry "
+          f"({tablet.requests / 3:.0f} requests, {tablet.not_modified / 3:.0f} not modified), "
+          f"first visit {static_bytes / 1024:.1f} KB")
+
+os.remove(db_file)
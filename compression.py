@@ -0,0 +1,78 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  RESPONSE COMPRESSION
+#  Text responses of at least COMPRESS_MIN_SIZE bytes are sent with brotli if the brotli package is installed and the
+#  client accepts it, else with gzip. Pages are compressed per request at a fast level. Static files are compressed once
+#  at the highest level and kept in memory, keyed by their modification time and size.
+#  Streamed responses (CSV export, floor stream) are left alone, since compressing them would buffer the stream.
+# ---------------------------------------------------------------------------------------------------------------------
+from flask import current_app, request
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ['text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                'application/json', 'image/svg+xml']
+# (quality for pages, quality for static files)
+LEVELS = {'br': (5, 11), 'gzip': (6, 9)}
+
+_static = {}
+
+
+def choose_encoding():
+    if brotli and 'br' in request.accept_encodings:
+        return 'br'
+    if 'gzip' in request.accept_encodings:
+        return 'gzip'
+    return None
+
+
+def compress(data: bytes, encoding: str, level: int):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_response(response):
+    """
+    after_request hook
+    """
+    if response.mimetype not in COMPRESSIBLE or response.status_code != 200 \
+            or 'Content-Encoding' in response.headers:
+        return response
+    is_static = request.endpoint == 'static'
+    if response.is_streamed and not is_static:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if not encoding:
+        return response
+
+    if is_static:
+        key = (request.path, response.last_modified, response.content_length, encoding)
+        if key not in _static:
+            response.direct_passthrough = False
+            data = response.get_data()
+            if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+                return response
+            _static[key] = compress(data, encoding, LEVELS[encoding][1])
+        body = _static[key]
+        # the open file behind the response isn't read when the cached body is used
+        if response.direct_passthrough:
+            response.response.close()
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        body = compress(data, encoding, LEVELS[encoding][0])
+
+    response.direct_passthrough = False
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # the compressed body is a different representation of the same content
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,106 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  ORDER HISTORY EXPORT
+#  Rows are read through a server-side cursor and written out as CSV chunk by chunk, so memory use doesn't depend on
+#  how much history is exported.
+# ---------------------------------------------------------------------------------------------------------------------
+from sqlalchemy import select
+from tables import db, sortable_timestamp, User, MenuItem, ItemModVar, Table, Order, OrderItem, ExportLog, \
+    order_item__var
+from datetime import datetime, timedelta
+import csv
+import io
+
+EXPORT_COLUMNS = ['order_id', 'status', 'customer_name', 'server', 'table', 'created_at', 'submitted_at', 'closed_at',
+                  'order_item_id', 'item', 'quantity', 'notes', 'subtotal', 'vars']
+CHUNK_SIZE = 1000
+
+
+def export_range(start: str = None, end: str = None, since_last: bool = False):
+    """
+    Turns the requested export into a [start, end) range of sortable closed_at timestamps (see sortable_timestamp).
+    start and end are inclusive "%Y-%m-%d" dates. since_last starts where the last incremental export stopped.
+    Incremental exports stop at the current second so the next one can pick up exactly where this one ends.
+    Raises ValueError for malformed dates.
+    """
+    range_start = datetime.strptime(start, "%Y-%m-%d").strftime("%Y-%m-%d") if start else None
+    range_end = (datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d") if end else None
+    if since_last:
+        last_export = ExportLog.query.order_by(ExportLog.id.desc()).first()
+        range_start = last_export.high_water if last_export else None
+        range_end = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return range_start, range_end
+
+
+def export_statement(range_start: str = None, range_end: str = None):
+    """
+    One row per order_item and var, ordered so that rows for the same order_item are adjacent
+    """
+    closed_at = sortable_timestamp(Order.closed_at)
+    statement = select(
+        Order.id, Order.status, Order.customer_name, User.full_name, Table.name, Order.created_at,
+        Order.submitted_at, Order.closed_at, OrderItem.id, MenuItem.name, OrderItem.quantity, OrderItem.notes,
+        OrderItem.subtotal, ItemModVar.name
+    ).select_from(Order) \
+        .outerjoin(User, User.id == Order.user_id) \
+        .outerjoin(Table, Table.id == Order.table_id) \
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id) \
+        .outerjoin(MenuItem, MenuItem.id == OrderItem.item_id) \
+        .outerjoin(order_item__var, order_item__var.c.order_item_id == OrderItem.id) \
+        .outerjoin(ItemModVar, ItemModVar.id == order_item__var.c.var_id) \
+        .where(Order.status.in_(['closed', 'cancelled'])) \
+        .order_by(Order.id, OrderItem.id, ItemModVar.name)
+    if range_start:
+        statement = statement.where(closed_at >= range_start)
+    if range_end:
+        statement = statement.where(closed_at < range_end)
+    return statement
+
+
+def export_rows(range_start: str = None, range_end: str = None):
+    """
+    Yields one list per order_item (vars joined with "; ") using a connection of its own, so the export doesn't hold
+    the request's session.
+    """
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, max_row_buffer=CHUNK_SIZE) \
+            .execute(export_statement(range_start, range_end))
+        current, current_vars = None, []
+        for row in result:
+            row = list(row)
+            var = row.pop()
+            if current and current[:9] == row[:9]:
+                current_vars.append(var)
+                continue
+            if current:
+                yield current + ['; '.join(current_vars)]
+            current, current_vars = row, [var] if var else []
+        if current:
+            yield current + ['; '.join(current_vars)]
+
+
+def export_csv(range_start: str = None, range_end: str = None, since_last: bool = False):
+    """
+    Yields the export as CSV text in chunks of CHUNK_SIZE rows.
+    For incremental exports the new high-water mark is only recorded once the last row has gone out.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+
+    row_count = 0
+    for row in export_rows(range_start, range_end):
+        writer.writerow(row)
+        row_count += 1
+        if row_count % CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+    if since_last:
+        db.session.add(ExportLog(
+            exported_at=datetime.now().strftime("%m/%d/%Y %H:%M:%S"),
+            high_water=range_end,
+            row_count=row_count
+        ))
+        db.session.commit()
@@ -0,0 +1,141 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  FLOOR PLAN
+#  Seating a table is a single conditional UPDATE (compare-and-set on status), so two servers can never seat the same
+#  table. Table statuses are mirrored in an in-memory board that renders the floor plan without querying and wakes up
+#  clients waiting on /floor/stream when anything changes.
+# ---------------------------------------------------------------------------------------------------------------------
+from tables import db, Table
+from locations import PerLocation
+import threading
+import time
+
+TAKE_OUT = "Take Out"
+
+
+class FloorBoard:
+    """
+    Table statuses for this worker: {table_id: {'id', 'name', 'status'}}
+    Changes made by this worker are applied immediately. Changes made by other workers are picked up by reloading from
+    the database at most every refresh_seconds, and a stale board is harmless because seating is re-checked in SQL.
+    Under threaded workers the dict is never changed in place: writers swap in a new one under the lock, so readers
+    can iterate whichever one they picked up without locking.
+    """
+
+    def __init__(self, refresh_seconds: float = 5):
+        self.refresh_seconds = refresh_seconds
+        self.version = 0
+        self._tables = None
+        self._loaded_at = 0
+        self._changed = threading.Condition()
+
+    def _load(self):
+        tables = {table.id: {'id': table.id, 'name': table.name, 'status': table.status}
+                  for table in db.session.query(Table.id, Table.name, Table.status)}
+        with self._changed:
+            if tables != self._tables:
+                self._tables = tables
+                self.version += 1
+                self._changed.notify_all()
+            self._loaded_at = time.monotonic()
+            return self._tables
+
+    def tables(self):
+        """
+        Needs an app context the first time and whenever the board is due for a refresh
+        """
+        tables = self._tables
+        if tables is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            tables = self._load()
+        return list(tables.values())
+
+    def available(self):
+        return [table for table in self.tables() if table['status'] == 'available']
+
+    def find(self, name: str):
+        return next((table for table in self.tables() if table['name'] == name), None)
+
+    def update(self, table: dict):
+        """
+        Records a committed change to a table: {'id', 'name', 'status'}
+        """
+        with self._changed:
+            if self._tables is None:
+                return
+            self._tables = {**self._tables, table['id']: table}
+            self.version += 1
+            self._changed.notify_all()
+
+    def remove(self, table_id: int):
+        with self._changed:
+            if self._tables is None:
+                return
+            self._tables = {key: value for key, value in self._tables.items() if key != table_id}
+            self.version += 1
+            self._changed.notify_all()
+
+    def clear(self):
+        with self._changed:
+            self._tables = None
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, version: int, timeout: float):
+        """
+        Blocks until the board moves past version or timeout passes. Returns the current version.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+# each location has its own floor, see locations.py
+board = PerLocation(FloorBoard)
+
+
+class StreamSlots:
+    """
+    Open /floor/stream responses in this worker. Each one holds a thread for FLOOR_STREAM_SECONDS, so they are capped
+    to leave threads for everything else. Shared by all locations: the threads are.
+    """
+
+    def __init__(self):
+        self.open = 0
+        self._lock = threading.Lock()
+
+    def take(self, limit: int):
+        """
+        False when limit streams are already open
+        """
+        with self._lock:
+            if self.open >= limit:
+                return False
+            self.open += 1
+            return True
+
+    def give_back(self):
+        with self._lock:
+            self.open -= 1
+
+
+streams = StreamSlots()
+
+
+def seat_table(table_id: int):
+    """
+    Used in start_order()
+    Marks the table unavailable only if it is still available. Returns False if someone else got there first.
+    The caller commits.
+    """
+    return db.session.query(Table) \
+        .filter(Table.id == table_id, Table.status == 'available') \
+        .update({'status': 'unavailable'}, synchronize_session=False) == 1
+
+
+def free_table(table: Table):
+    """
+    Used in cancel_order() and close_order()
+    The caller commits, then passes the returned entry to board.update()
+    """
+    if table.status == 'unavailable':
+        table.status = 'available'
+    return {'id': table.id, 'name': table.name, 'status': table.status}
@@ -1,6 +1,6 @@
 from wtforms import IntegerField, TextAreaField, StringField, SubmitField, PasswordField, EmailField, SelectField, \
     FloatField
-from wtforms.validators import DataRequired, Email, InputRequired, NumberRange
+from wtforms.validators import DataRequired, Email, InputRequired, NumberRange, Optional
 from flask_wtf import FlaskForm
 
 
@@ -59,3 +59,10 @@ class AddOrderItemForm(FlaskForm):
     quantity = IntegerField('Quantity', default=1,
                             validators=[NumberRange(min=1, message="Quantity must be a positive number.")])
     add = SubmitField('Add')
+
+
+class ProfilingForm(FlaskForm):
+    endpoints = StringField('Endpoints')
+    sample = FloatField('Sample %', default=0,
+                        validators=[Optional(), NumberRange(min=0, max=100, message="Enter a percentage from 0 to 100.")])
+    submit = SubmitField('Save')
@@ -0,0 +1,29 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  GUNICORN SETTINGS
+#  Read by `gunicorn` from the working directory (Procfile: web). Command line options override them.
+#
+#  gthread workers: each worker process serves up to `threads` requests at once, so a request that waits - on the
+#  database, or hashing a password at login - holds one thread instead of the whole worker. See bench_concurrency.py.
+#  (gevent is not used: psycopg2 would block its event loop without extra patching.)
+#
+#  With FLOOR_PUSH=1, every tablet on the start order page holds a thread for its /floor/stream (up to 5 minutes at a
+#  time). A worker gives at most FLOOR_STREAMS_PER_WORKER (default 4) of its threads to streams and turns further
+#  tablets away with a 503, after which they poll /floor. Keep it below WEB_THREADS so order entry always has threads:
+#  workers x FLOOR_STREAMS_PER_WORKER tablets get pushed updates (8 by default), the rest poll.
+#
+#  Threads share a worker's memory. What that relies on:
+#   - db.session is a scoped_session, one per thread; current_user, flash() and the session cookie live on the request
+#   - the in-memory caches (floor.board, menu_search.menu_index, quick_picks, versions, assets) either take a lock to
+#     change or swap in a new dict, never changing one a request may be reading
+# ---------------------------------------------------------------------------------------------------------------------
+import os
+
+wsgi_app = 'main:create_app()'
+worker_class = 'gthread'
+# WEB_CONCURRENCY is set by the host to suit the dyno's memory
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# keep below the database pool (5 connections + 10 overflow per worker), or requests queue for a connection
+threads = int(os.environ.get('WEB_THREADS', 8))
+timeout = 30
+# the app is imported once and forked, so every worker signs sessions with the same random SECRET_KEY
+preload_app = True
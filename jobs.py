@@ -0,0 +1,247 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  BACKGROUND JOBS
+#  Work that doesn't need to hold up a request is queued as a row in the job table, in the request's transaction, and
+#  run by `flask worker` (Procfile: worker). There is no broker: a worker claims a job with a conditional UPDATE on its
+#  status (compare-and-set, as in floor.py), so any number of workers can poll the table without running a job twice.
+#  A failing job is retried MAX_ATTEMPTS times, a little later each time. A job whose worker died is queued again
+#  after JOB_TIMEOUT seconds.
+#
+#  Besides running jobs, the worker queues the end-of-day close-out for each business day (see close_out()). A business
+#  day runs until CLOSE_OUT_HOUR the next morning.
+# ---------------------------------------------------------------------------------------------------------------------
+from flask import current_app
+from sqlalchemy import func, insert, exists
+from sqlalchemy.exc import IntegrityError
+from tables import db, sortable_timestamp, ItemMod, Order, Table, Job, item__mod, mod__var
+from analytics import rebuild_rollups
+from export import export_csv
+from versions import bump
+from locations import location_dir
+import orders
+from datetime import datetime, timedelta
+import json
+import os
+import socket
+import time
+import traceback
+
+MAX_ATTEMPTS = 3
+RETRY_SECONDS = 60
+JOB_TIMEOUT = 600
+HOUSEKEEPING_SECONDS = 60
+KEEP_DAYS = 30
+
+HANDLERS = {}
+
+
+def handler(name: str):
+    """
+    Decorator registering a function as the job name. It is called with the job's payload as keyword arguments,
+    and may return a JSON-serialisable summary that is kept with the job.
+    """
+    def register(function):
+        HANDLERS[name] = function
+        return function
+    return register
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  QUEUEING
+# ---------------------------------------------------------------------------------------------------------------------
+def enqueue(name: str, payload: dict = None, key: str = None, delay: float = 0, coalesce: bool = False):
+    """
+    Queues a job without committing: it becomes visible to workers when the caller commits.
+    key: a job with this key is only ever queued once. coalesce: skip if the same job is already waiting.
+    Returns False if nothing was queued.
+    """
+    now = time.time()
+    values = {'name': name, 'payload': json.dumps(payload or {}, sort_keys=True), 'key': key, 'status': 'queued',
+              'created_at': now, 'run_after': now + delay, 'attempts': 0}
+    if coalesce and db.session.query(Job.id).filter_by(name=name, payload=values['payload'], status='queued').first():
+        return False
+    if key is None:
+        db.session.execute(insert(Job).values(**values))
+        return True
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(Job).values(**values))
+    except IntegrityError:
+        return False
+    return True
+
+
+def claim(worker: str):
+    """
+    The next due job, now marked running for worker; None when there is nothing to do
+    """
+    now = time.time()
+    due = db.session.query(Job.id).filter(Job.status == 'queued', Job.run_after <= now) \
+        .order_by(Job.run_after, Job.id).limit(5).all()
+    for job_id, in due:
+        claimed = db.session.query(Job).filter(Job.id == job_id, Job.status == 'queued') \
+            .update({'status': 'running', 'worker': worker, 'started_at': now, 'attempts': Job.attempts + 1},
+                    synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return Job.query.get(job_id)
+    return None
+
+
+def run(job: Job):
+    """
+    Runs a claimed job and records how it went. Returns True if it succeeded.
+    """
+    job_id, attempts, worker = job.id, job.attempts, job.worker
+    try:
+        function = HANDLERS.get(job.name)
+        if function is None:
+            raise LookupError(f'no handler for job {job.name}')
+        result = function(**json.loads(job.payload))
+        db.session.commit()
+        values = {'status': 'done', 'result': json.dumps(result)}
+    except Exception:
+        db.session.rollback()
+        values = {'status': 'failed', 'result': traceback.format_exc(limit=5)}
+        if attempts < MAX_ATTEMPTS:
+            values.update(status='queued', run_after=time.time() + RETRY_SECONDS * attempts)
+    # a job that outlived JOB_TIMEOUT may have been handed to another worker: leave it to that one
+    db.session.query(Job).filter(Job.id == job_id, Job.status == 'running', Job.worker == worker) \
+        .update({**values, 'finished_at': time.time()}, synchronize_session=False)
+    db.session.commit()
+    return values['status'] == 'done'
+
+
+def requeue_stale(timeout: float = JOB_TIMEOUT):
+    """
+    Queues jobs again whose worker has been silent for timeout seconds, or fails them if they're out of attempts
+    """
+    now = time.time()
+    stale = [Job.status == 'running', Job.started_at < now - timeout]
+    db.session.query(Job).filter(*stale, Job.attempts >= MAX_ATTEMPTS) \
+        .update({'status': 'failed', 'finished_at': now, 'result': 'timed out'}, synchronize_session=False)
+    db.session.query(Job).filter(*stale).update({'status': 'queued', 'run_after': now}, synchronize_session=False)
+    db.session.commit()
+
+
+def last_business_day(hour: int):
+    """
+    "%Y-%m-%d" the last business day that has ended started on, when business days end at hour
+    """
+    return ((datetime.now() - timedelta(hours=hour)).date() - timedelta(days=1)).isoformat()
+
+
+def schedule_close_out(hour: int):
+    """
+    Queues the close-out of the last business day that has ended, once
+    """
+    day = last_business_day(hour)
+    key = f'close-out:{day}'
+    if not db.session.query(Job.id).filter_by(key=key).first():
+        enqueue('close-out', {'day': day}, key=key)
+        db.session.commit()
+
+
+def work(report, poll_seconds: float = 1, once: bool = False):
+    """
+    Runs jobs until stopped, or until the queue is empty with once. report(job, ok, ms) is called after each job.
+    """
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    next_housekeeping = 0
+    while True:
+        if time.monotonic() >= next_housekeeping:
+            requeue_stale()
+            schedule_close_out(current_app.config['CLOSE_OUT_HOUR'])
+            next_housekeeping = time.monotonic() + HOUSEKEEPING_SECONDS
+        job = claim(worker)
+        if job:
+            start = time.perf_counter()
+            ok = run(job)
+            report(job, ok, (time.perf_counter() - start) * 1000)
+            db.session.remove()
+        elif once:
+            return
+        else:
+            time.sleep(poll_seconds)
+
+
+def queue_stats(recent: int = 50):
+    """
+    For the jobs page: jobs per status, how long the oldest due job has waited, timings per job name over the
+    recent finished jobs, and the recent jobs themselves (newest first)
+    """
+    now = time.time()
+    depth = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+    oldest = db.session.query(func.min(Job.run_after)).filter(Job.status == 'queued', Job.run_after <= now).scalar()
+    jobs = Job.query.order_by(Job.id.desc()).limit(recent).all()
+    timings = {}
+    for job in jobs:
+        if job.finished_at and job.started_at:
+            timings.setdefault(job.name, []).append((job.finished_at - job.started_at) * 1000)
+    return {
+        'depth': {status: depth.get(status, 0) for status in ['queued', 'running', 'done', 'failed']},
+        'waiting_seconds': now - oldest if oldest else 0,
+        'timings': {name: {'runs': len(times), 'avg_ms': sum(times) / len(times), 'max_ms': max(times)}
+                    for name, times in sorted(timings.items())},
+        'jobs': jobs,
+    }
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  JOBS
+# ---------------------------------------------------------------------------------------------------------------------
+@handler('cleanup-mods')
+def cleanup_mods():
+    """
+    Deletes the mods no item uses any more, keeping their vars. Queued by add_mod_var().
+    """
+    orphans = db.session.query(ItemMod.id).filter(~exists().where(item__mod.c.mod_id == ItemMod.id)).all()
+    orphan_ids = [mod_id for mod_id, in orphans]
+    if orphan_ids:
+        db.session.execute(mod__var.delete().where(mod__var.c.mod_id.in_(orphan_ids)))
+        db.session.execute(ItemMod.__table__.delete().where(ItemMod.id.in_(orphan_ids)))
+    return {'mods_deleted': len(orphan_ids)}
+
+
+@handler('close-out')
+def close_out(day: str):
+    """
+    End of the business day that started on day ("%Y-%m-%d"):
+     - cancels orders still 'started' from before the business day ended (empty ones are deleted, see orders.cancel)
+     - frees tables left unavailable without an open order
+     - rebuilds that day's sales rollups from order history, correcting any drift
+     - archives the day's closed and cancelled orders to ARCHIVE_DIR/[location/]orders-<day>.csv (see export.py)
+     - deletes finished jobs older than KEEP_DAYS
+    Running it again for the same day is harmless.
+    """
+    hour = current_app.config['CLOSE_OUT_HOUR']
+    day_start = datetime.strptime(day, '%Y-%m-%d') + timedelta(hours=hour)
+    day_end = day_start + timedelta(days=1)
+
+    stale = Order.query.filter(Order.status == 'started',
+                               sortable_timestamp(Order.created_at) < day_end.strftime('%Y-%m-%d %H:%M:%S')).all()
+    for order in stale:
+        orders.cancel(order)
+    open_orders = db.session.query(Order.table_id) \
+        .filter(Order.status.in_(['started', 'submitted']), Order.table_id.isnot(None))
+    freed = db.session.query(Table).filter(Table.status == 'unavailable', ~Table.id.in_(open_orders)) \
+        .update({'status': 'available'}, synchronize_session=False)
+    if freed:
+        bump('orders')
+    db.session.commit()
+
+    next_day = (day_start + timedelta(days=1)).strftime('%Y-%m-%d')
+    rollups = rebuild_rollups(day, next_day)
+
+    directory = location_dir(current_app.config['ARCHIVE_DIR'])
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'orders-{day}.csv')
+    with open(path + '.tmp', 'w', newline='') as file:
+        for chunk in export_csv(day_start.strftime('%Y-%m-%d %H:%M:%S'), day_end.strftime('%Y-%m-%d %H:%M:%S')):
+            file.write(chunk)
+    os.replace(path + '.tmp', path)
+
+    pruned = db.session.query(Job).filter(Job.status.in_(['done', 'failed']),
+                                          Job.finished_at < time.time() - KEEP_DAYS * 24 * 3600) \
+        .delete(synchronize_session=False)
+    return {'orders_cancelled': len(stale), 'tables_freed': freed, 'rollups': rollups, 'archive': path,
+            'jobs_deleted': pruned}
@@ -0,0 +1,176 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  LOCATIONS
+#  One deployment can serve several restaurants, each with its own database, so one location's orders never slow down
+#  another's queries. Off unless LOCATIONS is set ("downtown,airport").
+#   - LOCATION_DB_URL is each location's database, with {location} in it:
+#       SQLite:     sqlite:////srv/pos/{location}.db (the default is instance/locations/{location}.db)
+#       PostgreSQL: postgresql://host/pos?options=-csearch_path%3D{location}  (one schema per location, created with
+#                   CREATE SCHEMA before `LOCATION=<name> flask init-db`)
+#   - a request's location is its X-Location header, set by the proxy in front of the app, or else the first label of
+#     its host under LOCATION_DOMAIN (downtown.pos.example.com); LOCATION is the fallback
+#   - CLI commands work on LOCATION, and refuse to run without it. The Procfile's `flask init-db` (release) and
+#     `flask worker` cover every location when LOCATION is unset: one location after another, and one worker thread
+#     per location, so every location gets its close-out.
+#  Every location gets its own pooled engine (and replica engine, see replicas.py), created on first use, and
+#  db.session is bound to the request's location.
+#  Logins are bound to the location they were made at. In-memory caches are kept per location with PerLocation.
+# ---------------------------------------------------------------------------------------------------------------------
+from flask import current_app, request, session, g, abort, has_app_context, has_request_context
+from flask_sqlalchemy import SQLAlchemy, _EngineConnector
+from sqlalchemy import orm
+from replicas import ReplicaSession, REPLICA
+from contextlib import contextmanager
+import os
+import re
+import threading
+
+PRIMARY = 'location'
+
+
+def location_names(value: str):
+    """
+    "downtown, airport" -> ['downtown', 'airport']. Raises ValueError for a name that can't be used in a file name.
+    """
+    names = [name.strip() for name in (value or '').split(',') if name.strip()]
+    for name in names:
+        if not re.fullmatch(r'[\w-]{1,50}', name):
+            raise ValueError(f'Location names may only contain letters, numbers, "-" and "_": {name!r}')
+    return names
+
+
+def current_location():
+    """
+    The location being served, or None for a single-location deployment.
+    Outside a request (CLI commands) LOCATION has to be set: there is no database to fall back to.
+    """
+    if not has_app_context() or not current_app.config.get('LOCATIONS'):
+        return None
+    location = g.get('location') or current_app.config['LOCATION']
+    if not location and not has_request_context():
+        raise RuntimeError(f"LOCATIONS is set: choose one with LOCATION=<name> "
+                           f"({', '.join(current_app.config['LOCATIONS'])})")
+    return location
+
+
+def every_location():
+    """
+    Where commands covering the whole deployment run: LOCATION if set, else every location ([None] for a
+    single-location deployment)
+    """
+    if current_app.config['LOCATION'] or not current_app.config['LOCATIONS']:
+        return [current_app.config['LOCATION']]
+    return current_app.config['LOCATIONS']
+
+
+@contextmanager
+def at_location(location: str, app=None):
+    """
+    An app context working on location, for every_location(); pass app from another thread. The db.session is
+    removed when it ends.
+    """
+    with (app or current_app._get_current_object()).app_context():
+        if location:
+            g.location = location
+        yield
+
+
+def location_dir(directory: str):
+    """
+    The current location's own folder under a files directory (snapshots, archives)
+    """
+    location = current_location()
+    return os.path.join(directory, location) if location else directory
+
+
+def select_location():
+    """
+    before_request: works out the request's location. Unknown locations are a 404.
+    """
+    if not current_app.config['LOCATIONS'] or request.endpoint == 'static':
+        return
+    location = request.headers.get('X-Location')
+    domain = current_app.config['LOCATION_DOMAIN']
+    host = request.host.split(':')[0]
+    if not location and domain and host.endswith('.' + domain):
+        location = host[:-len(domain) - 1]
+    location = location or current_app.config['LOCATION']
+    if location not in current_app.config['LOCATIONS']:
+        return abort(404)
+    g.location = location
+
+
+def logged_in_here():
+    """
+    False when the session's login was made at another location, where the same user id is someone else
+    """
+    return session.get('location') == current_location()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  ENGINES
+# ---------------------------------------------------------------------------------------------------------------------
+class LocationConnector(_EngineConnector):
+    """
+    Engines for the binds LocationSQLAlchemy adds: 'replica', '<PRIMARY or REPLICA>:<location>'
+    """
+
+    def get_uri(self):
+        kind, _, location = self._bind.partition(':')
+        if not location:
+            url = self._app.config['DB_READ_URL']
+        elif kind == REPLICA:
+            url = self._app.config['LOCATION_READ_URL'].format(location=location)
+        else:
+            url = self._app.config['LOCATION_DB_URL'].format(location=location)
+        if url.startswith('sqlite:///'):
+            os.makedirs(os.path.dirname(os.path.abspath(url[len('sqlite:///'):])) or '.', exist_ok=True)
+        return url
+
+
+class LocationSQLAlchemy(SQLAlchemy):
+    """
+    Routes the default bind to the current location's engine: db.session, db.engine, create_all() and
+    drop_all() all act on the location being served. The replica bind likewise goes to the location's replica.
+    Sessions are ReplicaSessions.
+    """
+
+    def get_engine(self, app=None, bind=None):
+        if bind in (None, REPLICA):
+            location = current_location()
+            if location:
+                bind = f'{bind or PRIMARY}:{location}'
+        return super().get_engine(app, bind)
+
+    def make_connector(self, app=None, bind=None):
+        if bind is not None and bind.split(':')[0] in (PRIMARY, REPLICA):
+            return LocationConnector(self, self.get_app(app), bind)
+        return super().make_connector(app, bind)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=ReplicaSession, db=self, **options)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  CACHES
+# ---------------------------------------------------------------------------------------------------------------------
+class PerLocation:
+    """
+    Stands in for one instance of factory per location: attributes are looked up on the current location's instance,
+    created on first use
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def here(self):
+        location = current_location()
+        instance = self._instances.get(location)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.setdefault(location, self._factory())
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self.here(), name)
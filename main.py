@@ -1,35 +1,117 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, abort, jsonify
-from flask_bootstrap import Bootstrap
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, url_for, flash, abort, jsonify, \
+    Response, stream_with_context, send_from_directory, session
 from flask_login import login_user, LoginManager, login_required, current_user, logout_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from forms import LoginForm, AddItemForm, AddUserForm, AddCategoryForm, AddBasicForm, StartOrderForm, \
-    AddOrderItemForm
-from tables import db, User, MenuItem, ItemMod, ItemModVar, Category, Section, Role, Order, Table, OrderItem
+    AddOrderItemForm, ProfilingForm
+from tables import db, User, MenuItem, ItemMod, ItemModVar, Category, Section, Role, Order, Table, OrderItem, \
+    upgrade_schema
+from analytics import rebuild_rollups, sales_report, modifier_report, DIMENSIONS
+from export import export_range, export_csv
+from floor import board, streams, TAKE_OUT
+from sync import apply_operations, SyncError
+from assets import static_url, cache_versioned_static, template_cache, warm_templates
+from compression import compress_response
+from versions import bump, conditional, ensure_versions
+from profiling import profiler, save_settings, start_profile, stop_profile, recent_captures
+from menu_edit import load_item, plan_edit, apply_edit
+from menu_bulk import apply_bulk, STATUSES
+from menu_search import menu_index, MAX_RESULTS
+from quick_picks import quick_picks
+from jobs import enqueue, work, queue_stats, last_business_day
+from snapshots import save_snapshot, restore_snapshot, list_snapshots
+from locations import location_names, select_location, current_location, logged_in_here, every_location, \
+    at_location
+from replicas import read_replica, remember_writes, refresh_replica, replica_url, REPLICA
+from sqlalchemy.exc import IntegrityError
+import orders
+from sqlalchemy import func
 from datetime import datetime
 from functools import wraps
+import click
 import csv
+import json
 import os
+import threading
+import time
 
-app = Flask(__name__)
-
-# IN PRODUCTION
-# app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
-SECRET_KEY = os.urandom(32)
-app.config['SECRET_KEY'] = SECRET_KEY
-
-Bootstrap(app)
+# Routes and CLI commands live on this blueprint and are attached to an app by create_app().
+# Importing this module does no I/O: the database is first touched by the first request or command that needs it.
+pos = Blueprint('pos', __name__, cli_group=None)
 login_manager = LoginManager()
-login_manager.init_app(app)
 
-uri = os.environ.get("DB_URL", 'sqlite:///shop.db')
-if uri.startswith("postgres://"):
-    uri = uri.replace("postgres://", "postgresql://", 1)
-app.config['SQLALCHEMY_DATABASE_URI'] = uri
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-with app.app_context():
+def create_app(config: dict = None):
+    """
+    Application factory
+    gunicorn: gunicorn  (settings in gunicorn.conf.py)
+    flask:    flask --app main <command>  (FLASK_APP=main on Flask 2.0)
+    """
+    app = Flask(__name__)
+
+    # IN PRODUCTION
+    # app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
+    app.config['SECRET_KEY'] = os.urandom(32)
+
+    uri = os.environ.get("DB_URL", 'sqlite:///shop.db')
+    if uri.startswith("postgres://"):
+        uri = uri.replace("postgres://", "postgresql://", 1)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['ORDERS_PER_PAGE'] = 25
+    # live table updates on the start order page hold a thread per tablet, so they need threaded workers
+    # (gunicorn.conf.py). At most FLOOR_STREAMS_PER_WORKER tablets stream from each worker; the rest poll /floor.
+    app.config['FLOOR_PUSH'] = os.environ.get("FLOOR_PUSH") == "1"
+    app.config['FLOOR_STREAM_SECONDS'] = 300
+    app.config['FLOOR_STREAMS_PER_WORKER'] = int(os.environ.get("FLOOR_STREAMS_PER_WORKER", 4))
+    # compiled templates, filled by `flask warm-templates` at deploy time (default: instance/jinja-cache)
+    app.config['TEMPLATE_CACHE_DIR'] = os.environ.get("TEMPLATE_CACHE_DIR")
+    # smaller responses aren't worth the CPU: they fit in a packet either way
+    app.config['COMPRESS_MIN_SIZE'] = 500
+    # request profiles captured from /profiling (default: instance/profiles)
+    app.config['PROFILE_DIR'] = os.environ.get("PROFILE_DIR") or os.path.join(app.instance_path, 'profiles')
+    # saved copies of the database, see snapshots.py (default: instance/snapshots)
+    app.config['SNAPSHOT_DIR'] = os.environ.get("SNAPSHOT_DIR") or os.path.join(app.instance_path, 'snapshots')
+    # background jobs, see jobs.py: business days end at CLOSE_OUT_HOUR, and each close-out archives its orders as
+    # CSV to ARCHIVE_DIR (default: instance/archive)
+    app.config['CLOSE_OUT_HOUR'] = int(os.environ.get("CLOSE_OUT_HOUR", 4))
+    app.config['ARCHIVE_DIR'] = os.environ.get("ARCHIVE_DIR") or os.path.join(app.instance_path, 'archive')
+    # several restaurants served by one deployment, each with its own database, see locations.py
+    app.config['LOCATIONS'] = location_names(os.environ.get("LOCATIONS"))
+    app.config['LOCATION'] = os.environ.get("LOCATION")
+    app.config['LOCATION_DB_URL'] = os.environ.get("LOCATION_DB_URL") or \
+        'sqlite:///' + os.path.join(app.instance_path, 'locations', '{location}.db')
+    app.config['LOCATION_DOMAIN'] = os.environ.get("LOCATION_DOMAIN")
+    # read-only copy of the database for order lists and reports, see replicas.py
+    read_uri = os.environ.get("DB_READ_URL")
+    if read_uri and read_uri.startswith("postgres://"):
+        read_uri = read_uri.replace("postgres://", "postgresql://", 1)
+    app.config['DB_READ_URL'] = read_uri
+    app.config['LOCATION_READ_URL'] = os.environ.get("LOCATION_READ_URL")
+    app.config['READ_YOUR_WRITES_SECONDS'] = float(os.environ.get("READ_YOUR_WRITES_SECONDS", 5))
+    app.config.update(config or {})
+
+    if app.config['LOCATION'] and app.config['LOCATIONS'] and app.config['LOCATION'] not in app.config['LOCATIONS']:
+        raise ValueError(f"LOCATION {app.config['LOCATION']} is not one of LOCATIONS")
+
+    app.jinja_env.bytecode_cache = template_cache(app)
+    app.add_template_global(static_url)
+    app.before_request(select_location)
+    app.before_request(start_profile)
+    # after_request hooks run last-registered first: the profile stops after compression and cache headers
+    app.after_request(stop_profile)
+    app.after_request(cache_versioned_static)
+    app.after_request(compress_response)
+    app.after_request(remember_writes)
+
+    # flask_bootstrap pulls in dominate and visitor, which only matter once an app exists
+    from flask_bootstrap import Bootstrap
+    Bootstrap(app)
+    login_manager.init_app(app)
     db.init_app(app)
-    db.create_all()
+    app.register_blueprint(pos)
+    return app
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -188,25 +270,254 @@ def add_mod_var(item: MenuItem, mod_name: str, vars_list: str):
             new_var.mods.append(new_mod)
     db.session.commit()
 
-    # Database cleanup
-    # If there are mods not associated with an item, delete
-    all_mods = [mod.id for mod in ItemMod.query.all() if len(mod.items) == 0]
-    for mod_id in all_mods:
-        mod = ItemMod.query.get(mod_id)
-        # dissociate mod from vars to prevent var deletion
-        mod.vars = []
-        db.session.delete(mod)
-        db.session.commit()
+    # Database cleanup: mods no longer associated with an item are deleted by the worker (see jobs.cleanup_mods)
+    enqueue('cleanup-mods', coalesce=True)
     return
 
 
+def order_total_drift():
+    """
+    Used by the verify-totals command
+    Recomputes every order's total and item count from order_item and returns the orders whose stored values differ:
+        [(order, actual_total, actual_item_count), ...]
+    """
+    actual = db.session.query(
+        OrderItem.order_id,
+        func.sum(OrderItem.subtotal).label('total'),
+        func.sum(OrderItem.quantity).label('item_count')
+    ).group_by(OrderItem.order_id).subquery()
+    rows = db.session.query(
+        Order,
+        func.coalesce(actual.c.total, 0),
+        func.coalesce(actual.c.item_count, 0)
+    ).outerjoin(actual, actual.c.order_id == Order.id).order_by(Order.id)
+
+    drift = []
+    for order, actual_total, actual_item_count in rows:
+        if abs(order.total - actual_total) > 0.005 or order.item_count != actual_item_count:
+            drift.append((order, actual_total, actual_item_count))
+    return drift
+
+
+def visible_orders(query):
+    """
+    Used in show_orders() and order_history()
+    The owner account sees every order, everyone else only their own
+    """
+    if current_user.id != 1:
+        query = query.filter(Order.user_id == current_user.id)
+    return query
+
+
+def keyset_page(query, cursor, newest_first: bool = False):
+    """
+    Used in show_orders() and order_history()
+    Returns one page of orders after the cursor (the last order id of the previous page) and the cursor for the next
+    page, or None on the last page. Seeking by id keeps every page as cheap as the first, however deep it is.
+    """
+    page_size = current_app.config['ORDERS_PER_PAGE']
+    if cursor:
+        query = query.filter(Order.id < cursor if newest_first else Order.id > cursor)
+    query = query.order_by(Order.id.desc() if newest_first else Order.id)
+    orders = query.limit(page_size + 1).all()
+    if len(orders) > page_size:
+        return orders[:page_size], orders[page_size - 1].id
+    return orders, None
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  CLI COMMANDS
+# ---------------------------------------------------------------------------------------------------------------------
+@pos.cli.command('init-db')
+def init_db():
+    """
+    Creates any missing database tables, columns and indexes, and the page version counters.
+    Run on every deploy (Procfile: release). With LOCATIONS, at every location unless LOCATION picks one.
+    """
+    for location in every_location():
+        with at_location(location):
+            db.create_all()
+            changes = upgrade_schema()
+            ensure_versions()
+            db.session.commit()
+        prefix = f"{location}: " if location else ''
+        click.echo(f"{prefix}Tables ready: {', '.join(db.metadata.tables)}")
+        if changes:
+            click.echo(f"{prefix}Upgraded: {', '.join(changes)}")
+
+
+@pos.cli.command('verify-totals')
+@click.option('--fix', is_flag=True, help='Overwrite drifted totals with the recomputed values.')
+def verify_totals(fix):
+    """
+    Recomputes order totals from order_item and reports drift
+    """
+    drift = order_total_drift()
+    for order, actual_total, actual_item_count in drift:
+        click.echo(f"ORDER #{order.id}: stored {order.total:.2f} / {order.item_count} items, "
+                   f"actual {actual_total:.2f} / {actual_item_count} items")
+        if fix:
+            order.total = actual_total
+            order.item_count = actual_item_count
+    if fix and drift:
+        db.session.commit()
+    click.echo(f"{len(drift)} order(s) with drift{' fixed' if fix and drift else ''}")
+
+
+@pos.cli.command('rebuild-rollups')
+def rebuild_sales_rollups():
+    """
+    Rebuilds the sales rollups from order history
+    """
+    for table_name, row_count in rebuild_rollups().items():
+        click.echo(f"{table_name}: {row_count} rows")
+
+
+@pos.cli.command('export-orders')
+@click.option('--start', help='First day to export (YYYY-MM-DD).')
+@click.option('--end', help='Last day to export (YYYY-MM-DD).')
+@click.option('--since-last', is_flag=True, help='Only orders closed since the last --since-last export.')
+@click.option('--output', '-o', type=click.File('w'), default='-', help='CSV file to write (default: stdout).')
+def export_orders(start, end, since_last, output):
+    """
+    Exports closed and cancelled orders with their line items as CSV
+    """
+    try:
+        range_start, range_end = export_range(start, end, since_last)
+    except ValueError:
+        raise click.BadParameter('Dates must be formatted as YYYY-MM-DD')
+    for chunk in export_csv(range_start, range_end, since_last):
+        output.write(chunk)
+
+
+@pos.cli.command('bulk-menu')
+@click.option('--category', help='Select the items of this category.')
+@click.option('--section', help='Select the items of this section (within --category, if given).')
+@click.option('--item', 'items', type=int, multiple=True, help='Select this item id. Repeat for more items.')
+@click.option('--reprice', type=float, help='Change prices by this percentage, e.g. 10 or -5.')
+@click.option('--status', type=click.Choice(STATUSES), help='Activate or deactivate the items.')
+@click.option('--move-to', help='Move the items to this section.')
+@click.option('--move-to-category', help='Category of the --move-to section, if the name is used more than once.')
+def bulk_menu(category, section, items, reprice, status, move_to, move_to_category):
+    """
+    Reprices, activates/deactivates or moves the selected items in one transaction, e.g.
+    flask bulk-menu --category drinks --reprice 10
+    """
+    selection = {'category': category, 'section': section, 'items': list(items)}
+    operations = []
+    if reprice is not None:
+        operations.append({'op': 'reprice', 'percent': reprice, **selection})
+    if status:
+        operations.append({'op': 'status', 'status': status, **selection})
+    if move_to:
+        operations.append({'op': 'move', 'to_section': move_to, 'to_category': move_to_category, **selection})
+    if not operations:
+        raise click.UsageError('Nothing to do: add --reprice, --status or --move-to')
+    try:
+        results = apply_bulk(operations)
+    except ValueError as error:
+        db.session.rollback()
+        raise click.ClickException(str(error))
+    db.session.commit()
+    for result in results:
+        click.echo(f"{result['op']}: {result['items']} items")
+
+
+@pos.cli.command('snapshot')
+@click.argument('name', default='default')
+def snapshot(name):
+    """
+    Saves the whole database as snapshot NAME, replacing any snapshot of that name
+    """
+    try:
+        elapsed = save_snapshot(name)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+    click.echo(f"Saved snapshot {name} in {elapsed:.0f} ms")
+
+
+@pos.cli.command('refresh-replica')
+def refresh_replica_command():
+    """
+    Copies the database over the SQLite read replica in DB_READ_URL, to try the replica out locally
+    """
+    if not replica_url(current_app):
+        raise click.UsageError('Set DB_READ_URL (LOCATION_READ_URL with several locations) first.')
+    try:
+        elapsed = refresh_replica(db.engine, db.get_engine(bind=REPLICA))
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    click.echo(f"Replica refreshed in {elapsed:.0f} ms")
+
+
+@pos.cli.command('restore')
+@click.argument('name', default='default')
+def restore(name):
+    """
+    Replaces the whole database with snapshot NAME
+    """
+    try:
+        elapsed = restore_snapshot(name)
+    except ValueError as error:
+        raise click.BadParameter(f"{error}. Snapshots: {', '.join(list_snapshots()) or 'none'}")
+    click.echo(f"Restored snapshot {name} in {elapsed:.0f} ms")
+
+
+@pos.cli.command('worker')
+@click.option('--once', is_flag=True, help='Stop when no job is due instead of waiting for more.')
+@click.option('--poll', default=1.0, help='Seconds between checks of an empty queue.')
+def run_worker(once, poll):
+    """
+    Runs background jobs (see jobs.py) and queues the nightly close-out.
+    With LOCATIONS, one worker thread per location unless LOCATION picks one.
+    """
+    def report(job, ok, ms):
+        location = current_location()
+        click.echo(f"{datetime.now().strftime('%m/%d/%Y %H:%M:%S')} {location + ' ' if location else ''}"
+                   f"job {job.id} {job.name}: {'done' if ok else 'failed'} in {ms:.0f} ms")
+
+    app = current_app._get_current_object()
+    stopped = []
+
+    def work_at(location):
+        with at_location(location, app):
+            try:
+                work(report, poll_seconds=poll, once=once)
+            except Exception:
+                stopped.append(location)
+                raise
+
+    threads = [threading.Thread(target=work_at, args=(location,), daemon=True) for location in every_location()]
+    for thread in threads:
+        thread.start()
+    # a location whose worker died would silently miss its jobs: stop, and let the process be restarted
+    while not stopped and any(thread.is_alive() for thread in threads):
+        time.sleep(poll)
+    if stopped:
+        where = ', '.join(location for location in stopped if location)
+        raise click.ClickException(f"worker stopped{' at ' + where if where else ''}")
+
+
+@pos.cli.command('warm-templates')
+def warm_template_cache():
+    """
+    Compiles every template into the bytecode cache. Run at deploy time, before the workers start.
+    """
+    start = time.perf_counter()
+    names = warm_templates(current_app)
+    click.echo(f"compiled {len(names)} templates in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 #  ROUTES THAT RETURN DETAILS FOR GET REQUESTS VIA JS OR PREFILL DATA
 # ---------------------------------------------------------------------------------------------------------------------
-@app.route('/details/item/<int:item_id>')
+@pos.route('/details/item/<int:item_id>')
 @login_required
 def get_item_details(item_id):
+    # from the primary, like the menu page linking here: a lagging replica may not have the item yet
     item = MenuItem.query.get(item_id)
+    if not item:
+        return abort(404)
     details = {
         'id': item.id,
         'name': item.name,
@@ -217,10 +528,13 @@ def get_item_details(item_id):
     return jsonify(details)
 
 
-@app.route('/details/category/<category_name>')
+@pos.route('/details/category/<category_name>')
 @login_required
 def get_category_details(category_name):
+    # from the primary, see get_item_details()
     category = Category.query.filter_by(name=category_name).first()
+    if not category:
+        return abort(404)
     details = {
         'id': category.id,
         'name': category.name,
@@ -229,7 +543,58 @@ def get_category_details(category_name):
     return jsonify(details)
 
 
-@app.route('/import-data')
+@pos.route('/menu/search')
+@login_required
+def search_menu():
+    """
+    ?q=<typed text>&limit=<results, default 10>. See menu_search.py
+    """
+    limit = min(request.args.get('limit', 10, type=int), MAX_RESULTS)
+    menu_index.refresh()
+    return jsonify({'results': menu_index.search(request.args.get('q', ''), limit)})
+
+
+@pos.route('/floor')
+@login_required
+def get_floor():
+    return jsonify({'version': board.version, 'tables': board.tables()})
+
+
+@pos.route('/floor/stream')
+@login_required
+def stream_floor():
+    """
+    Server-sent events: the table list, sent once on connect and again whenever it changes.
+    The stream ends after FLOOR_STREAM_SECONDS and the browser reconnects on its own.
+    A 503 once FLOOR_STREAMS_PER_WORKER streams are open: the browser then polls /floor instead.
+    """
+    if not streams.take(current_app.config['FLOOR_STREAMS_PER_WORKER']):
+        return Response(status=503, headers={'Retry-After': str(current_app.config['FLOOR_STREAM_SECONDS'])})
+
+    def events():
+        version = None
+        deadline = time.monotonic() + current_app.config['FLOOR_STREAM_SECONDS']
+        while time.monotonic() < deadline:
+            tables = board.tables()
+            # give the connection back while waiting: a reload only needs it for one query
+            db.session.remove()
+            if board.version == version:
+                yield ': keep-alive\n\n'
+            else:
+                version = board.version
+                yield f"data: {json.dumps({'version': version, 'tables': tables})}\n\n"
+            board.wait(version, timeout=min(board.refresh_seconds, deadline - time.monotonic()))
+
+    # the session opened loading the user would otherwise hold a pooled connection for the whole stream
+    db.session.remove()
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+    # the server closes the response when the stream ends or the browser goes away
+    response.call_on_close(streams.give_back)
+    return response
+
+
+@pos.route('/import-data')
 def import_data():
     # create dictionary from csv data
     data = {}
@@ -285,24 +650,59 @@ def import_data():
         updates = True
 
     if updates:
+        bump('menu')
+        db.session.commit()
+        menu_index.expire()
         flash('Success! Dummy data added.')
     else:
         flash('No changes were made. Dummy data has already been added.')
-    return redirect(url_for('home'))
+    return redirect(url_for('.home'))
 
 
-@app.route('/reset')
+@pos.route('/reset')
 def reset():
     for table in reversed(db.metadata.sorted_tables):
         db.session.execute(table.delete())
+    bump('menu', 'orders')
     db.session.commit()
-    return redirect(url_for('home'))
+    board.clear()
+    menu_index.clear()
+    quick_picks.clear()
+    return redirect(url_for('.home'))
+
+
+@pos.route('/snapshot')
+@admin_only
+def snapshot_data():
+    """
+    ?name=<snapshot name>, default "default"
+    """
+    name = request.args.get('name', 'default')
+    try:
+        flash(f'Success: Snapshot {name} saved in {save_snapshot(name):.0f} ms')
+    except ValueError as error:
+        flash(f'Error: {error}')
+    return redirect(url_for('.setup'))
+
+
+@pos.route('/restore')
+@admin_only
+def restore_data():
+    """
+    ?name=<snapshot name>, default "default". The restored database may not have the current user: back to login.
+    """
+    name = request.args.get('name', 'default')
+    try:
+        flash(f'Success: Snapshot {name} restored in {restore_snapshot(name):.0f} ms')
+    except ValueError as error:
+        flash(f'Error: {error}')
+    return redirect(url_for('.home'))
 
 
 # ---------------------------------------------------------------------------------------------------------------------
 #  FLASK ROUTES: HOME, LOGIN, LOGOUT
 # ---------------------------------------------------------------------------------------------------------------------
-@app.route('/')
+@pos.route('/')
 def home():
     """
     If the active user is authenticated, redirect to the start order page.
@@ -312,7 +712,7 @@ def home():
     """
     user_count = User.query.count()
     if current_user.is_authenticated:
-        return redirect(url_for('start_order'))
+        return redirect(url_for('.start_order'))
     elif user_count == 0:
         new_role = Role(name="Owner")
         db.session.add(new_role)
@@ -326,23 +726,27 @@ def home():
             status="active"
         )
         take_out = Table(
-            name="Take Out",
+            name=TAKE_OUT,
             status="available"
         )
         db.session.add_all([take_out, owner_user])
+        bump('orders')
         db.session.commit()
+        board.clear()
         login_user(owner_user)
-        return redirect(url_for('setup'))
-    return redirect(url_for('login'))
+        session['location'] = current_location()
+        return redirect(url_for('.setup'))
+    return redirect(url_for('.login'))
 
 
-@app.route('/login', methods=['POST', 'GET'])
+@pos.route('/login', methods=['POST', 'GET'])
+@conditional('menu')
 def login():
     menu, categories, sections = menu_create()
     form = LoginForm()
 
     if current_user.is_authenticated:
-        return redirect(url_for('start_order'))
+        return redirect(url_for('.start_order'))
     if form.validate_on_submit():
         employee_id = request.form.get('employee_id')
         password = request.form.get('password')
@@ -351,59 +755,61 @@ def login():
         if user:
             if check_password_hash(user.password, password):
                 login_user(user)
-                return redirect(url_for('start_order'))
+                session['location'] = current_location()
+                return redirect(url_for('.start_order'))
             else:
                 flash('Password incorrect.')
-                return redirect(url_for('login'))
+                return redirect(url_for('.login'))
         else:
             flash('Employee ID is not registered in the database.')
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
     return render_template('index.html', form=form, menu=menu, categories=categories, sections=sections)
 
 
 @login_manager.user_loader
 def load_user(user_id):
+    if not logged_in_here():
+        return None
     return User.query.get(int(user_id))
 
 
-@app.route('/logout')
+@pos.route('/logout')
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
 
 # ---------------------------------------------------------------------------------------------------------------------
 #  FLASK ROUTES: TAKE AN ORDER
 # ---------------------------------------------------------------------------------------------------------------------
-@app.route('/start-order', methods=['GET', 'POST'])
+@pos.route('/start-order', methods=['GET', 'POST'])
 @login_required
+@conditional('menu', 'orders')
 def start_order():
     menu, categories, sections = menu_create()
     form = StartOrderForm()
-    form.table.choices = [table.name for table in Table.query.filter_by(status='available').all()]
+    form.table.choices = [table['name'] for table in board.available()]
     started_order = Order.query.filter_by(user_id=current_user.id, status="started").first()
 
     if started_order:
-        return redirect(url_for('complete_order'))
+        return redirect(url_for('.complete_order'))
     if form.validate_on_submit():
-        table = Table.query.filter_by(name=form.table.data).first()
-        new_order = Order(
-            customer_name=form.name.data,
-            status='started',
-            created_at=datetime.now().strftime("%m/%d/%Y %H:%M:%S"),
-            table_id=table.id,
-            user_id=current_user.id
-        )
-        if table.name != "Take Out":
-            table.status = 'unavailable'
-        db.session.add(new_order)
+        table = board.find(form.table.data)
+        if not orders.start(table, form.name.data, current_user.id):
+            db.session.rollback()
+            board.update({**table, 'status': 'unavailable'})
+            flash(f"{table['name']} was just seated by someone else. Please choose another table.")
+            return redirect(url_for('.start_order'))
         db.session.commit()
-        return redirect(url_for('complete_order'))
+        if table['name'] != TAKE_OUT:
+            board.update({**table, 'status': 'unavailable'})
+        return redirect(url_for('.complete_order'))
     return render_template('index.html', form=form, menu=menu, categories=categories, sections=sections)
 
 
-@app.route('/complete-order', methods=['GET', 'POST'])
+@pos.route('/complete-order', methods=['GET', 'POST'])
 @login_required
+@conditional('menu', 'orders', extra=lambda: quick_picks.stamp(current_user.id))
 def complete_order():
     menu, categories, sections = menu_create()
     form = AddOrderItemForm()
@@ -417,128 +823,285 @@ def complete_order():
 
     if form.validate_on_submit():
         data = form.data
-        item_id = data['item_id']
-        order_item = db.session.query(MenuItem).get(item_id)
-        price = order_item.price
-        new_quantity = data['quantity']
-        notes = data['notes']
         new_vars = [data[x] for x in data if "mod" in x and data[x] != "null"]
-
-        # CHECK 1: If adding the same exact item then update previous data
-        similar_items = db.session.query(OrderItem).filter(
-            OrderItem.item_id == item_id,
-            OrderItem.notes == notes,
-            OrderItem.order_id == order.id
-        ).all()
-        if similar_items:
-            item_details = {item: [var.name for var in item.vars] for item in similar_items}
-            if new_vars in item_details.values():
-                same_item = get_key(item_details, new_vars)
-                same_item.quantity += new_quantity
-                same_item.subtotal = same_item.quantity * price
-                db.session.commit()
-                return redirect(url_for('complete_order', id=order.id))
-
-        # Create a new item
-        new_order_item = OrderItem(
-            quantity=new_quantity,
-            notes=notes,
-            subtotal=new_quantity * price,
-            item_id=item_id,
-            order_id=order.id
-        )
-        db.session.add(new_order_item)
-
-        # associate vars with new ordered item
-        order_item_vars = ItemModVar.query.filter(ItemModVar.name.in_(new_vars)).all()
-        new_order_item.vars.extend(order_item_vars)
+        orders.add_item(order, data['item_id'], data['quantity'], data['notes'], new_vars)
         db.session.commit()
-        return redirect(url_for('complete_order', id=order.id))
+        return redirect(url_for('.complete_order', id=order.id))
     return render_template('index.html', form=form, menu=menu, categories=categories, sections=sections,
-                           order=order)
+                           order=order, picks=quick_picks.items(current_user.id, menu))
 
 
-@app.route('/submit-order')
+@pos.route('/submit-order')
 @login_required
 def submit_order():
     order = Order.query.get(request.args.get('id'))
-    if len(order.order_items) > 0:
-        order.status = 'submitted'
-        order.submitted_at = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
+    if orders.submit(order):
         db.session.commit()
         flash(f"Success: ORDER #{order.id} submitted")
-        return redirect(url_for('show_orders'))
+        return redirect(url_for('.show_orders'))
     else:
         flash(f"Please add an item.")
-        return redirect(url_for('complete_order'))
+        return redirect(url_for('.complete_order'))
 
 
-@app.route('/delete-order-item')
+@pos.route('/delete-order-item')
 @login_required
 def delete_order_item():
     order_item = OrderItem.query.get(request.args.get('id'))
+    if not order_item:
+        return redirect(url_for('.complete_order'))
     order_id = order_item.order_id
-    db.session.delete(order_item)
+    if order_item.order.status not in orders.OPEN_STATUSES:
+        flash(f"Order #{order_id} is already {order_item.order.status}.")
+        return redirect(url_for('.show_orders'))
+    orders.remove_item(order_item)
     db.session.commit()
-    return redirect(url_for('complete_order', id=order_id))
+    return redirect(url_for('.complete_order', id=order_id))
 
 
-@app.route('/cancel-order')
+@pos.route('/cancel-order')
 @login_required
 def cancel_order():
     # Get Active Order
     order = Order.query.get(request.args.get('id'))
-    not_empty_order = OrderItem.query.filter_by(order_id=order.id).all()
-    order.table.status = "available"
-    if not_empty_order:
-        order.status = 'cancelled'
-        order.closed_at = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
-        flash(f"Success: Order #{order.id} for {order.customer_name} cancelled")
-    else:
-        db.session.delete(order)
-        flash(f"Success: Order #{order.id} for {order.customer_name} deleted")
+    if not order:
+        return redirect(url_for('.show_orders'))
+    outcome = 'cancelled' if orders.has_items(order) else 'deleted'
+    order_id, customer_name = order.id, order.customer_name
+    table = orders.cancel(order)
+    if table is None:
+        flash(f"Order #{order_id} is already {order.status}.")
+        return redirect(url_for('.show_orders'))
+    flash(f"Success: Order #{order_id} for {customer_name} {outcome}")
     db.session.commit()
+    board.update(table)
 
-    return redirect(url_for('show_orders'))
+    return redirect(url_for('.show_orders'))
 
 
-@app.route('/close-order')
+@pos.route('/close-order')
 @login_required
 def close_order():
     # Get Active Order
     order = db.session.query(Order).get(request.args.get('id'))
-    order.status = 'closed'
-    order.table.status = 'available'
-    order.closed_at = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
+    if not order:
+        return redirect(url_for('.show_orders'))
+    table = orders.close(order)
+    if table is None:
+        flash(f"Order #{order.id} is already {order.status}.")
+        return redirect(url_for('.show_orders'))
     flash(f"Success: Order #{order.id} for {order.customer_name} closed")
     db.session.commit()
-    return redirect(url_for('show_orders'))
+    board.update(table)
+    return redirect(url_for('.show_orders'))
+
+
+@pos.route('/sync', methods=['POST'])
+@login_required
+def sync_orders():
+    """
+    Applies a batch of queued order operations in one transaction. See sync.py for the format.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('operations'), list):
+        return abort(400)
+    try:
+        results, table_changes = apply_operations(payload['operations'], current_user)
+        db.session.commit()
+    except SyncError as error:
+        db.session.rollback()
+        return jsonify({'error': str(error), 'index': error.index, 'key': error.key}), 422
+    except IntegrityError:
+        # the same keys were applied by a concurrent request - retrying returns its results
+        db.session.rollback()
+        return jsonify({'error': 'Batch is being applied by another request. Please retry.'}), 409
+    for table in table_changes:
+        board.update(table)
+    return jsonify({'results': results})
 
 
 # ---------------------------------------------------------------------------------------------------------------------
 #  FLASK ROUTES: SYSTEM SETUP & SETTINGS
 # ---------------------------------------------------------------------------------------------------------------------
-@app.route('/setup')
+@pos.route('/setup')
 @admin_only
+@conditional('menu')
 def setup():
     menu, categories, sections = menu_create()
     return render_template('index.html', menu=menu, categories=categories, sections=sections)
 
 
-@app.route('/orders')
+@pos.route('/orders')
+@login_required
+@read_replica
+@conditional('menu', 'orders')
 def show_orders():
+    """
+    Open orders, one page at a time (?after=<last order id of the previous page>)
+    """
     menu, categories, sections = menu_create()
-    orders = Order.query.filter(Order.status.not_in(['closed', 'cancelled', 'started'])).all()
-    closed_orders = db.session.query(Order).filter(Order.status == "closed").all()
-    lifetime_total = 0
-    for x in closed_orders:
-        for y in x.order_items:
-            lifetime_total += y.subtotal
+    open_orders = visible_orders(Order.query.filter(Order.status.not_in(['closed', 'cancelled', 'started'])))
+    orders, next_cursor = keyset_page(open_orders, request.args.get('after', type=int))
+    lifetime_total = db.session.query(func.coalesce(func.sum(Order.total), 0)).filter(Order.status == "closed").scalar()
     return render_template('index.html', menu=menu, categories=categories, sections=sections, orders=orders,
-                           total=lifetime_total)
+                           total=lifetime_total, next_cursor=next_cursor)
 
 
-@app.route('/add-role', methods=['GET', 'POST'])
+@pos.route('/order-history')
+@login_required
+@read_replica
+def order_history():
+    """
+    Closed and cancelled orders, newest first, one page at a time (?before=<last order id of the previous page>)
+    filters: ?server=<user id>&table=<table id>&status=closed|cancelled&date=YYYY-MM-DD
+    """
+    menu, categories, sections = menu_create()
+    # ids that aren't numbers are ignored, like a bad ?before=
+    filters = {'server': request.args.get('server', type=int), 'table': request.args.get('table', type=int),
+               'status': request.args.get('status', ''), 'date': request.args.get('date', '')}
+
+    history = visible_orders(Order.query.filter(Order.status.in_(['closed', 'cancelled'])))
+    if filters['server'] is not None:
+        history = history.filter(Order.user_id == filters['server'])
+    if filters['table'] is not None:
+        history = history.filter(Order.table_id == filters['table'])
+    if filters['status'] in ['closed', 'cancelled']:
+        history = history.filter(Order.status == filters['status'])
+    if filters['date']:
+        try:
+            closed_on = datetime.strptime(filters['date'], "%Y-%m-%d").strftime("%m/%d/%Y")
+        except ValueError:
+            flash('Error: Dates must be formatted as YYYY-MM-DD')
+            return redirect(url_for('.order_history'))
+        history = history.filter(Order.closed_at.startswith(closed_on))
+
+    orders, next_cursor = keyset_page(history, request.args.get('before', type=int), newest_first=True)
+    return render_template('index.html', menu=menu, categories=categories, sections=sections, orders=orders,
+                           next_cursor=next_cursor, filters=filters, users=User.query.all(), tables=Table.query.all())
+
+
+@pos.route('/reports')
+@admin_only
+@read_replica
+def show_reports():
+    """
+    Sales summary for a date range (?start=YYYY-MM-DD&end=YYYY-MM-DD, defaults to the last 30 days)
+    """
+    menu, categories, sections = menu_create()
+    start, end = request.args.get('start'), request.args.get('end')
+    try:
+        reports = {by: sales_report(by, start, end) for by in ['day', 'server', 'table', 'category', 'item']}
+        reports['modifier'] = modifier_report(start, end)
+    except ValueError:
+        flash('Error: Dates must be formatted as YYYY-MM-DD')
+        return redirect(url_for('.show_reports'))
+    return render_template('index.html', menu=menu, categories=categories, sections=sections, reports=reports,
+                           start=start, end=end)
+
+
+@pos.route('/reports/sales')
+@admin_only
+@read_replica
+def get_sales_report():
+    """
+    JSON: ?by=hour|day|server|table|category|section|item&start=YYYY-MM-DD&end=YYYY-MM-DD
+    """
+    by = request.args.get('by', 'day')
+    if by not in DIMENSIONS:
+        return abort(400)
+    try:
+        rows = sales_report(by, request.args.get('start'), request.args.get('end'))
+    except ValueError:
+        return abort(400)
+    return jsonify({'by': by, 'rows': rows})
+
+
+@pos.route('/reports/modifiers')
+@admin_only
+@read_replica
+def get_modifier_report():
+    try:
+        rows = modifier_report(request.args.get('start'), request.args.get('end'))
+    except ValueError:
+        return abort(400)
+    return jsonify({'rows': rows})
+
+
+@pos.route('/export/orders.csv')
+@admin_only
+def export_orders_csv():
+    """
+    Streams the order history as CSV: ?start=YYYY-MM-DD&end=YYYY-MM-DD or ?since=last
+    """
+    since_last = request.args.get('since') == 'last'
+    try:
+        range_start, range_end = export_range(request.args.get('start'), request.args.get('end'), since_last)
+    except ValueError:
+        return abort(400)
+    return Response(
+        stream_with_context(export_csv(range_start, range_end, since_last)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=orders-{datetime.now().strftime("%Y%m%d")}.csv'}
+    )
+
+
+@pos.route('/profiling', methods=['GET', 'POST'])
+@admin_only
+def profiling():
+    """
+    Switches request profiling on for some endpoints and/or a percentage of requests. See profiling.py.
+    """
+    menu, categories, sections = menu_create()
+    form = ProfilingForm()
+    directory = current_app.config['PROFILE_DIR']
+    if form.validate_on_submit():
+        endpoints = [endpoint.strip() for endpoint in form.endpoints.data.split(',') if endpoint.strip()]
+        known = current_app.view_functions
+        unknown = [endpoint for endpoint in endpoints if endpoint not in known and f'pos.{endpoint}' not in known]
+        if unknown:
+            flash(f"Error: Unknown endpoint {', '.join(unknown)}")
+            return redirect(url_for('.profiling'))
+        save_settings(directory, endpoints, form.sample.data or 0)
+        flash('Success: Profiling is on' if profiler.enabled else 'Success: Profiling is off')
+        return redirect(url_for('.profiling'))
+
+    profiler.reload(directory)
+    form.endpoints.default, form.sample.default = ', '.join(profiler.endpoints), profiler.sample
+    form.process()
+    return render_template('index.html', form=form, menu=menu, categories=categories, sections=sections,
+                           captures=recent_captures(directory))
+
+
+@pos.route('/profiling/<filename>')
+@admin_only
+def get_profile(filename):
+    return send_from_directory(current_app.config['PROFILE_DIR'], filename, as_attachment=True)
+
+
+@pos.route('/jobs')
+@admin_only
+def show_jobs():
+    """
+    Background job queue: depth, timings and recent jobs. See jobs.py.
+    """
+    menu, categories, sections = menu_create()
+    return render_template('index.html', menu=menu, categories=categories, sections=sections, stats=queue_stats())
+
+
+@pos.route('/jobs/close-out')
+@admin_only
+def queue_close_out():
+    """
+    Queues the close-out of the last business day again, e.g. after fixing orders it archived
+    """
+    day = last_business_day(current_app.config['CLOSE_OUT_HOUR'])
+    enqueue('close-out', {'day': day})
+    db.session.commit()
+    flash(f'Success: Close-out of {day} queued')
+    return redirect(url_for('.show_jobs'))
+
+
+@pos.route('/add-role', methods=['GET', 'POST'])
 @admin_only
 def add_role():
     menu, categories, sections = menu_create()
@@ -552,14 +1115,14 @@ def add_role():
             db.session.add(new_role)
             db.session.commit()
             flash(f'Success: {new_role.name} role added')
-            return redirect(url_for('add_role'))
+            return redirect(url_for('.add_role'))
         else:
             flash('ERROR: Role names must be unique')
     return render_template('index.html', form=form, menu=menu, categories=categories, sections=sections,
                            roles=roles)
 
 
-@app.route('/delete-role')
+@pos.route('/delete-role')
 @admin_only
 def delete_role():
     role_id = request.args.get('id')
@@ -571,10 +1134,10 @@ def delete_role():
         db.session.commit()
     else:
         flash(f'ERROR: That role is currently assigned to a user.')
-    return redirect(url_for('add_role'))
+    return redirect(url_for('.add_role'))
 
 
-@app.route('/add-user', methods=['POST', 'GET'])
+@pos.route('/add-user', methods=['POST', 'GET'])
 @admin_only
 def add_user():
     menu, categories, sections = menu_create()
@@ -594,12 +1157,12 @@ def add_user():
         db.session.add(new_user)
         db.session.commit()
         flash(f"Success! {new_user.full_name}'s ID is {new_user.id}")
-        return redirect(url_for('add_user'))
+        return redirect(url_for('.add_user'))
     return render_template('index.html', form=form, menu=menu, categories=categories, sections=sections,
                            users=users)
 
 
-@app.route('/delete-user')
+@pos.route('/delete-user')
 @admin_only
 def remove_user():
     user_id = request.args.get('id')
@@ -607,10 +1170,10 @@ def remove_user():
     user.status = "inactive"
     db.session.commit()
     flash(f'SUCCESS: {user.full_name} is now inactive')
-    return redirect(url_for('add_user'))
+    return redirect(url_for('.add_user'))
 
 
-@app.route('/edit-user', methods=['GET', 'POST'])
+@pos.route('/edit-user', methods=['GET', 'POST'])
 @admin_only
 def edit_user():
     menu, categories, sections = menu_create()
@@ -635,7 +1198,7 @@ def edit_user():
             flash(f"Success! {user.full_name}'s info has been updated")
         else:
             flash(f"Error: No changes detected")
-        return redirect(url_for('add_user'))
+        return redirect(url_for('.add_user'))
 
     # SET DEFAULTS
     form.full_name.default, form.email.default, form.role.default = user.full_name, user.email, user.role.name
@@ -644,8 +1207,9 @@ def edit_user():
                            users=users)
 
 
-@app.route('/add-table', methods=['GET', 'POST'])
+@pos.route('/add-table', methods=['GET', 'POST'])
 @admin_only
+@conditional('menu', 'orders')
 def add_table():
     menu, categories, sections = menu_create()
     tables = Table.query.all()
@@ -659,15 +1223,17 @@ def add_table():
                 status="available"
             )
             db.session.add(new_table)
+            bump('orders')
             db.session.commit()
+            board.update({'id': new_table.id, 'name': new_table.name, 'status': new_table.status})
             flash(f'Success: {new_table.name} added')
-            return redirect(url_for('add_table'))
+            return redirect(url_for('.add_table'))
         flash('ERROR: Table names must be unique')
     return render_template('index.html', form=form, menu=menu, categories=categories, sections=sections,
                            tables=tables)
 
 
-@app.route('/remove-table')
+@pos.route('/remove-table')
 @admin_only
 def remove_table():
     table_id = request.args.get('id')
@@ -679,12 +1245,18 @@ def remove_table():
     else:
         table.status = "inactive"
         flash(f'Success: {table.name} is now inactive')
+    bump('orders')
     db.session.commit()
-    return redirect(url_for('add_table'))
+    if table.status == "inactive":
+        board.update({'id': table.id, 'name': table.name, 'status': table.status})
+    else:
+        board.remove(int(table_id))
+    return redirect(url_for('.add_table'))
 
 
-@app.route('/add-category', methods=['GET', 'POST'])
+@pos.route('/add-category', methods=['GET', 'POST'])
 @admin_only
+@conditional('menu')
 def add_category():
     menu, categories, sections = menu_create()
     form = AddCategoryForm()
@@ -695,21 +1267,24 @@ def add_category():
         category_exists = Category.query.filter_by(name=category_name).first()
         if category_exists:
             flash(f'ERROR: Category names must be unique')
-            return redirect(url_for('add_category'))
+            return redirect(url_for('.add_category'))
 
         new_category = Category(name=category_name)
         db.session.add(new_category)
         db.session.commit()
 
         add_menu_sections(new_category.id, data['sections'])
+        bump('menu')
+        db.session.commit()
 
         flash(f'Success! {data["category"].upper()} added')
-        return redirect(url_for('add_category'))
+        return redirect(url_for('.add_category'))
     return render_template('index.html', form=form, menu=menu, categories=categories, sections=sections)
 
 
-@app.route('/edit-category', methods=['GET', 'POST'])
+@pos.route('/edit-category', methods=['GET', 'POST'])
 @admin_only
+@conditional('menu')
 def edit_category():
     menu, categories, sections = menu_create()
     form = AddCategoryForm()
@@ -724,7 +1299,7 @@ def edit_category():
             category_exists = Category.query.filter_by(name=data["category"].upper()).first()
             if category_exists:
                 flash(f'ERROR: Category names must be unique')
-                return redirect(url_for('add_category'))
+                return redirect(url_for('.add_category'))
             category.name = data["category"].upper()
             db.session.commit()
 
@@ -740,11 +1315,17 @@ def edit_category():
                 section_in_use = [item for item in section.items if item.status == 'active']
                 if section_in_use:
                     flash(f"Error: Items are associated with the section {section_name}")
-                    return redirect(url_for('add_category'))
+                    bump('menu')
+                    db.session.commit()
+                    menu_index.expire()
+                    return redirect(url_for('.add_category'))
                 section.items = []
                 db.session.delete(section)
                 db.session.commit()
-        return redirect(url_for('add_category'))
+        bump('menu')
+        db.session.commit()
+        menu_index.expire()
+        return redirect(url_for('.add_category'))
 
     current_sections = ','.join([section.name for section in category.sections])
     form.category.default, form.sections.default = category.name, current_sections
@@ -752,7 +1333,7 @@ def edit_category():
     return render_template('index.html', form=form, menu=menu, categories=categories, sections=sections)
 
 
-@app.route('/remove-category', methods=['GET', 'POST'])
+@pos.route('/remove-category', methods=['GET', 'POST'])
 @admin_only
 def remove_category():
     category = Category.query.get(request.args.get('id'))
@@ -763,16 +1344,18 @@ def remove_category():
         for section in Section.query.filter_by(category_id=category.id).all():
             db.session.delete(section)
         db.session.delete(category)
+        bump('menu')
         flash(f"Success: {category.name} has been deleted")
     db.session.commit()
-    return redirect(url_for('add_category'))
+    return redirect(url_for('.add_category'))
 
 
 # ---------------------------------------------------------------------------------------------------------------------
 #  FLASK ROUTES: EDIT MENU ITEMS
 # ---------------------------------------------------------------------------------------------------------------------
-@app.route('/add-menu-item', methods=['GET', 'POST'])
+@pos.route('/add-menu-item', methods=['GET', 'POST'])
 @admin_only
+@conditional('menu')
 def add_menu_item():
     menu, categories, sections = menu_create()
     form = AddItemForm()
@@ -785,7 +1368,7 @@ def add_menu_item():
         # is the item name unique?
         if MenuItem.query.filter_by(name=data['name']).first():
             flash(f'Error: Item names must be unique.')
-            return redirect(url_for('add_menu_item'))
+            return redirect(url_for('.add_menu_item'))
 
         category_id = Category.query.filter(Category.name == data['category']).first().id
         section_id = Section.query.filter(Section.name == data['section']).first().id
@@ -808,82 +1391,46 @@ def add_menu_item():
 
             if mod_name and var_data:
                 add_mod_var(new_item, mod_name, var_data)
+        bump('menu')
+        db.session.commit()
+        menu_index.expire()
 
         flash(f'Success! {form.name.data} added to the menu')
 
-        return redirect(url_for('add_menu_item'))
+        return redirect(url_for('.add_menu_item'))
 
     return render_template('index.html', form=form, menu=menu, categories=categories, sections=sections)
 
 
-@app.route('/edit-menu-item/<int:id>', methods=['GET', 'POST'])
+@pos.route('/edit-menu-item/<int:id>', methods=['GET', 'POST'])
 @admin_only
+@conditional('menu')
 def edit_menu_item(id):
+    """
+    See menu_edit.py: the whole edit is applied in one transaction, and only if something changed
+    """
     menu, categories, sections = menu_create()
-    item = MenuItem.query.get(id)
+    item = load_item(id)
     form = AddItemForm()
     form.category.choices = [category.name for category in categories]
     form.section.choices = [section.name for section in sections]
 
-    current_mod_vars = {mod.name: ','.join([var.name for var in mod.vars]) for mod in item.mods}
-    current_mods = {mod.name: mod for mod in item.mods}
-
     if form.validate_on_submit():
-        data = form.data
-        category_id = Category.query.filter(Category.name == data['category']).first().id
-        section_id = Section.query.filter(Section.name == data['section']).first().id
-
-        original = [item.name, item.price, item.category_id, item.section_id, item.description]
-        submit = [data['name'], int(data['price']), category_id, section_id, data['description']]
-
-        [item.name, item.price, item.category_id, item.section_id, item.description], updates = change(original, submit)
-        db.session.commit()
-
-        updated_mod_vars = {data["mod" + str(i)].title(): data["vars" + str(i)].title() for i in range(1, 4)}
-
-        """
-        MOD: VAR TYPES
-        1. new mod: new vars - create a new mod
-        2. new mod: same vars - update existing mod name
-        3. same mod: new vars - create a new mod
-        4. same mod: same vars - do nothing
-        5. not included mod: vars - dissociate item from mod
-        """
-        for mv in current_mod_vars:
-            if mv in updated_mod_vars:
-                if current_mod_vars[mv] != updated_mod_vars[mv]:
-                    # TYPE 3
-                    add_mod_var(item, mv, updated_mod_vars[mv])
-                    updates = True
-                # TYPE 4
-                del updated_mod_vars[mv]
-
-            else:
-                if current_mod_vars[mv] in updated_mod_vars.values():
-                    # TYPE 2
-                    new_mod_name = get_key(updated_mod_vars, current_mod_vars[mv])
-                    current_mods[mv].name = new_mod_name
-                    del updated_mod_vars[new_mod_name]
-                    updates = True
-                else:
-                    # TYPE 5
-                    item.mods.remove(current_mods[mv])
-                    updates = True
-        db.session.commit()
-
-        for mv in updated_mod_vars:
-            # TYPE 1
-            add_mod_var(item, mv, updated_mod_vars[mv])
-            updates = True
-
-        if updates:
-            flash(f"Success! {item.name} has been updated")
+        edit = plan_edit(item, form.data, categories, sections)
+        if edit.changed:
+            item_name = edit.fields.get('name', item.name)
+            apply_edit(item, edit)
+            bump('menu')
+            db.session.commit()
+            menu_index.expire()
+            flash(f"Success! {item_name} has been updated")
         else:
             flash(f"Error: No changes detected")
 
-        return redirect(url_for('add_menu_item'))
+        return redirect(url_for('.add_menu_item'))
 
     # Set default values for the form
+    current_mod_vars = {mod.name: ','.join([var.name for var in mod.vars]) for mod in item.mods}
     form.name.default, form.price.default, form.category.default, form.section.default, form.description.default \
         = item.name, item.price, item.category.name, item.section.name, item.description
     form.mod1.default, form.mod2.default, form.mod3.default = add_padding(3, list(current_mod_vars))
@@ -894,7 +1441,26 @@ def edit_menu_item(id):
                            item_id=id)
 
 
-@app.route('/remove-menu-item')
+@pos.route('/menu/bulk', methods=['POST'])
+@admin_only
+def bulk_menu_update():
+    """
+    Applies a batch of menu changes in one transaction. See menu_bulk.py for the format.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('operations'), list):
+        return abort(400)
+    try:
+        results = apply_bulk(payload['operations'])
+    except ValueError as error:
+        db.session.rollback()
+        return jsonify({'error': str(error)}), 422
+    db.session.commit()
+    menu_index.expire()
+    return jsonify({'results': results})
+
+
+@pos.route('/remove-menu-item')
 @admin_only
 def remove_menu_item():
     """
@@ -907,10 +1473,13 @@ def remove_menu_item():
     else:
         item.mods = []
         db.session.delete(item)
+        enqueue('cleanup-mods', coalesce=True)
         flash(f"Success: {item.name} has been deleted.")
+    bump('menu')
     db.session.commit()
-    return redirect(url_for('add_menu_item'))
+    menu_index.expire()
+    return redirect(url_for('.add_menu_item'))
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
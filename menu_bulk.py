@@ -0,0 +1,111 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  BULK MENU OPERATIONS
+#  Used by POST /menu/bulk and `flask bulk-menu`. Each operation is one UPDATE over the items it selects; a batch is
+#  applied in one transaction and bumps the menu version once (see versions.py).
+#
+#  {"operations": [
+#      {"op": "reprice", "percent": 10, "category": "DRINKS"},            prices rounded to whole dollars, at least 1
+#      {"op": "status", "status": "inactive", "section": "Tea", "category": "DRINKS"},
+#      {"op": "move", "to_section": "Coffee", "to_category": "DRINKS", "items": [3, 4]},
+#  ]}
+#  Items are selected by any mix of category, section (within category, when both are given) and items (a list of
+#  item ids). Every operation needs at least one of them.
+# ---------------------------------------------------------------------------------------------------------------------
+from tables import db, MenuItem, Category, Section
+from versions import bump
+from sqlalchemy import case, cast, func
+import math
+
+STATUSES = ['active', 'inactive']
+
+
+def find_category(name: str):
+    if not isinstance(name, str):
+        raise ValueError('category must be a category name')
+    category = Category.query.filter_by(name=name.upper()).first()
+    if not category:
+        raise ValueError(f'unknown category {name}')
+    return category
+
+
+def find_sections(name: str, category_name: str = None):
+    if not isinstance(name, str):
+        raise ValueError('section must be a section name')
+    query = Section.query.filter_by(name=name.title())
+    if category_name:
+        query = query.filter_by(category_id=find_category(category_name).id)
+    sections = query.all()
+    if not sections:
+        raise ValueError(f'unknown section {name}')
+    return sections
+
+
+def selected_items(operation: dict):
+    """
+    the WHERE clause of an operation
+    """
+    conditions = []
+    if operation.get('category'):
+        conditions.append(MenuItem.category_id == find_category(operation['category']).id)
+    if operation.get('section'):
+        sections = find_sections(operation['section'], operation.get('category'))
+        conditions.append(MenuItem.section_id.in_([section.id for section in sections]))
+    if operation.get('items'):
+        if not isinstance(operation['items'], list) or \
+                not all(isinstance(item_id, int) and not isinstance(item_id, bool) for item_id in operation['items']):
+            raise ValueError('items must be a list of item ids')
+        conditions.append(MenuItem.id.in_(operation['items']))
+    if not conditions:
+        raise ValueError('choose items by category, section or item ids')
+    return conditions
+
+
+def reprice(operation: dict):
+    percent = operation.get('percent')
+    if isinstance(percent, bool) or not isinstance(percent, (int, float)) or not math.isfinite(percent) \
+            or percent <= -100:
+        raise ValueError('percent must be a number above -100')
+    new_price = cast(func.round(MenuItem.price * (100 + percent) / 100.0), db.Integer)
+    return {'price': case((new_price < 1, 1), else_=new_price)}
+
+
+def set_status(operation: dict):
+    if operation.get('status') not in STATUSES:
+        raise ValueError(f"status must be one of {', '.join(STATUSES)}")
+    return {'status': operation['status']}
+
+
+def move(operation: dict):
+    if not operation.get('to_section'):
+        raise ValueError('to_section is required')
+    sections = find_sections(operation['to_section'], operation.get('to_category'))
+    if len(sections) > 1:
+        raise ValueError(f"{operation['to_section']} is in more than one category, add to_category")
+    return {'section_id': sections[0].id, 'category_id': sections[0].category_id}
+
+
+OPERATIONS = {
+    'reprice': reprice,
+    'status': set_status,
+    'move': move,
+}
+
+
+def apply_bulk(operations: list):
+    """
+    Applies the batch without committing. Returns the number of items each operation changed.
+    Raises ValueError, naming the failing operation, if any operation is invalid.
+    """
+    results = []
+    for index, operation in enumerate(operations):
+        try:
+            if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+                raise ValueError(f"op must be one of {', '.join(OPERATIONS)}")
+            values = OPERATIONS[operation['op']](operation)
+            count = MenuItem.query.filter(*selected_items(operation)).update(values, synchronize_session=False)
+        except ValueError as error:
+            raise ValueError(f'operation {index}: {error}')
+        results.append({'op': operation['op'], 'items': count})
+    if any(result['items'] for result in results):
+        bump('menu')
+    return results
@@ -0,0 +1,127 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  MENU ITEM EDITS
+#  An edit is worked out in memory first (plan_edit), comparing the submitted form with the item, its mods and their
+#  vars as loaded by load_item(). apply_edit() then writes only the differences, in the caller's transaction, with
+#  bulk inserts and deletes on item__mod and mod__var. An edit that changes nothing never reaches the database.
+#
+#  A mod is a name plus a set of vars, and mods are shared: an item gets an existing mod when one has the same name and
+#  vars, otherwise a new one is created. Mods an edit leaves without items are deleted.
+# ---------------------------------------------------------------------------------------------------------------------
+from tables import db, MenuItem, ItemMod, ItemModVar, item__mod, mod__var
+from sqlalchemy import select, exists
+from sqlalchemy.orm import selectinload
+
+ITEM_FIELDS = ['name', 'price', 'category_id', 'section_id', 'description']
+
+
+class MenuEdit:
+    """
+    fields: changed item columns and their new values
+    add_mods: (name, vars) packages to attach, vars as a sorted list of names
+    remove_mod_ids: mods to detach from the item
+    """
+
+    def __init__(self, fields: dict, add_mods: list, remove_mod_ids: list):
+        self.fields = fields
+        self.add_mods = add_mods
+        self.remove_mod_ids = remove_mod_ids
+
+    @property
+    def changed(self):
+        return bool(self.fields or self.add_mods or self.remove_mod_ids)
+
+
+def load_item(item_id: int):
+    """
+    the item with its mods and their vars, in three queries
+    """
+    return MenuItem.query.options(selectinload(MenuItem.mods).selectinload(ItemMod.vars)).filter_by(id=item_id).first()
+
+
+def parse_vars(vars_list: str):
+    """
+    "small, Large,,small" -> ['Large', 'Small']
+    """
+    return sorted({var.strip().title() for var in vars_list.split(',') if var.strip()})
+
+
+def plan_edit(item: MenuItem, data: dict, categories: list, sections: list):
+    """
+    data: AddItemForm data. categories and sections: the lists already loaded for the page (see menu_create())
+    Mods with an empty name or no vars are left out, as in add_menu_item().
+    """
+    category = next(category for category in categories if category.name == data['category'])
+    # section names are only unique within a category
+    same_name = [section for section in sections if section.name == data['section']]
+    section = next((section for section in same_name if section.category_id == category.id), same_name[0])
+    submitted = dict(zip(ITEM_FIELDS, [data['name'], int(data['price']), category.id, section.id,
+                                       data['description']]))
+    fields = {field: value for field, value in submitted.items() if getattr(item, field) != value}
+
+    wanted = {}
+    for i in range(1, 4):
+        mod_name, variations = data['mod' + str(i)].strip().title(), parse_vars(data['vars' + str(i)])
+        if mod_name and variations:
+            wanted[mod_name] = variations
+
+    current = {(mod.name, tuple(sorted(var.name for var in mod.vars))): mod.id for mod in item.mods}
+    wanted_keys = {(mod_name, tuple(variations)) for mod_name, variations in wanted.items()}
+    add_mods = [(mod_name, list(variations)) for mod_name, variations in sorted(wanted_keys - set(current))]
+    remove_mod_ids = [mod_id for key, mod_id in current.items() if key not in wanted_keys]
+    return MenuEdit(fields, add_mods, remove_mod_ids)
+
+
+def apply_edit(item: MenuItem, edit: MenuEdit):
+    """
+    Writes the edit without committing.
+    New mods are inserted before old ones are deleted, so a database that reuses ids (SQLite) can't hand a deleted
+    mod's id, still in the session, to a new one.
+    """
+    if edit.fields:
+        MenuItem.query.filter_by(id=item.id).update(edit.fields, synchronize_session=False)
+
+    if edit.add_mods:
+        mod_ids = [find_or_create_mod(mod_name, variations) for mod_name, variations in resolve_mods(edit.add_mods)]
+        db.session.execute(item__mod.insert(), [{'item_id': item.id, 'mod_id': mod_id} for mod_id in mod_ids])
+
+    if edit.remove_mod_ids:
+        db.session.execute(item__mod.delete().where(item__mod.c.item_id == item.id,
+                                                    item__mod.c.mod_id.in_(edit.remove_mod_ids)))
+        orphans = select(ItemMod.id).where(ItemMod.id.in_(edit.remove_mod_ids),
+                                           ~exists().where(item__mod.c.mod_id == ItemMod.id)).scalar_subquery()
+        db.session.execute(mod__var.delete().where(mod__var.c.mod_id.in_(orphans)))
+        db.session.execute(ItemMod.__table__.delete().where(ItemMod.id.in_(orphans)))
+
+
+def resolve_mods(add_mods: list):
+    """
+    (name, var names) -> (name, var ids), creating the vars that don't exist yet
+    """
+    names = {var for _, variations in add_mods for var in variations}
+    var_ids = dict(db.session.query(ItemModVar.name, ItemModVar.id).filter(ItemModVar.name.in_(names)))
+    new_vars = [ItemModVar(name=name) for name in sorted(names - set(var_ids))]
+    if new_vars:
+        db.session.add_all(new_vars)
+        db.session.flush()
+        var_ids.update({var.name: var.id for var in new_vars})
+    return [(mod_name, sorted(var_ids[var] for var in variations)) for mod_name, variations in add_mods]
+
+
+def find_or_create_mod(mod_name: str, var_ids: list):
+    """
+    id of a mod with exactly this name and these vars; a new mod if there is none
+    """
+    candidates = db.session.query(mod__var.c.mod_id, mod__var.c.var_id) \
+        .join(ItemMod, ItemMod.id == mod__var.c.mod_id).filter(ItemMod.name == mod_name).all()
+    packages = {}
+    for mod_id, var_id in candidates:
+        packages.setdefault(mod_id, []).append(var_id)
+    for mod_id, mod_var_ids in packages.items():
+        if sorted(mod_var_ids) == var_ids:
+            return mod_id
+
+    new_mod = ItemMod(name=mod_name)
+    db.session.add(new_mod)
+    db.session.flush()
+    db.session.execute(mod__var.insert(), [{'mod_id': new_mod.id, 'var_id': var_id} for var_id in var_ids])
+    return new_mod.id
@@ -0,0 +1,229 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  MENU SEARCH
+#  Typeahead over active menu items, answered from memory by /menu/search. Every word of an item's name, description,
+#  section and category is indexed; each word of the query must match one of them:
+#   exact word > prefix ("chi" finds Chicken) > fuzzy, for words with no prefix match ("chiken" finds Chicken), by the
+#   trigrams the two words share
+#  Name matches rank above section and category matches, which rank above description matches.
+#
+#  The index follows the 'menu' counter (see versions.py). It re-reads the counter at most every refresh_seconds, or on
+#  the next search after expire(), and when the counter moved it loads the active items in one query and builds a new
+#  index beside the old one, which searches keep using until the new one is swapped in.
+# ---------------------------------------------------------------------------------------------------------------------
+from tables import db, MenuItem, Category, Section, Version
+from locations import PerLocation
+from bisect import bisect_left
+from collections import Counter
+import heapq
+import re
+import threading
+import time
+import unicodedata
+
+WEIGHTS = {'name': 4, 'section': 2, 'category': 2, 'description': 1}
+PREFIX_MATCH = 0.75
+FUZZY_MATCH = 0.5
+MIN_SIMILARITY = 0.3
+MAX_RESULTS = 50
+
+
+def words(text: str):
+    """
+    "Crème Brûlée (2pc)" -> ['creme', 'brulee', '2pc']
+    """
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode()
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+def trigrams(word: str):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IndexedMenu:
+    """
+    The index over one load of the menu, never changed once built:
+    items: {item_id: {'id', 'name', 'price', 'section', 'category'}}
+    postings: {word: {weight: {item_id}}}, each item under the best field the word appears in, with the sorted list
+    of words for prefix lookups
+    grams: {trigram: {word}}, for fuzzy lookups
+    positions: {item_id: place in name order}, to break ties
+    """
+
+    def __init__(self, rows: list):
+        self.items = {}
+        self._postings = {}
+        self._grams = {}
+        for row in rows:
+            self._add(row)
+        self._sorted = sorted(self._postings)
+        names = sorted(self.items, key=lambda item_id: self.items[item_id]['name'])
+        self._positions = {item_id: position for position, item_id in enumerate(names)}
+
+    def _add(self, row: tuple):
+        item_id, name, price, description, section, category = row
+        self.items[item_id] = {'id': item_id, 'name': name, 'price': price, 'section': section, 'category': category}
+        item_words = {}
+        for field, text in [('name', name), ('section', section), ('category', category),
+                            ('description', description)]:
+            for word in words(text):
+                item_words[word] = max(item_words.get(word, 0), WEIGHTS[field])
+        for word, weight in item_words.items():
+            if word not in self._postings:
+                self._postings[word] = {}
+                for gram in trigrams(word):
+                    self._grams.setdefault(gram, set()).add(word)
+            self._postings[word].setdefault(weight, set()).add(item_id)
+
+    def search(self, terms: list, limit: int):
+        levels = [self._prefix_levels(term) or self._fuzzy_levels(term) for term in terms]
+        if len(levels) == 1:
+            best = self._rank_one(levels[0], limit)
+        else:
+            best = self._rank_all(levels, limit)
+        return [self.items[item_id] for item_id in best]
+
+    def _rank_one(self, levels: list, limit: int):
+        """
+        Takes items level by level, best score first, until there are enough. Only the level that fills the list is
+        ordered, and only as far as needed.
+        """
+        best, seen = [], set()
+        for _, item_ids in levels:
+            new = item_ids - seen
+            best += heapq.nsmallest(limit - len(best), new, key=self._positions.__getitem__)
+            if len(best) == limit:
+                break
+            seen |= new
+        return best
+
+    def _rank_all(self, levels: list, limit: int):
+        """
+        Items matching every term, scored by adding up each term's best level. Only the items in every term's
+        levels are scored, so the most selective term bounds the work.
+        """
+        candidates = set.intersection(*[set().union(*[item_ids for _, item_ids in term_levels])
+                                        for term_levels in levels])
+        scores = dict.fromkeys(candidates, 0)
+        for term_levels in levels:
+            left = set(candidates)
+            for score, item_ids in term_levels:
+                for item_id in left & item_ids:
+                    scores[item_id] += score
+                left -= item_ids
+                if not left:
+                    break
+        return heapq.nsmallest(limit, candidates, key=lambda item_id: (-scores[item_id], self._positions[item_id]))
+
+    def _prefix_levels(self, term: str):
+        """
+        [(score, {item_id})], best score first: the items where term is a word, then those where it starts one,
+        each by field
+        """
+        exact, prefix = {}, {}
+        index = bisect_left(self._sorted, term)
+        while index < len(self._sorted) and self._sorted[index].startswith(term):
+            word = self._sorted[index]
+            for weight, item_ids in self._postings[word].items():
+                if word == term:
+                    exact[weight] = item_ids
+                else:
+                    prefix.setdefault(weight, []).append(item_ids)
+            index += 1
+        levels = [(weight, item_ids) for weight, item_ids in exact.items()] \
+            + [(weight * PREFIX_MATCH, set().union(*sets)) for weight, sets in prefix.items()]
+        return sorted(levels, key=lambda level: -level[0])
+
+    def _fuzzy_levels(self, term: str):
+        """
+        [(score, {item_id})] for the words sharing enough trigrams with term, best score first
+        """
+        if len(term) < 3:
+            return []
+        term_grams = trigrams(term)
+        shared = Counter()
+        for gram in term_grams:
+            shared.update(self._grams.get(gram, ()))
+        levels = []
+        for word, count in shared.items():
+            # a word has len(word) + 1 trigrams, give or take repeats
+            similarity = count / (len(term_grams) + len(word) + 1 - count)
+            if similarity >= MIN_SIMILARITY:
+                levels += [(weight * FUZZY_MATCH * similarity, item_ids)
+                           for weight, item_ids in self._postings[word].items()]
+        return sorted(levels, key=lambda level: -level[0])
+
+class MenuIndex:
+    """
+    The current IndexedMenu, rebuilt when the menu changes. A rebuild is done aside and swapped in, so searches
+    carry on with the old index meanwhile instead of waiting for it.
+    """
+
+    def __init__(self, refresh_seconds: float = 2):
+        self.refresh_seconds = refresh_seconds
+        self.version = None
+        self._checked_at = 0
+        self._refreshing = threading.Lock()
+        self._menu = IndexedMenu([])
+
+    @property
+    def items(self):
+        return self._menu.items
+
+    # -----------------------------------------------------------------------------------------------------------------
+    #  KEEPING UP WITH THE MENU
+    # -----------------------------------------------------------------------------------------------------------------
+    def expire(self):
+        """
+        Call after committing a menu change, so this worker's next search sees it
+        """
+        self._checked_at = 0
+
+    def clear(self):
+        with self._refreshing:
+            self._menu = IndexedMenu([])
+            self.version = None
+            self._checked_at = 0
+
+    def refresh(self):
+        """
+        Needs an app context whenever the index is due for a check. One request at a time checks and rebuilds; the
+        others go on searching the current index, unless there is none yet.
+        """
+        if time.monotonic() - self._checked_at <= self.refresh_seconds:
+            return
+        if not self._refreshing.acquire(blocking=self.version is None):
+            return
+        try:
+            if time.monotonic() - self._checked_at <= self.refresh_seconds:
+                return
+            version = db.session.query(Version.value, Version.changed_at).filter_by(name='menu').first()
+            version = tuple(version) if version else None
+            if self.version is None or version != self.version:
+                self._menu = IndexedMenu(self._load())
+                self.version = version
+            self._checked_at = time.monotonic()
+        finally:
+            self._refreshing.release()
+
+    def _load(self):
+        return db.session.query(MenuItem.id, MenuItem.name, MenuItem.price, MenuItem.description,
+                                Section.name, Category.name) \
+            .outerjoin(Section, Section.id == MenuItem.section_id) \
+            .outerjoin(Category, Category.id == MenuItem.category_id) \
+            .filter(MenuItem.status == 'active').all()
+
+    # -----------------------------------------------------------------------------------------------------------------
+    #  SEARCH
+    # -----------------------------------------------------------------------------------------------------------------
+    def search(self, query: str, limit: int = 10):
+        """
+        The best matches first, as items entries. Call refresh() first to pick up menu changes.
+        """
+        terms = list(dict.fromkeys(words(query)))
+        if not terms:
+            return []
+        return self._menu.search(terms, limit)
+
+
+menu_index = PerLocation(MenuIndex)
@@ -0,0 +1,146 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  ORDER ACTIONS
+#  Shared by the order routes in main.py and the offline sync endpoint (sync.py). None of these commit; the caller
+#  decides where the transaction ends. Each one bumps the "orders" version (see versions.py) in the same transaction.
+# ---------------------------------------------------------------------------------------------------------------------
+from tables import db, MenuItem, ItemModVar, Order, OrderItem
+from floor import seat_table, free_table, TAKE_OUT
+from analytics import record_closed_order
+from versions import bump
+from datetime import datetime
+
+OPEN_STATUSES = ['started', 'submitted']
+
+
+def now():
+    return datetime.now().strftime("%m/%d/%Y %H:%M:%S")
+
+
+def update_order_totals(order: Order, quantity_change: int, subtotal_change: float):
+    """
+    Keeps Order.total and Order.item_count in step with its order_items.
+    The change is applied as an UPDATE relative to the stored value and flushed right away, so it lands in the same
+    transaction as the order_item change and two servers editing one ticket can't overwrite each other's totals.
+    """
+    order.total = Order.total + subtotal_change
+    order.item_count = Order.item_count + quantity_change
+    bump('orders')
+    db.session.flush()
+
+
+def start(table: dict, customer_name: str, user_id: int):
+    """
+    table is a floor board entry. Returns the new order, or None if the table was seated by someone else.
+    """
+    if table['name'] != TAKE_OUT and not seat_table(table['id']):
+        return None
+    new_order = Order(
+        customer_name=customer_name,
+        status='started',
+        created_at=now(),
+        table_id=table['id'],
+        user_id=user_id
+    )
+    db.session.add(new_order)
+    bump('orders')
+    db.session.flush()
+    return new_order
+
+
+def add_item(order: Order, item_id: int, quantity: int, notes: str, var_names: list):
+    """
+    If the exact same item (same notes and vars) is already on the order, its quantity goes up instead.
+    Returns the order_item.
+    """
+    price = db.session.query(MenuItem).get(item_id).price
+
+    similar_items = db.session.query(OrderItem).filter(
+        OrderItem.item_id == item_id,
+        OrderItem.notes == notes,
+        OrderItem.order_id == order.id
+    ).all()
+    for same_item in similar_items:
+        if [var.name for var in same_item.vars] == var_names:
+            old_subtotal = same_item.subtotal
+            same_item.quantity += quantity
+            same_item.subtotal = same_item.quantity * price
+            update_order_totals(order, quantity, same_item.subtotal - old_subtotal)
+            return same_item
+
+    new_order_item = OrderItem(
+        quantity=quantity,
+        notes=notes,
+        subtotal=quantity * price,
+        item_id=item_id,
+        order_id=order.id
+    )
+    db.session.add(new_order_item)
+    update_order_totals(order, quantity, new_order_item.subtotal)
+
+    # associate vars with new ordered item
+    order_item_vars = ItemModVar.query.filter(ItemModVar.name.in_(var_names)).all()
+    new_order_item.vars.extend(order_item_vars)
+    db.session.flush()
+    return new_order_item
+
+
+def has_items(order: Order):
+    """
+    Asks order_item rather than trusting Order.item_count: a count that is off must never get an order deleted
+    """
+    return db.session.query(OrderItem.query.filter_by(order_id=order.id).exists()).scalar()
+
+
+def remove_item(order_item: OrderItem):
+    update_order_totals(order_item.order, -order_item.quantity, -order_item.subtotal)
+    db.session.delete(order_item)
+
+
+def submit(order: Order):
+    """
+    Returns False if there is nothing to submit
+    """
+    if not has_items(order):
+        return False
+    order.status = 'submitted'
+    order.submitted_at = now()
+    bump('orders')
+    return True
+
+
+def finish(order: Order, status: str):
+    """
+    Moves an open order to status with a conditional UPDATE (compare-and-set, as in floor.py), so a retried or
+    double-tapped close or cancel only takes effect once. Returns False if the order was no longer open.
+    """
+    finished = db.session.query(Order).filter(Order.id == order.id, Order.status.in_(OPEN_STATUSES)) \
+        .update({'status': status, 'closed_at': now()}, synchronize_session=False)
+    db.session.expire(order, ['status', 'closed_at'])
+    return bool(finished)
+
+
+def cancel(order: Order):
+    """
+    Orders with items are kept as cancelled, empty ones are deleted.
+    Returns the freed table's floor board entry, or None if the order was already closed or cancelled.
+    """
+    if not finish(order, 'cancelled'):
+        return None
+    table = free_table(order.table)
+    if not has_items(order):
+        db.session.delete(order)
+    bump('orders')
+    return table
+
+
+def close(order: Order):
+    """
+    Returns the freed table's floor board entry, or None if the order was already closed or cancelled: an order is
+    only ever added to the rollups once.
+    """
+    if not finish(order, 'closed'):
+        return None
+    table = free_table(order.table)
+    record_closed_order(order)
+    bump('orders')
+    return table
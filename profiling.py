@@ -0,0 +1,179 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  REQUEST PROFILING
+#  The owner switches profiling on at /profiling, for a list of endpoints (e.g. complete_order, edit_menu_item) and/or a
+#  percentage of all requests. The settings are saved in PROFILE_DIR/settings.json, and every worker reloads them at
+#  most RELOAD_SECONDS later. Each profiled request leaves two files in PROFILE_DIR:
+#   <name>.prof  cProfile stats: python -m pstats <name>.prof, snakeviz <name>.prof
+#   <name>.json  url, status and duration, every SQL statement with its time, and the time spent in each template
+#  While profiling is off, a request costs one clock comparison (plus re-reading settings.json every RELOAD_SECONDS).
+#  No profiler is created and the SQL listener isn't attached to the engine.
+# ---------------------------------------------------------------------------------------------------------------------
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from datetime import datetime
+import cProfile
+import json
+import os
+import pstats
+import random
+import threading
+import time
+
+RELOAD_SECONDS = 5
+
+
+class Profiler:
+    """
+    settings shared by all threads of a worker, plus the SQL statements of the request profiled on each thread
+    """
+
+    def __init__(self):
+        self.endpoints = []
+        self.sample = 0
+        self.next_reload = 0
+        self.listening = False
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.endpoints or self.sample)
+
+    def reload(self, directory: str):
+        try:
+            with open(os.path.join(directory, 'settings.json')) as file:
+                settings = json.load(file)
+        except (OSError, ValueError):
+            settings = {}
+        with self.lock:
+            self.endpoints = settings.get('endpoints', [])
+            self.sample = settings.get('sample', 0)
+            self.next_reload = time.monotonic() + RELOAD_SECONDS
+            if self.enabled != self.listening:
+                for name, listener in [('before_cursor_execute', before_execute),
+                                       ('after_cursor_execute', after_execute)]:
+                    (event.listen if self.enabled else event.remove)(Engine, name, listener)
+                self.listening = self.enabled
+
+    def wants(self, endpoint: str):
+        if endpoint and (endpoint in self.endpoints or endpoint.split('.')[-1] in self.endpoints):
+            return True
+        return random.random() * 100 < self.sample
+
+
+profiler = Profiler()
+
+
+def save_settings(directory: str, endpoints: list, sample: float):
+    """
+    writes the settings for every worker and applies them to this one right away
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'settings.json')
+    with open(path + '.tmp', 'w') as file:
+        json.dump({'endpoints': endpoints, 'sample': sample}, file)
+    os.replace(path + '.tmp', path)
+    profiler.reload(directory)
+
+
+def before_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(profiler.local, 'statements', None) is not None:
+        context.profile_start = time.perf_counter()
+
+
+def after_execute(conn, cursor, statement, parameters, context, executemany):
+    statements = getattr(profiler.local, 'statements', None)
+    if statements is not None and hasattr(context, 'profile_start'):
+        statements.append({'statement': statement, 'parameters': repr(parameters)[:500],
+                           'ms': round((time.perf_counter() - context.profile_start) * 1000, 3)})
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  REQUEST HOOKS
+# ---------------------------------------------------------------------------------------------------------------------
+def start_profile():
+    """
+    before_request hook
+    """
+    if time.monotonic() >= profiler.next_reload:
+        profiler.reload(current_app.config['PROFILE_DIR'])
+    if not profiler.enabled or not profiler.wants(request.endpoint):
+        return
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # another profiler is already running on this interpreter (Python 3.12+ allows only one)
+        return
+    profiler.local.statements = []
+    g.profile = (profile, time.perf_counter())
+
+
+def stop_profile(response):
+    """
+    after_request hook, registered first so it runs after every other after_request hook
+    """
+    if 'profile' not in g:
+        return response
+    profile, start = g.pop('profile')
+    profile.disable()
+    statements, profiler.local.statements = profiler.local.statements, None
+    elapsed = (time.perf_counter() - start) * 1000
+
+    directory = current_app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    endpoint = (request.endpoint or 'unknown').split('.')[-1]
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{endpoint}-{elapsed:.0f}ms-{random.randrange(16 ** 4):04x}"
+    stats = pstats.Stats(profile)
+    stats.dump_stats(os.path.join(directory, name + '.prof'))
+    with open(os.path.join(directory, name + '.json'), 'w') as file:
+        json.dump({
+            'name': name,
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'url': request.full_path,
+            'status': response.status_code,
+            'ms': round(elapsed, 3),
+            'sql_ms': round(sum(statement['ms'] for statement in statements), 3),
+            'sql': statements,
+            'templates': template_times(stats),
+        }, file, indent=1)
+    return response
+
+
+def template_times(stats: pstats.Stats):
+    """
+    Jinja compiles each template to Python functions whose code carries the template's file name, so the time spent
+    in a template is the time cProfile recorded for functions in that file.
+    total_ms: time from entering the template's root function to leaving it, included templates and all
+    self_ms: time spent in the template's own code
+    """
+    templates = {}
+    for (filename, _, function), (_, _, self_time, total_time, _) in stats.stats.items():
+        if not filename.endswith('.html'):
+            continue
+        entry = templates.setdefault(os.path.basename(filename), {'total_ms': 0, 'self_ms': 0})
+        entry['self_ms'] += self_time * 1000
+        if function == 'root':
+            entry['total_ms'] += total_time * 1000
+    return {name: {key: round(value, 3) for key, value in entry.items()}
+            for name, entry in sorted(templates.items(), key=lambda item: -item[1]['total_ms'])}
+
+
+def recent_captures(directory: str, limit: int = 50):
+    """
+    summaries of the newest captures, newest first
+    """
+    try:
+        names = sorted((name for name in os.listdir(directory) if name.endswith('.json') and name[0].isdigit()),
+                       reverse=True)[:limit]
+    except OSError:
+        return []
+    captures = []
+    for name in names:
+        with open(os.path.join(directory, name)) as file:
+            capture = json.load(file)
+        summary = {key: capture[key] for key in ['name', 'endpoint', 'method', 'url', 'status', 'ms', 'sql_ms']}
+        captures.append({**summary, 'queries': len(capture['sql'])})
+    return captures
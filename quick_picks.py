@@ -0,0 +1,83 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  QUICK PICKS
+#  The items a server orders most at this time of day, shown above the menu on the order screen so they take one tap.
+#  Ranked from PopularityRollup (kept up to date as orders close, see analytics.py): the server's own favourites
+#  first, topped up with the whole house's for the daypart when the server has little history yet.
+#
+#  Lists are cached per worker and location as item ids for refresh_seconds, so the order screen normally costs no
+#  extra queries: the ids are looked up in the active menu the page has already loaded. One more closed order hardly
+#  moves a ranking, so closing orders doesn't expire the cache. The order screen's ETag includes the list, so a new one
+#  (after refresh_seconds, or at the next daypart) reaches tablets that revalidate.
+# ---------------------------------------------------------------------------------------------------------------------
+from tables import db, MenuItem, PopularityRollup
+from analytics import daypart_of
+from locations import PerLocation
+from sqlalchemy import func
+from datetime import datetime
+import threading
+import time
+
+QUICK_PICKS = 8
+
+
+class QuickPicks:
+    """
+    {(user_id, daypart): (loaded_at, loaded_at as wall time, [item_id])}
+    """
+
+    def __init__(self, refresh_seconds: float = 300, size: int = QUICK_PICKS):
+        self.refresh_seconds = refresh_seconds
+        self.size = size
+        self._lists = {}
+        self._lock = threading.Lock()
+
+    def _load(self, user_id: int, daypart: str):
+        active = db.session.query(MenuItem.id).filter(MenuItem.status == 'active')
+        own = db.session.query(PopularityRollup.item_id) \
+            .filter(PopularityRollup.user_id == user_id, PopularityRollup.daypart == daypart,
+                    PopularityRollup.item_id.in_(active)) \
+            .order_by(PopularityRollup.quantity.desc(), PopularityRollup.item_id).limit(self.size)
+        item_ids = [item_id for item_id, in own]
+        if len(item_ids) < self.size:
+            house = db.session.query(PopularityRollup.item_id) \
+                .filter(PopularityRollup.daypart == daypart, PopularityRollup.item_id.in_(active)) \
+                .group_by(PopularityRollup.item_id) \
+                .order_by(func.sum(PopularityRollup.quantity).desc(), PopularityRollup.item_id).limit(self.size * 2)
+            item_ids += [item_id for item_id, in house if item_id not in item_ids]
+        return item_ids[:self.size]
+
+    def item_ids(self, user_id: int, daypart: str = None):
+        """
+        Needs an app context whenever the list is due for a refresh
+        """
+        return self._cached(user_id, daypart)[2]
+
+    def stamp(self, user_id: int):
+        """
+        For the order screen's ETag (see versions.conditional): (the server's current list, when it was loaded)
+        """
+        _, loaded_at, item_ids = self._cached(user_id)
+        return tuple(item_ids), loaded_at
+
+    def _cached(self, user_id: int, daypart: str = None):
+        key = (user_id, daypart or daypart_of(datetime.now().hour))
+        cached = self._lists.get(key)
+        if cached is None or time.monotonic() - cached[0] > self.refresh_seconds:
+            cached = (time.monotonic(), time.time(), self._load(*key))
+            with self._lock:
+                self._lists[key] = cached
+        return cached
+
+    def items(self, user_id: int, menu: list):
+        """
+        The quick picks found in menu (active MenuItems), in order
+        """
+        by_id = {item.id: item for item in menu}
+        return [by_id[item_id] for item_id in self.item_ids(user_id) if item_id in by_id]
+
+    def clear(self):
+        with self._lock:
+            self._lists = {}
+
+
+quick_picks = PerLocation(QuickPicks)
@@ -0,0 +1,85 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  READ REPLICA
+#  With DB_READ_URL set (LOCATION_READ_URL, with {location} in it, for several locations - see locations.py), views
+#  decorated with @read_replica run their SELECTs on a read-only copy of the database: order lists, history and
+#  reports no longer compete with order entry on the primary. Everything else goes to the primary, and so does any
+#  write, even from a replica view. Menu details stay on the primary, like the menu pages that link to them.
+#  Read-your-writes: a replica can be a little behind, so for READ_YOUR_WRITES_SECONDS after a request writes, that
+#  user's requests read from the primary too (the time is kept in their session). A server who just closed an order
+#  sees it closed on the orders page they are sent back to.
+#
+#  Locally: point DB_READ_URL at a second SQLite file and copy the primary into it with `flask refresh-replica`.
+# ---------------------------------------------------------------------------------------------------------------------
+from flask import session, g, has_request_context
+from flask_sqlalchemy import SignallingSession, get_state
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+from functools import wraps
+import time
+
+REPLICA = 'replica'
+
+
+def replica_url(app):
+    """
+    The replica's URL for the default database, or its template with several locations; None without a replica
+    """
+    return app.config['LOCATION_READ_URL'] if app.config['LOCATIONS'] else app.config['DB_READ_URL']
+
+
+def read_replica(function):
+    """
+    Decorator for views that only read: their queries may be answered by the replica
+    """
+    @wraps(function)
+    def decorated_function(*args, **kwargs):
+        g.read_replica = True
+        return function(*args, **kwargs)
+    return decorated_function
+
+
+def reads_from_replica(app):
+    if not has_request_context() or not g.get('read_replica') or g.get('wrote') or not replica_url(app):
+        return False
+    return time.time() - session.get('wrote_at', 0) > app.config['READ_YOUR_WRITES_SECONDS']
+
+
+def remember_writes(response):
+    """
+    after_request: starts the user's read-your-writes window when the request wrote
+    """
+    if g.get('wrote'):
+        session['wrote_at'] = time.time()
+    return response
+
+
+class ReplicaSession(SignallingSession):
+    """
+    Sends SELECTs to the replica where reads_from_replica(), and notes writes for remember_writes()
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            if has_request_context():
+                g.wrote = True
+        elif isinstance(clause, Select) and reads_from_replica(self.app):
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA)
+        return super().get_bind(mapper, clause)
+
+
+def refresh_replica(primary, replica):
+    """
+    SQLite only: copies the primary database over the replica, for trying the replica out locally.
+    Returns the time taken in ms.
+    """
+    if primary.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        raise ValueError('Only SQLite replicas can be refreshed here; PostgreSQL replicas follow the primary by '
+                         'streaming replication.')
+    start = time.perf_counter()
+    source, target = primary.raw_connection(), replica.raw_connection()
+    try:
+        source.dbapi_connection.backup(target.dbapi_connection)
+    finally:
+        source.close()
+        target.close()
+    return (time.perf_counter() - start) * 1000
@@ -0,0 +1,107 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  DATABASE SNAPSHOTS
+#  Saves the whole database under a name and puts it back in one step, for training/staging resets and tests:
+#  seed a database once (import-data, users, tables), save it, and restore it instead of rebuilding it.
+#   SQLite:     SNAPSHOT_DIR/<name>.sqlite, copied both ways with SQLite's online backup API
+#   PostgreSQL: SNAPSHOT_DIR/<name>/<table>.copy, one binary COPY per table; restored with one TRUNCATE of every table
+#               and a COPY FROM per table, in one transaction, then the id sequences are moved past the restored ids
+#  With several locations (see locations.py), each one's snapshots are in its own folder under SNAPSHOT_DIR.
+# ---------------------------------------------------------------------------------------------------------------------
+from flask import current_app
+from tables import db
+from locations import location_dir
+from floor import board
+from menu_search import menu_index
+from quick_picks import quick_picks
+from versions import bump
+import os
+import re
+import sqlite3
+import time
+
+
+def snapshot_path(name: str):
+    if not re.fullmatch(r'[\w-]{1,50}', name):
+        raise ValueError('Snapshot names may only contain letters, numbers, "-" and "_"')
+    directory = location_dir(current_app.config['SNAPSHOT_DIR'])
+    os.makedirs(directory, exist_ok=True)
+    if db.engine.dialect.name == 'sqlite':
+        return os.path.join(directory, name + '.sqlite')
+    return os.path.join(directory, name)
+
+
+def list_snapshots():
+    directory = location_dir(current_app.config['SNAPSHOT_DIR'])
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name.rsplit('.sqlite', 1)[0] for name in os.listdir(directory))
+
+
+def quoted(table):
+    return db.engine.dialect.identifier_preparer.format_table(table)
+
+
+def save_snapshot(name: str):
+    """
+    Returns the time taken in ms. Raises ValueError for a bad name.
+    """
+    path = snapshot_path(name)
+    start = time.perf_counter()
+    db.session.remove()
+    connection = db.engine.raw_connection()
+    try:
+        if db.engine.dialect.name == 'sqlite':
+            target = sqlite3.connect(path)
+            with target:
+                connection.dbapi_connection.backup(target)
+            target.close()
+        else:
+            os.makedirs(path, exist_ok=True)
+            with connection.cursor() as cursor:
+                for table in db.metadata.sorted_tables:
+                    with open(os.path.join(path, table.name + '.copy'), 'wb') as file:
+                        cursor.copy_expert(f'COPY {quoted(table)} TO STDOUT WITH (FORMAT binary)', file)
+            connection.commit()
+    finally:
+        connection.close()
+    return (time.perf_counter() - start) * 1000
+
+
+def restore_snapshot(name: str):
+    """
+    Replaces every table with the snapshot's rows. Returns the time taken in ms.
+    Raises ValueError for a bad name or a snapshot that doesn't exist.
+    """
+    path = snapshot_path(name)
+    if not os.path.exists(path):
+        raise ValueError(f'No snapshot named {name}')
+    start = time.perf_counter()
+    db.session.remove()
+    connection = db.engine.raw_connection()
+    try:
+        if db.engine.dialect.name == 'sqlite':
+            source = sqlite3.connect(path)
+            source.backup(connection.dbapi_connection)
+            source.close()
+        else:
+            tables = db.metadata.sorted_tables
+            with connection.cursor() as cursor:
+                cursor.execute(f"TRUNCATE {', '.join(quoted(table) for table in tables)}")
+                for table in tables:
+                    with open(os.path.join(path, table.name + '.copy'), 'rb') as file:
+                        cursor.copy_expert(f'COPY {quoted(table)} FROM STDIN WITH (FORMAT binary)', file)
+                for table in tables:
+                    if 'id' in table.c and table.c.id.autoincrement is not False:
+                        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                                       f"coalesce(max(id), 0) + 1, false) FROM {quoted(table)}")
+            connection.commit()
+    finally:
+        connection.close()
+
+    # rows changed underneath every cache and every page ETag
+    board.clear()
+    menu_index.clear()
+    quick_picks.clear()
+    bump('menu', 'orders')
+    db.session.commit()
+    return (time.perf_counter() - start) * 1000
@@ -0,0 +1,152 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  OFFLINE SYNC
+#  Devices queue order operations while the Wi-Fi is down and send them to /sync in one batch when it comes back.
+#  Every operation carries a client-generated key. A batch is applied in order in one transaction, and keys that were
+#  already applied are answered from idempotency_key instead of being applied twice.
+#
+#  {"operations": [
+#      {"key": "k1", "op": "start", "table": "Table 1", "customer_name": "Kim"},
+#      {"key": "k2", "op": "add_item", "order_key": "k1", "item_id": 3, "quantity": 2, "notes": "", "vars": ["Sweet"]},
+#      {"key": "k3", "op": "delete_item", "order_item_id": 12},
+#      {"key": "k4", "op": "submit", "order_id": 7},            also: "cancel", "close"
+#  ]}
+#  Orders are referenced by order_id, or by order_key (the key of the "start" operation that created them).
+# ---------------------------------------------------------------------------------------------------------------------
+from tables import db, MenuItem, Order, OrderItem, IdempotencyKey
+from floor import board, TAKE_OUT
+import orders
+import json
+
+
+class SyncError(Exception):
+    """
+    An operation that can't be applied. The whole batch is rolled back.
+    """
+
+    def __init__(self, message: str, index: int = None, key: str = None):
+        super().__init__(message)
+        self.index = index
+        self.key = key
+
+
+def is_int(value):
+    # bool is an int too, but true is not a quantity or an id
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def find_order(operation: dict, user, applied: dict):
+    order_id = operation.get('order_id')
+    if operation.get('order_key'):
+        order_id = applied.get(operation['order_key'], {}).get('order_id')
+    order = Order.query.get(order_id) if is_int(order_id) else None
+    if not order or (user.id != 1 and order.user_id != user.id):
+        raise SyncError('order not found')
+    if order.status not in orders.OPEN_STATUSES:
+        raise SyncError(f'order #{order.id} is already {order.status}')
+    return order
+
+
+def apply_start(operation: dict, user, applied: dict):
+    table = board.find(operation.get('table'))
+    if not table or table['status'] != 'available':
+        raise SyncError(f"{operation.get('table')} is not available")
+    if Order.query.filter_by(user_id=user.id, status='started').first():
+        raise SyncError('an order is already started')
+    new_order = orders.start(table, operation.get('customer_name') or 'Guest', user.id)
+    if not new_order:
+        raise SyncError(f"{table['name']} was just seated by someone else")
+    table_change = None if table['name'] == TAKE_OUT else {**table, 'status': 'unavailable'}
+    return {'order_id': new_order.id}, table_change
+
+
+def apply_add_item(operation: dict, user, applied: dict):
+    order = find_order(operation, user, applied)
+    quantity, notes, var_names = operation.get('quantity', 1), operation.get('notes', ''), operation.get('vars', [])
+    item = MenuItem.query.get(operation['item_id']) if is_int(operation.get('item_id')) else None
+    if not item or item.status != 'active':
+        raise SyncError('menu item not found')
+    if not is_int(quantity) or quantity < 1:
+        raise SyncError('quantity must be a positive number')
+    if not isinstance(notes, str) or len(notes) > 200:
+        raise SyncError('notes must be text of up to 200 characters')
+    if not isinstance(var_names, list) or not all(isinstance(name, str) for name in var_names):
+        raise SyncError('vars must be a list of var names')
+    order_item = orders.add_item(order, item.id, quantity, notes, var_names)
+    return {'order_id': order.id, 'order_item_id': order_item.id}, None
+
+
+def apply_delete_item(operation: dict, user, applied: dict):
+    order_item_id = operation.get('order_item_id')
+    order_item = OrderItem.query.get(order_item_id) if is_int(order_item_id) else None
+    if not order_item:
+        raise SyncError('order item not found')
+    order = find_order({'order_id': order_item.order_id}, user, applied)
+    orders.remove_item(order_item)
+    return {'order_id': order.id}, None
+
+
+def apply_submit(operation: dict, user, applied: dict):
+    order = find_order(operation, user, applied)
+    if not orders.submit(order):
+        raise SyncError(f'order #{order.id} has no items')
+    return {'order_id': order.id}, None
+
+
+def apply_cancel(operation: dict, user, applied: dict):
+    order = find_order(operation, user, applied)
+    table = orders.cancel(order)
+    if table is None:
+        raise SyncError(f'order #{order.id} was just closed by someone else')
+    return {'order_id': order.id}, table
+
+
+def apply_close(operation: dict, user, applied: dict):
+    order = find_order(operation, user, applied)
+    table = orders.close(order)
+    if table is None:
+        raise SyncError(f'order #{order.id} was just closed by someone else')
+    return {'order_id': order.id}, table
+
+
+OPERATIONS = {
+    'start': apply_start,
+    'add_item': apply_add_item,
+    'delete_item': apply_delete_item,
+    'submit': apply_submit,
+    'cancel': apply_cancel,
+    'close': apply_close,
+}
+
+
+def apply_operations(operations: list, user):
+    """
+    Applies the batch in order without committing.
+    Returns one result per operation and the floor board entries to update once the caller has committed.
+    Raises SyncError, with the index and key of the failing operation, if any operation can't be applied.
+    """
+    keys = [operation.get('key') for operation in operations if isinstance(operation, dict)]
+    applied = {row.key: json.loads(row.result)
+               for row in IdempotencyKey.query.filter(IdempotencyKey.key.in_(keys), IdempotencyKey.user_id == user.id)}
+
+    results, table_changes = [], []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or not isinstance(operation.get('key'), str) \
+                or not 0 < len(operation['key']) <= 64:
+            raise SyncError('every operation needs a key of up to 64 characters', index)
+        key = operation['key']
+        if key in applied:
+            results.append({'key': key, 'duplicate': True, **applied[key]})
+            continue
+        if operation.get('op') not in OPERATIONS:
+            raise SyncError(f"unknown operation {operation.get('op')}", index, key)
+
+        try:
+            result, table_change = OPERATIONS[operation['op']](operation, user, applied)
+        except SyncError as error:
+            raise SyncError(str(error), index, key)
+        db.session.add(IdempotencyKey(key=key, user_id=user.id, result=json.dumps(result), created_at=orders.now()))
+        applied[key] = result
+        results.append({'key': key, 'duplicate': False, **result})
+        if table_change:
+            table_changes.append(table_change)
+    return results, table_changes
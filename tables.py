@@ -1,8 +1,35 @@
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, event, inspect, literal, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import relationship
 from flask_login import UserMixin
+from locations import LocationSQLAlchemy
+import sqlite3
+
+# bound to the location being served, see locations.py
+db = LocationSQLAlchemy()
+
+
+@event.listens_for(Engine, 'connect')
+def sqlite_write_ahead_log(dbapi_connection, connection_record):
+    """
+    SQLite only: in its default journal mode a commit waits for every reader to finish, and a request that starts
+    writing meanwhile fails at once with "database is locked" instead of waiting its turn - which threaded workers hit
+    under load. With a write-ahead log readers never hold up a commit, and writers queue for the lock.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+
+def sortable_timestamp(column):
+    """
+    Timestamps are stored as "%m/%d/%Y %H:%M:%S" strings, which don't sort or compare by date.
+    Rewrites the column as "%Y-%m-%d %H:%M:%S" in SQL (works on SQLite and PostgreSQL)
+    """
+    def part(start, length):
+        return func.substr(column, start, length, type_=db.String)
+
+    return part(7, 4) + '-' + part(1, 2) + '-' + part(4, 2) + ' ' + part(12, 8)
 
-db = SQLAlchemy()
 
 # ---------------------------------------------------------------------------------------------------------------------
 #  CONFIGURE DATABASE TABLES
@@ -120,15 +147,18 @@ class Order(db.Model):
     __tablename__ = "order"
     id = db.Column(db.Integer, primary_key=True)
     customer_name = db.Column(db.String(50), nullable=False)
-    status = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(100), nullable=False, index=True)
     created_at = db.Column(db.String(100), nullable=False)
     submitted_at = db.Column(db.String(100))
     closed_at = db.Column(db.String(100))
+    # denormalized from order_items, kept in sync by update_order_totals() in orders.py
+    total = db.Column(db.Float, nullable=False, default=0)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
     table = relationship("Table", back_populates="orders")
-    table_id = db.Column(db.Integer, db.ForeignKey("table.id"))
+    table_id = db.Column(db.Integer, db.ForeignKey("table.id"), index=True)
     order_items = relationship("OrderItem", back_populates="order")
     user = relationship("User", back_populates="orders")
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), index=True)
 
 
 # Created because of Many-to-Many Relationship between Order and Items
@@ -143,3 +173,189 @@ class OrderItem(db.Model):
     order = relationship("Order", back_populates="order_items")
     order_id = db.Column(db.Integer, db.ForeignKey("order.id"))
     vars = relationship("ItemModVar", secondary=order_item__var, back_populates="order_items")
+
+
+class IdempotencyKey(db.Model):
+    """
+    one row per operation applied through /sync (see sync.py), so a retried operation is only applied once
+    key: chosen by the client, unique per user (two devices may pick the same key)
+    result: JSON returned to the client, replayed when the key comes back
+    """
+    __tablename__ = "idempotency_key"
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    result = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.String(100), nullable=False)
+    __table_args__ = (db.Index('ix_idempotency_key_user_id_key', 'user_id', 'key', unique=True),)
+
+
+class ExportLog(db.Model):
+    """
+    one row per incremental order history export (see export.py)
+    high_water: sortable closed_at ("%Y-%m-%d %H:%M:%S") the export stopped at; the next one starts there
+    """
+    __tablename__ = "export_log"
+    id = db.Column(db.Integer, primary_key=True)
+    exported_at = db.Column(db.String(100), nullable=False)
+    high_water = db.Column(db.String(19), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+
+
+class Version(db.Model):
+    """
+    change counters behind the ETags of cached pages (see versions.py)
+    name: "menu" (items, mods, categories, sections) or "orders" (orders, order items, tables)
+    changed_at: unix time of the last bump, sent as Last-Modified
+    """
+    __tablename__ = "version"
+    name = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.Float, nullable=False)
+
+
+class Job(db.Model):
+    """
+    background work, run by `flask worker` (see jobs.py)
+    status options: queued, running, done, failed
+    key: set for jobs that must only ever be queued once (e.g. one close-out per business day)
+    created_at, run_after, started_at, finished_at: unix times
+    """
+    __tablename__ = "job"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    key = db.Column(db.String(100), unique=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    created_at = db.Column(db.Float, nullable=False)
+    run_after = db.Column(db.Float, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(100))
+    started_at = db.Column(db.Float)
+    finished_at = db.Column(db.Float)
+    result = db.Column(db.Text)
+    __table_args__ = (db.Index('ix_job_status_run_after', 'status', 'run_after'),)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  SALES ROLLUPS - maintained by analytics.py
+#  hour is "%Y-%m-%d %H" and day is "%Y-%m-%d" of closed_at. ids are plain integers so rollups survive deleted rows.
+# ---------------------------------------------------------------------------------------------------------------------
+class OrderRollup(db.Model):
+    """
+    closed orders per hour, server and table
+    """
+    __tablename__ = "order_rollup"
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.String(13), nullable=False, index=True)
+    user_id = db.Column(db.Integer)
+    table_id = db.Column(db.Integer)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('hour', 'user_id', 'table_id'),)
+
+
+class SalesRollup(db.Model):
+    """
+    closed line items per day and menu item
+    """
+    __tablename__ = "sales_rollup"
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.String(10), nullable=False, index=True)
+    item_id = db.Column(db.Integer)
+    category_id = db.Column(db.Integer)
+    section_id = db.Column(db.Integer)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('day', 'item_id'),)
+
+
+class ModRollup(db.Model):
+    """
+    quantity ordered per day, menu item and var (see order_item__var)
+    """
+    __tablename__ = "mod_rollup"
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.String(10), nullable=False, index=True)
+    item_id = db.Column(db.Integer)
+    var_id = db.Column(db.Integer)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('day', 'item_id', 'var_id'),)
+
+
+class PopularityRollup(db.Model):
+    """
+    quantity ordered per server, daypart (see analytics.DAYPARTS) and menu item, over all time
+    """
+    __tablename__ = "popularity_rollup"
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, index=True)
+    daypart = db.Column(db.String(10), nullable=False)
+    item_id = db.Column(db.Integer)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('user_id', 'daypart', 'item_id'),)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  SCHEMA UPGRADES
+# ---------------------------------------------------------------------------------------------------------------------
+# indexes the models no longer have, dropped by upgrade_schema(): keys used to be unique across all users
+RETIRED_INDEXES = {'idempotency_key': ['ix_idempotency_key_key']}
+
+
+def backfill_order_totals():
+    """
+    Order.total and Order.item_count, recomputed from order_item for every order
+    """
+    items = db.session.query(OrderItem).filter(OrderItem.order_id == Order.id)
+    db.session.query(Order).update({
+        'total': func.coalesce(items.with_entities(func.sum(OrderItem.subtotal)).scalar_subquery(), 0),
+        'item_count': func.coalesce(items.with_entities(func.sum(OrderItem.quantity)).scalar_subquery(), 0),
+    }, synchronize_session=False)
+
+
+# columns worked out from other tables: when upgrade_schema() adds one, existing rows are filled in from the start
+BACKFILLS = {'order.total': backfill_order_totals, 'order.item_count': backfill_order_totals}
+
+
+def upgrade_schema():
+    """
+    Used by `flask init-db`, after create_all(), which only creates missing tables.
+    Brings tables that already exist up to the models: adds missing columns (NOT NULL ones with their default as the
+    value for existing rows, or the values BACKFILLS works out), creates missing indexes and drops RETIRED_INDEXES.
+    Doesn't commit.
+    Returns what it changed, as ["table.column", "index name", ...].
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    changes = []
+    for table in db.metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            ddl = f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} ' \
+                  f'{column.type.compile(dialect=engine.dialect)}'
+            if column.default is not None and column.default.is_scalar:
+                value = literal(column.default.arg).compile(dialect=engine.dialect,
+                                                           compile_kwargs={'literal_binds': True})
+                ddl += f' DEFAULT {value}' + ('' if column.nullable else ' NOT NULL')
+            db.session.execute(text(ddl))
+            changes.append(f'{table.name}.{column.name}')
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for name in RETIRED_INDEXES.get(table.name, []):
+            if name in existing_indexes:
+                db.session.execute(text(f'DROP INDEX {preparer.quote(name)}'))
+                changes.append(f'dropped {name}')
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(db.session.connection())
+                changes.append(index.name)
+
+    # once every column is there: a backfill may read the other new columns
+    for backfill in {BACKFILLS[change]: None for change in changes if change in BACKFILLS}:
+        backfill()
+    return changes
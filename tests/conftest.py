@@ -0,0 +1,75 @@
+import os
+import sys
+
+# the app is a set of top-level modules in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def environment(tmp_path):
+    """
+    The environment create_app() reads; test modules override this fixture to add to it
+    """
+    return {}
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, environment):
+    """
+    The app on a fresh SQLite file with every table created, CSRF off for posting forms
+    """
+    import main
+    from tables import db
+    from floor import board
+    from menu_search import menu_index
+    from quick_picks import quick_picks
+    monkeypatch.setenv('DB_URL', f"sqlite:///{tmp_path / 'pos.db'}")
+    monkeypatch.setenv('SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    monkeypatch.setenv('ARCHIVE_DIR', str(tmp_path / 'archive'))
+    for name, value in environment.items():
+        monkeypatch.setenv(name, value)
+    app = main.create_app({'TESTING': True, 'WTF_CSRF_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+        main.ensure_versions()
+        db.session.commit()
+        # the caches outlive an app: drop what the last test's database left in them
+        board.clear()
+        menu_index.clear()
+        quick_picks.clear()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    """
+    A test client logged in as the setup account, with the sample menu loaded
+    """
+    client = app.test_client()
+    client.get('/')
+    client.get('/import-data')
+    return client
+
+
+@pytest.fixture
+def log_in_server(app, client):
+    """
+    log_in_server('Kim') adds a server and returns a test client logged in as them
+    """
+    from tables import db, Role, User
+    from werkzeug.security import generate_password_hash
+
+    def log_in(name: str):
+        with app.app_context():
+            role = Role.query.filter_by(name='Server').first() or Role(name='Server')
+            user = User(full_name=name, email=f'{name.lower()}@test.local', status='active', role=role,
+                        password=generate_password_hash('secret', method='pbkdf2:sha256', salt_length=8))
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+        server = app.test_client()
+        assert server.post('/login', data={'employee_id': user_id, 'password': 'secret'}).status_code == 302
+        return server
+    return log_in
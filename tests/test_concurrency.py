@@ -0,0 +1,71 @@
+"""
+Servers entering orders at the same time, as threaded workers serve them (see gunicorn.conf.py, bench_concurrency.py):
+no session, flash message or db.session leaks from one request into another, and every order ends up with exactly
+what its server entered
+"""
+import random
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+from tables import Order
+
+CLIENTS = 6
+ORDERS_EACH = 3
+
+
+def enter_order(server, name, item_ids):
+    """
+    One order from start to close, checking every page is about this order. Returns (order_id, {item_id: quantity}).
+    """
+    assert server.post('/start-order', data={'table': 'Take Out', 'name': name}).status_code == 302
+    quantities, order_id = {}, None
+    for item_id in random.sample(item_ids, 2):
+        quantity = random.randint(1, 3)
+        redirect = server.post('/complete-order', data={'item_id': item_id, 'quantity': quantity, 'notes': name,
+                                                        'mod1': 'null', 'mod2': 'null', 'mod3': 'null'})
+        redirected_id = int(parse_qs(urlsplit(redirect.location).query)['id'][0])
+        assert order_id in (None, redirected_id), f'{name}: items went to orders {order_id} and {redirected_id}'
+        order_id = redirected_id
+        quantities[item_id] = quantities.get(item_id, 0) + quantity
+    assert f' - {name}</span>'.encode() in server.get(f'/complete-order?id={order_id}').data, \
+        f"{name}: the order page shows someone else's order"
+
+    for path, message in [(f'/submit-order?id={order_id}', f'ORDER #{order_id} submitted'),
+                          (f'/close-order?id={order_id}', f'Order #{order_id} for {name} closed')]:
+        assert server.get(path).status_code == 302
+        assert message.encode() in server.get('/orders').data, f'{name}: expected the flash "{message}"'
+    return order_id, quantities
+
+
+def test_concurrent_servers_only_see_their_own_orders(app, client, log_in_server):
+    servers = [log_in_server(f'Server{number}') for number in range(CLIENTS)]
+    item_ids = list(range(1, 11))
+    start = threading.Barrier(CLIENTS)
+    entered, errors = [], []
+
+    def enter_orders(number, server):
+        start.wait()
+        try:
+            for count in range(ORDERS_EACH):
+                name = f'S{number}-{count}'
+                entered.append((name, *enter_order(server, name, item_ids)))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=enter_orders, args=args) for args in enumerate(servers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(entered) == CLIENTS * ORDERS_EACH
+    with app.app_context():
+        for name, order_id, quantities in entered:
+            order = Order.query.get(order_id)
+            found = {}
+            for order_item in order.order_items:
+                assert order_item.notes == name
+                found[order_item.item_id] = found.get(order_item.item_id, 0) + order_item.quantity
+            assert (order.customer_name, order.status, found) == (name, 'closed', quantities)
+            assert order.user.full_name == f"Server{name[1:].split('-')[0]}"
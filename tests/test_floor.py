@@ -0,0 +1,61 @@
+"""
+Seating a table is a compare-and-set (see floor.seat_table): however many servers try at once, exactly one wins.
+Live floor updates (/floor/stream) are capped per worker so tablets can't take every thread.
+"""
+import threading
+
+from floor import seat_table, streams
+from tables import db, Table
+
+
+def test_concurrent_seating_seats_the_table_once(app):
+    with app.app_context():
+        table = Table(name='T1', status='available')
+        db.session.add(table)
+        db.session.commit()
+        table_id = table.id
+
+    threads = 20
+    start = threading.Barrier(threads)
+    results, errors = [], []
+
+    def attempt():
+        with app.app_context():
+            start.wait()
+            try:
+                results.append(seat_table(table_id))
+                db.session.commit()
+            except Exception as error:
+                db.session.rollback()
+                errors.append(error)
+
+    workers = [threading.Thread(target=attempt) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert results.count(True) == 1
+    with app.app_context():
+        assert Table.query.get(table_id).status == 'unavailable'
+
+
+def test_floor_streams_are_capped_per_worker(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'FLOOR_STREAMS_PER_WORKER', 2)
+    client = app.test_client()
+    # the first visit sets up and logs in the owner account
+    client.get('/')
+
+    first, second = client.get('/floor/stream', buffered=False), client.get('/floor/stream', buffered=False)
+    turned_away = client.get('/floor/stream', buffered=False)
+    assert (first.status_code, second.status_code, turned_away.status_code) == (200, 200, 503)
+    assert turned_away.headers['Retry-After']
+
+    # in the test client, streams hold request contexts that must be closed last opened, first closed
+    second.close()
+    first.close()
+    assert streams.open == 0
+    again = client.get('/floor/stream', buffered=False)
+    assert again.status_code == 200
+    again.close()
@@ -0,0 +1,46 @@
+"""
+Order history (/order-history): closed and cancelled orders, filtered by server, table, status and date
+"""
+import orders
+from floor import board
+from tables import db, Table
+
+
+def close_order(name, table, user_id=1):
+    order = orders.start(table, name, user_id)
+    orders.add_item(order, 1, 1, '', [])
+    orders.submit(order)
+    orders.close(order)
+    db.session.commit()
+
+
+def test_filters_by_server_and_table(app, client):
+    with app.app_context():
+        db.session.add(Table(name='Table 1', status='available'))
+        db.session.commit()
+        close_order('AtTheTable', board.find('Table 1'))
+        close_order('ToGo', board.find('Take Out'))
+        table_id = board.find('Table 1')['id']
+
+    page = client.get(f'/order-history?table={table_id}').data
+    assert b'AtTheTable' in page and b'ToGo' not in page
+    assert f'<option value="{table_id}" selected'.encode() in page
+
+    assert b'No orders found' in client.get('/order-history?server=2').data
+    assert b'ToGo' in client.get('/order-history?server=1').data
+
+
+def test_ids_that_are_not_numbers_are_ignored(app, client):
+    with app.app_context():
+        close_order('Anyone', board.find('Take Out'))
+    for query in ['server=abc', 'table=1.5', 'server=&table=']:
+        response = client.get(f'/order-history?{query}')
+        assert response.status_code == 200
+        assert b'Anyone' in response.data
+
+
+def test_table_ids_are_compared_as_numbers(app, client):
+    with app.app_context():
+        close_order('Takeaway', board.find('Take Out'))
+        take_out_id = Table.query.filter_by(name='Take Out').first().id
+    assert b'Takeaway' in client.get(f'/order-history?table=0{take_out_id}').data
@@ -0,0 +1,78 @@
+"""
+Background jobs (jobs.py): however many workers poll the table, each job is claimed by one of them, and failing or
+abandoned jobs are retried a limited number of times
+"""
+import threading
+
+import jobs
+from tables import db, Job
+
+
+def queue(app, name, payload=None, **options):
+    with app.app_context():
+        queued = jobs.enqueue(name, payload, **options)
+        db.session.commit()
+        return queued
+
+
+def test_concurrent_workers_claim_a_job_once(app):
+    queue(app, 'noop')
+    workers = 12
+    start = threading.Barrier(workers)
+    claimed, errors = [], []
+
+    def claim(number):
+        with app.app_context():
+            start.wait()
+            try:
+                job = jobs.claim(f'worker-{number}')
+                if job:
+                    claimed.append((job.id, job.worker))
+            except Exception as error:
+                errors.append(error)
+
+    threads = [threading.Thread(target=claim, args=(number,)) for number in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(claimed) == 1
+    with app.app_context():
+        job = Job.query.one()
+        assert (job.status, job.worker, job.attempts) == ('running', claimed[0][1], 1)
+
+
+def test_a_keyed_job_is_queued_once(app):
+    assert queue(app, 'noop', key='once')
+    assert not queue(app, 'noop', key='once')
+    assert queue(app, 'noop', {'a': 1}, coalesce=True)
+    assert not queue(app, 'noop', {'a': 1}, coalesce=True)
+    with app.app_context():
+        assert Job.query.count() == 2
+
+
+def test_a_failing_job_is_retried_then_failed(app, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, 'broken', lambda: 1 / 0)
+    monkeypatch.setattr(jobs, 'RETRY_SECONDS', 0)
+    queue(app, 'broken')
+    with app.app_context():
+        outcomes = [jobs.run(jobs.claim('worker')) for _ in range(jobs.MAX_ATTEMPTS)]
+        assert outcomes == [False] * jobs.MAX_ATTEMPTS
+        job = Job.query.one()
+        assert (job.status, job.attempts) == ('failed', jobs.MAX_ATTEMPTS)
+        assert 'ZeroDivisionError' in job.result
+        assert jobs.claim('worker') is None
+
+
+def test_a_job_whose_worker_died_is_queued_again(app, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, 'noop', lambda: 'ok')
+    queue(app, 'noop')
+    with app.app_context():
+        abandoned = jobs.claim('dead-worker').id
+        jobs.requeue_stale(timeout=-1)
+        job = jobs.claim('live-worker')
+        assert job.id == abandoned
+        assert jobs.run(job)
+        assert (Job.query.get(abandoned).status, Job.query.get(abandoned).attempts) == ('done', 2)
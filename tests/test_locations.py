@@ -0,0 +1,83 @@
+"""
+Several locations in one deployment (locations.py): each request works on its own location's database
+"""
+import pytest
+
+import main
+from tables import Order, MenuItem
+from locations import at_location
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('LOCATIONS', 'downtown,airport')
+    monkeypatch.setenv('LOCATION_DB_URL', f"sqlite:///{tmp_path}/{{location}}.db")
+    monkeypatch.setenv('LOCATION_DOMAIN', 'pos.test')
+    monkeypatch.delenv('LOCATION', raising=False)
+    app = main.create_app({'TESTING': True, 'WTF_CSRF_ENABLED': False})
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    return app
+
+
+def at(app, location):
+    client = app.test_client()
+    client.environ_base['HTTP_X_LOCATION'] = location
+    return client
+
+
+def count(app, location, model):
+    with app.app_context(), at_location(location):
+        return model.query.count()
+
+
+def test_init_db_sets_up_every_location(app):
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert 'downtown: Tables ready' in result.output and 'airport: Tables ready' in result.output
+
+
+def test_requests_work_on_their_own_location(app):
+    downtown = at(app, 'downtown')
+    downtown.get('/')
+    downtown.get('/import-data')
+    downtown.post('/start-order', data={'table': 'Take Out', 'name': 'Kim'})
+
+    assert count(app, 'downtown', Order) == 1
+    assert count(app, 'airport', Order) == 0
+    assert count(app, 'airport', MenuItem) == 0
+    assert downtown.get('/menu/search?q=makgeolli').json['results']
+    airport = at(app, 'airport')
+    airport.get('/')
+    assert airport.get('/menu/search?q=makgeolli').json['results'] == []
+
+
+def test_the_location_can_come_from_the_host(app):
+    response = app.test_client().get('/login', base_url='http://airport.pos.test')
+    assert response.status_code == 200
+
+
+def test_unknown_locations_are_not_found(app):
+    assert at(app, 'nowhere').get('/login').status_code == 404
+    assert app.test_client().get('/login').status_code == 404
+
+
+def test_a_login_only_counts_where_it_was_made(app):
+    downtown = at(app, 'downtown')
+    downtown.get('/')
+    assert downtown.get('/orders').status_code == 200
+    with downtown.session_transaction() as session:
+        cookie = dict(session)
+    airport = at(app, 'airport')
+    with airport.session_transaction() as session:
+        session.update(cookie)
+    assert airport.get('/orders').status_code == 401
+
+
+def test_commands_need_a_location(app, monkeypatch):
+    result = app.test_cli_runner().invoke(args=['verify-totals'])
+    assert result.exit_code != 0
+    assert 'LOCATION' in str(result.exception)
+
+    monkeypatch.setitem(app.config, 'LOCATION', 'airport')
+    result = app.test_cli_runner().invoke(args=['verify-totals'])
+    assert result.exit_code == 0, result.output
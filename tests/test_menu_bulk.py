@@ -0,0 +1,53 @@
+"""
+POST /menu/bulk (menu_bulk.py): a batch is applied whole or not at all, and a bad operation is a 422, never a 500
+"""
+import pytest
+
+from tables import MenuItem, Category
+
+
+def bulk(client, *operations):
+    return client.post('/menu/bulk', json={'operations': list(operations)})
+
+
+def prices(app, category):
+    with app.app_context():
+        category_id = Category.query.filter_by(name=category).first().id
+        return {item.id: item.price for item in MenuItem.query.filter_by(category_id=category_id)}
+
+
+def test_reprice_and_status_in_one_batch(app, client):
+    before = prices(app, 'DRINKS')
+    response = bulk(client, {'op': 'reprice', 'percent': 50, 'category': 'drinks'},
+                    {'op': 'status', 'status': 'inactive', 'items': [min(before)]})
+    assert response.status_code == 200
+    assert response.json['results'] == [{'op': 'reprice', 'items': len(before)}, {'op': 'status', 'items': 1}]
+    # SQLite rounds halves away from zero
+    assert prices(app, 'DRINKS') == {item_id: max(1, int(price * 1.5 + 0.5)) for item_id, price in before.items()}
+    with app.app_context():
+        assert MenuItem.query.get(min(before)).status == 'inactive'
+
+
+def test_a_bad_operation_rolls_back_the_whole_batch(app, client):
+    before = prices(app, 'DRINKS')
+    response = bulk(client, {'op': 'reprice', 'percent': 10, 'category': 'DRINKS'},
+                    {'op': 'move', 'to_section': 'Nowhere', 'items': [1]})
+    assert response.status_code == 422
+    assert response.json['error'].startswith('operation 1:')
+    assert prices(app, 'DRINKS') == before
+
+
+@pytest.mark.parametrize('operation', [
+    {'op': 'reprice', 'percent': 10, 'category': 5},
+    {'op': 'reprice', 'percent': 10, 'section': ['Tea']},
+    {'op': 'reprice', 'percent': 10, 'section': 'Tea', 'category': {'name': 'DRINKS'}},
+    {'op': 'move', 'to_section': 7, 'items': [1]},
+    {'op': 'status', 'status': 'inactive', 'items': [True]},
+    {'op': 'status', 'status': 'inactive', 'items': 3},
+    {'op': 'reprice', 'percent': float('nan'), 'items': [1]},
+    {'op': 'reprice', 'percent': True, 'items': [1]},
+    {'op': 'reprice', 'percent': 10},
+    {'op': 'rename', 'items': [1]},
+])
+def test_invalid_operations_are_rejected(client, operation):
+    assert bulk(client, operation).status_code == 422
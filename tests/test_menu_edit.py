@@ -0,0 +1,73 @@
+"""
+Menu item edits (menu_edit.py): only the differences between the form and the item are written, and mods are shared
+between items with the same name and vars
+"""
+import main
+from menu_edit import load_item, plan_edit, apply_edit
+from tables import db, ItemMod, mod__var
+
+
+def form_for(item):
+    """
+    The edit form as it is first shown for item: three mod slots
+    """
+    data = {'name': item.name, 'price': str(item.price), 'category': item.category.name,
+            'section': item.section.name, 'description': item.description}
+    mods = [mod for mod in item.mods if mod.name]
+    for i in range(1, 4):
+        mod = mods[i - 1] if i <= len(mods) else None
+        data[f'mod{i}'] = mod.name if mod else ''
+        data[f'vars{i}'] = ', '.join(var.name for var in mod.vars) if mod else ''
+    return data
+
+
+def edit(item_id, **changes):
+    _, categories, sections = main.menu_create()
+    item = load_item(item_id)
+    plan = plan_edit(item, {**form_for(item), **changes}, categories, sections)
+    apply_edit(item, plan)
+    db.session.commit()
+    return plan
+
+
+def mods_of(item_id):
+    return {mod.name: sorted(var.name for var in mod.vars) for mod in load_item(item_id).mods}
+
+
+def test_an_unchanged_form_changes_nothing(app, client):
+    with app.app_context():
+        assert not edit(4).changed
+
+
+def test_only_changed_fields_are_written(app, client):
+    with app.app_context():
+        plan = edit(4, price='6', vars3='Matcha, taro')
+        assert (plan.fields, plan.add_mods, plan.remove_mod_ids) == ({'price': 6}, [], [])
+        assert load_item(4).price == 6
+
+
+def test_changing_a_shared_mod_leaves_the_other_items_alone(app, client):
+    with app.app_context():
+        shared = [mod.id for mod in load_item(1).mods if mod.name == 'Sweetness'][0]
+        edit(1, vars1='Unsweet, Sweet')
+        assert mods_of(1)['Sweetness'] == ['Sweet', 'Unsweet']
+        assert mods_of(2)['Sweetness'] == ['Lightly Sweet', 'Sweet', 'Unsweet', 'Very Sweet']
+        assert ItemMod.query.get(shared) is not None
+
+
+def test_a_mod_matching_an_existing_one_is_reused(app, client):
+    with app.app_context():
+        mods_before = ItemMod.query.count()
+        edit(5, mod1='sweetness', vars1='Very Sweet,Sweet, Lightly Sweet, Unsweet')
+        assert ItemMod.query.count() == mods_before
+        assert [mod.id for mod in load_item(5).mods if mod.name == 'Sweetness'] == \
+            [mod.id for mod in load_item(2).mods if mod.name == 'Sweetness']
+
+
+def test_a_mod_left_without_items_is_deleted(app, client):
+    with app.app_context():
+        toppings = [mod.id for mod in load_item(4).mods if mod.name == 'Toppings'][0]
+        edit(4, mod2='', vars2='')
+        assert 'Toppings' not in mods_of(4)
+        assert ItemMod.query.get(toppings) is None
+        assert db.session.query(mod__var).filter(mod__var.c.mod_id == toppings).count() == 0
@@ -0,0 +1,40 @@
+"""
+Type-ahead over the menu (menu_search.py): menu edits are picked up, and a rebuild never holds up other searches
+"""
+from menu_search import MenuIndex
+from tables import db, MenuItem
+from versions import bump
+
+
+def test_edits_are_picked_up(app, client):
+    with app.app_context():
+        index = MenuIndex()
+        index.refresh()
+        assert index.search('affogato') == []
+
+        item = MenuItem.query.get(1)
+        item.name = 'Matcha Affogato'
+        bump('menu')
+        db.session.commit()
+        index.expire()
+        index.refresh()
+        assert [found['id'] for found in index.search('afogato')] == [1]
+
+
+def test_searches_use_the_current_index_while_another_request_rebuilds(app, client):
+    with app.app_context():
+        index = MenuIndex()
+        index.refresh()
+        before = index.search('a', 50)
+        assert before
+
+        MenuItem.query.filter_by(id=1).update({'status': 'inactive'})
+        bump('menu')
+        db.session.commit()
+        index.expire()
+        # as if another request were in the middle of rebuilding: this one doesn't wait for it
+        with index._refreshing:
+            index.refresh()
+            assert index.search('a', 50) == before
+        index.refresh()
+        assert 1 not in [found['id'] for found in index.search('a', 50)]
@@ -0,0 +1,105 @@
+"""
+Order.total and Order.item_count are kept in step with order_item by orders.py, and never decide on their own
+whether an order is deleted
+"""
+import threading
+
+import main
+import orders
+from floor import board
+from tables import db, Order, OrderItem, MenuItem
+
+
+def stored_and_actual(order_id):
+    order = Order.query.get(order_id)
+    items = OrderItem.query.filter_by(order_id=order_id).all()
+    return (order.total, order.item_count), (sum(item.subtotal for item in items), sum(item.quantity for item in items))
+
+
+def start_order(name='Guest'):
+    order = orders.start(board.find('Take Out'), name, 1)
+    db.session.commit()
+    return order
+
+
+def test_totals_follow_add_merge_and_remove(app, client):
+    with app.app_context():
+        order = start_order()
+        price = MenuItem.query.get(1).price
+
+        orders.add_item(order, 1, 2, '', [])
+        db.session.commit()
+        assert (order.total, order.item_count) == (2 * price, 2)
+
+        # the same item with the same notes goes onto the existing line
+        merged = orders.add_item(order, 1, 1, '', [])
+        db.session.commit()
+        assert merged.quantity == 3
+        assert OrderItem.query.filter_by(order_id=order.id).count() == 1
+        assert (order.total, order.item_count) == (3 * price, 3)
+
+        other = orders.add_item(order, 2, 1, 'no ice', [])
+        db.session.commit()
+        stored, actual = stored_and_actual(order.id)
+        assert stored == actual
+
+        orders.remove_item(other)
+        orders.remove_item(merged)
+        db.session.commit()
+        assert stored_and_actual(order.id) == ((0, 0), (0, 0))
+
+
+def test_concurrent_edits_keep_totals(app, client):
+    with app.app_context():
+        order_id = start_order().id
+
+    threads = 8
+    start = threading.Barrier(threads)
+    errors = []
+
+    def add(item_id):
+        with app.app_context():
+            start.wait()
+            try:
+                orders.add_item(Order.query.get(order_id), item_id, 2, '', [])
+                db.session.commit()
+            except Exception as error:
+                db.session.rollback()
+                errors.append(error)
+
+    # half the threads add the same item, so they race to merge into one line
+    workers = [threading.Thread(target=add, args=(1 if number % 2 else number + 2,)) for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    with app.app_context():
+        stored, actual = stored_and_actual(order_id)
+        assert stored == actual
+        assert stored[1] == 2 * threads
+        assert main.order_total_drift() == []
+
+
+def test_a_wrong_item_count_never_deletes_an_order(app, client):
+    with app.app_context():
+        order = start_order()
+        orders.add_item(order, 1, 1, '', [])
+        # as if the count had never been filled in
+        order.item_count = 0
+        db.session.commit()
+
+        assert orders.submit(order)
+        orders.cancel(order)
+        db.session.commit()
+        assert Order.query.get(order.id).status == 'cancelled'
+        assert OrderItem.query.filter_by(order_id=order.id).count() == 1
+
+
+def test_cancelling_an_empty_order_deletes_it(app, client):
+    with app.app_context():
+        order_id = start_order().id
+        orders.cancel(Order.query.get(order_id))
+        db.session.commit()
+        assert Order.query.get(order_id) is None
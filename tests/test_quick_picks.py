@@ -0,0 +1,47 @@
+"""
+Quick picks on the order screen (quick_picks.py): a new list reaches tablets that revalidate the page
+"""
+import quick_picks as quick_picks_module
+from quick_picks import quick_picks
+from tables import db, PopularityRollup
+
+
+def popular(app, daypart, *item_ids):
+    with app.app_context():
+        db.session.add_all([PopularityRollup(user_id=1, daypart=daypart, item_id=item_id, quantity=10 - rank)
+                            for rank, item_id in enumerate(item_ids)])
+        db.session.commit()
+
+
+def order_screen(client):
+    client.post('/start-order', data={'table': 'Take Out', 'name': 'Guest'})
+    # the first visit shows the pending flash messages, and pages with messages get no ETag
+    client.get('/complete-order')
+    return client.get('/complete-order')
+
+
+def revalidate(client, etag):
+    return client.get('/complete-order', headers={'If-None-Match': etag})
+
+
+def test_new_picks_change_the_etag(app, client, monkeypatch):
+    monkeypatch.setattr(quick_picks_module, 'daypart_of', lambda hour: 'lunch')
+    etag = order_screen(client).headers['ETag']
+    assert revalidate(client, etag).status_code == 304
+
+    # the cached list is due for a refresh and the rollups have moved
+    popular(app, 'lunch', 3, 1)
+    quick_picks.clear()
+    response = revalidate(client, etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_the_next_daypart_changes_the_etag(app, client, monkeypatch):
+    popular(app, 'lunch', 1, 2)
+    popular(app, 'dinner', 4, 5)
+    monkeypatch.setattr(quick_picks_module, 'daypart_of', lambda hour: 'lunch')
+    etag = order_screen(client).headers['ETag']
+
+    monkeypatch.setattr(quick_picks_module, 'daypart_of', lambda hour: 'dinner')
+    assert revalidate(client, etag).status_code == 200
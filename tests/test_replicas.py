@@ -0,0 +1,60 @@
+"""
+Read replica (replicas.py): @read_replica views read from the replica, except just after the user wrote something
+"""
+import pytest
+
+from replicas import REPLICA, refresh_replica
+from tables import db, MenuItem, Category
+
+
+@pytest.fixture
+def environment(tmp_path):
+    return {'DB_READ_URL': f"sqlite:///{tmp_path / 'replica.db'}"}
+
+
+def copy_to_replica(app):
+    with app.app_context():
+        refresh_replica(db.engine, db.get_engine(bind=REPLICA))
+
+
+def forget_writes(client):
+    with client.session_transaction() as session:
+        session['wrote_at'] = 0
+
+
+def submit_order(client, name):
+    client.post('/start-order', data={'table': 'Take Out', 'name': name})
+    order_page = client.post('/complete-order', data={'item_id': 1, 'quantity': 1, 'notes': '',
+                                                      'mod1': 'null', 'mod2': 'null', 'mod3': 'null'})
+    client.get(order_page.location.replace('/complete-order', '/submit-order'))
+
+
+def test_a_user_reads_their_own_writes(app, client):
+    copy_to_replica(app)
+    submit_order(client, 'Fresh')
+    assert b'Fresh' in client.get('/orders').data
+
+    # once the window is over, the lagging replica answers
+    forget_writes(client)
+    assert b'Fresh' not in client.get('/orders').data
+    copy_to_replica(app)
+    assert b'Fresh' in client.get('/orders').data
+
+
+def test_menu_details_come_from_the_primary(app, client):
+    copy_to_replica(app)
+    with app.app_context():
+        category = Category(name='SPECIALS')
+        item = MenuItem(name='New Special', price=9, status='active', category=category)
+        db.session.add(item)
+        db.session.commit()
+        item_id = item.id
+    forget_writes(client)
+
+    assert client.get(f'/details/item/{item_id}').json['name'] == 'New Special'
+    assert client.get('/details/category/SPECIALS').json['name'] == 'SPECIALS'
+
+
+def test_missing_menu_details_are_not_found(client):
+    assert client.get('/details/item/9999').status_code == 404
+    assert client.get('/details/category/NOPE').status_code == 404
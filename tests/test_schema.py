@@ -0,0 +1,40 @@
+"""
+`flask init-db` brings an existing database up to the models (tables.upgrade_schema)
+"""
+from sqlalchemy import text
+
+import orders
+from floor import board
+from tables import db, Order, OrderItem, upgrade_schema
+
+
+def test_added_order_totals_are_filled_in_from_order_items(app, client):
+    with app.app_context():
+        take_out = board.find('Take Out')
+        old = orders.start(take_out, 'Old', 1)
+        orders.add_item(old, 1, 2, '', [])
+        orders.add_item(old, 2, 1, '', [])
+        orders.start(take_out, 'Empty', 1)
+        db.session.commit()
+
+        # the order table as it was before the totals were denormalized
+        db.session.execute(text('ALTER TABLE "order" DROP COLUMN total'))
+        db.session.execute(text('ALTER TABLE "order" DROP COLUMN item_count'))
+        db.session.commit()
+
+        changes = upgrade_schema()
+        db.session.commit()
+
+        assert {'order.total', 'order.item_count'} <= set(changes)
+        expected = {order_id: (subtotal, quantity) for order_id, subtotal, quantity in db.session.query(
+            OrderItem.order_id, db.func.sum(OrderItem.subtotal), db.func.sum(OrderItem.quantity)
+        ).group_by(OrderItem.order_id)}
+        by_name = {order.customer_name: order for order in Order.query}
+        assert (by_name['Old'].total, by_name['Old'].item_count) == expected[by_name['Old'].id]
+        assert by_name['Old'].item_count == 3
+        assert (by_name['Empty'].total, by_name['Empty'].item_count) == (0, 0)
+
+
+def test_upgrade_schema_leaves_an_up_to_date_database_alone(app):
+    with app.app_context():
+        assert upgrade_schema() == []
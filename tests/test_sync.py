@@ -0,0 +1,88 @@
+"""
+POST /sync (sync.py): a batch of offline operations is applied once, however often it is sent, and a bad operation is
+a 422 naming it, never a 500
+"""
+import pytest
+
+from tables import db, Order, OrderItem
+
+
+def sync(client, *operations):
+    return client.post('/sync', json={'operations': list(operations)})
+
+
+def order_count(app):
+    with app.app_context():
+        return Order.query.count()
+
+
+BATCH = [
+    {'key': 'k1', 'op': 'start', 'table': 'Take Out', 'customer_name': 'Kim'},
+    {'key': 'k2', 'op': 'add_item', 'order_key': 'k1', 'item_id': 1, 'quantity': 2},
+    {'key': 'k3', 'op': 'submit', 'order_key': 'k1'},
+]
+
+
+def test_a_batch_is_applied_in_order(app, client):
+    response = sync(client, *BATCH)
+    assert response.status_code == 200
+    results = response.json['results']
+    assert [result['duplicate'] for result in results] == [False, False, False]
+    with app.app_context():
+        order = Order.query.get(results[0]['order_id'])
+        assert (order.customer_name, order.status, order.item_count) == ('Kim', 'submitted', 2)
+
+
+def test_a_key_repeated_within_a_batch_is_applied_once(app, client):
+    add = {'key': 'k2', 'op': 'add_item', 'order_key': 'k1', 'item_id': 1, 'quantity': 2}
+    response = sync(client, BATCH[0], add, add)
+    assert [result['duplicate'] for result in response.json['results']] == [False, False, True]
+    with app.app_context():
+        assert db.session.query(db.func.sum(OrderItem.quantity)).scalar() == 2
+
+
+def test_a_resent_batch_is_answered_from_the_first_time(app, client):
+    first = sync(client, *BATCH).json['results']
+    again = sync(client, *BATCH)
+    assert again.status_code == 200
+    assert again.json['results'] == [{**result, 'duplicate': True} for result in first]
+    assert order_count(app) == 1
+
+
+def test_keys_belong_to_the_user_that_sent_them(app, log_in_server):
+    kim, lee = log_in_server('Kim'), log_in_server('Lee')
+    kims = sync(kim, *BATCH)
+    lees = sync(lee, *BATCH)
+    assert (kims.status_code, lees.status_code) == (200, 200)
+    assert not any(result['duplicate'] for result in lees.json['results'])
+    assert kims.json['results'][0]['order_id'] != lees.json['results'][0]['order_id']
+    assert order_count(app) == 2
+
+
+def test_a_user_can_not_reach_another_users_order(app, log_in_server):
+    kim, lee = log_in_server('Kim'), log_in_server('Lee')
+    order_id = sync(kim, *BATCH[:2]).json['results'][0]['order_id']
+    response = sync(lee, {'key': 'x', 'op': 'cancel', 'order_id': order_id})
+    assert response.status_code == 422
+    assert response.json['error'] == 'order not found'
+
+
+@pytest.mark.parametrize('change', [
+    {'quantity': True},
+    {'quantity': 0},
+    {'quantity': '2'},
+    {'item_id': True},
+    {'item_id': 'one'},
+    {'notes': 5},
+    {'notes': 'x' * 201},
+    {'vars': 'Sweet'},
+    {'vars': [1, 2]},
+    {'vars': [None]},
+    {'order_key': None, 'order_id': True},
+])
+def test_bad_add_item_operations_are_rejected(app, client, change):
+    response = sync(client, BATCH[0], {**BATCH[1], **change})
+    assert response.status_code == 422
+    assert (response.json['index'], response.json['key']) == (1, 'k2')
+    # the batch is rolled back whole
+    assert order_count(app) == 0
@@ -0,0 +1,107 @@
+# ---------------------------------------------------------------------------------------------------------------------
+#  PAGE VERSIONS & CONDITIONAL GET
+#  Most pages are index.html with the whole menu inlined, and only change when the menu or an order changes. Code that
+#  changes either calls bump() inside its transaction, and views decorated with @conditional('menu', 'orders') send an
+#  ETag and Last-Modified built from those counters. A tablet revalidating an unchanged page gets a 304 before the view
+#  runs: no menu queries, no rendering, no body.
+# ---------------------------------------------------------------------------------------------------------------------
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from tables import db, Version
+from locations import current_location
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+import os
+import time
+
+VERSIONS = ['menu', 'orders']
+
+_build = None
+
+
+def bump(*names):
+    """
+    adds one to each counter, without committing
+    """
+    changed_at = time.time()
+    for name in names:
+        updated = Version.query.filter_by(name=name) \
+            .update({'value': Version.value + 1, 'changed_at': changed_at}, synchronize_session=False)
+        if not updated:
+            db.session.add(Version(name=name, value=1, changed_at=changed_at))
+
+
+def ensure_versions():
+    """
+    creates the counters that don't exist yet, so bump() never races to insert them
+    """
+    existing = [version.name for version in Version.query.all()]
+    db.session.add_all([Version(name=name, value=0, changed_at=time.time())
+                        for name in VERSIONS if name not in existing])
+
+
+def build_id():
+    """
+    newest modification time under templates/ and static/, so a deploy changes every ETag
+    """
+    global _build
+    if _build is None:
+        folders = [os.path.join(current_app.root_path, current_app.template_folder), current_app.static_folder]
+        _build = max(os.path.getmtime(os.path.join(root, name))
+                     for folder in folders for root, _, names in os.walk(folder) for name in names)
+    return _build
+
+
+def page_validators(versions: list, extra: tuple = None):
+    """
+    ETag and Last-Modified of the current request's page.
+    Besides the counters, the page depends on the location, on who is asking and on the CSRF token rendered into its
+    forms. The token is signed with a timestamp, so the ETag also changes every half WTF_CSRF_TIME_LIMIT: a page
+    answered with a 304 never carries a token older than the limit.
+    extra: (value, changed_at) for anything else on the page that the counters don't follow.
+    """
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    window = int(time.time() // (time_limit / 2)) if time_limit else 0
+    key = [build_id(), current_location(), request.full_path, current_user.get_id(), session.get('csrf_token'),
+           window] \
+        + [(version.name, version.value, version.changed_at) for version in versions] + [extra and extra[0]]
+    etag = hashlib.sha1(repr(key).encode()).hexdigest()
+    changed_at = max([version.changed_at for version in versions] + [window * time_limit / 2]
+                     + [extra[1] if extra else 0])
+    return etag, datetime.fromtimestamp(int(changed_at), timezone.utc)
+
+
+def conditional(*names, extra=None):
+    """
+    Decorator for GET views whose page only changes with the named counters, and with what extra() returns as
+    (value, changed_at) when the page shows more than that.
+    Pages with pending flash messages are always rendered, and never get an ETag.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return function(*args, **kwargs)
+            etag, last_modified = page_validators(Version.query.filter(Version.name.in_(names)).all(),
+                                                  extra() if extra else None)
+
+            if request.if_none_match:
+                unchanged = request.if_none_match.contains_weak(etag)
+            else:
+                unchanged = request.if_modified_since is not None and last_modified <= request.if_modified_since
+            if unchanged:
+                response = make_response('', 304)
+            else:
+                response = make_response(function(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator